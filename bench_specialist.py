@@ -0,0 +1,364 @@
+"""Benchmarks for the Specialist command-line tool.
+
+Run with `python bench_specialist.py [NAME ...]`.
+"""
+import collections
+import dis
+import itertools
+import pathlib
+import runpy
+import subprocess
+import sys
+import tempfile
+import timeit
+import types
+import typing
+
+from specialist import analysis, cache, common, core, utils
+from specialist.instructions import (
+    classify_code,
+    classify_instruction,
+    score_instruction,
+)
+from specialist.stats import SourceChunk, Stats
+
+FUNCTIONS = 1000
+
+
+def _generate_source(functions: int = FUNCTIONS) -> str:
+    """Generate a large module with a mix of (un)specializable code."""
+    lines = ["import math", ""]
+    for i in range(functions):
+        operand = ("2", "2.0", "y")[i % 3]
+        lines += [
+            f"def f{i}(x, y):",
+            f'    """Compute the {i}th value (on a toy workload)."""',
+            "    # Accumulate, with a mix of int and float operands:",
+            "    s = 0",
+            "    for k in range(x):",
+            f"        s += k * {operand} - (y if k % 3 else {i})",
+            f"    return [math.floor(s), str(s)[0], (x, y)]",
+            "",
+        ]
+    for i in range(functions):
+        lines.append(f"f{i}(20, {('1', '1.5')[i % 2]})")
+    return "\n".join(lines) + "\n"
+
+
+def _quickened_code(source: str) -> types.CodeType:
+    """Compile and run some source, so that its code gets quickened."""
+    code = compile(source, "<bench>", "exec")
+    exec(code, {"__name__": "<bench>"})
+    return code
+
+
+def _parse_reference(code: types.CodeType) -> typing.Iterator[SourceChunk]:
+    """The original defaultdict-of-Stats implementation of core._parse."""
+    events: collections.defaultdict[tuple[int, int], Stats] = collections.defaultdict(
+        Stats
+    )
+    events[core.FIRST_POSTION] = Stats()
+    events[core.LAST_POSITION] = Stats()
+    previous = None
+    for child in common.walk_code(code):
+        fixed_positions = list(child.co_positions())
+        for instruction in dis.get_instructions(child, adaptive=True):
+            lineno, end_lineno, col_offset, end_col_offset = fixed_positions[
+                instruction.offset // 2
+            ]
+            if (
+                lineno is None
+                or end_lineno is None
+                or col_offset is None
+                or end_col_offset is None
+            ):
+                previous = instruction
+                continue
+            stats = score_instruction(instruction, previous)
+            events[lineno, col_offset] += stats
+            events[end_lineno, end_col_offset] -= stats
+            previous = instruction
+    stats = Stats()
+    for (start, event), (stop, _) in itertools.pairwise(sorted(events.items())):
+        stats += event
+        yield SourceChunk(start, stop, stats)
+
+
+def _read_reference(
+    path: pathlib.Path, chunks: typing.Iterable[SourceChunk]
+) -> typing.Iterator[typing.Tuple[str, Stats]]:
+    """The original byte-at-a-time implementation of core._read."""
+    parser = iter(chunks)
+    chunk = next(parser)
+    group = bytearray()
+    with path.open("rb") as file:
+        for lineno, line in enumerate(file, 1):
+            for col_offset, character in enumerate(line):
+                if chunk.stop == (lineno, col_offset):
+                    yield group.decode("utf-8"), chunk.stats
+                    group.clear()
+                    chunk = next(parser)
+                group.append(character)
+    yield group.decode("utf-8"), chunk.stats
+
+
+def _report(name: str, timings: typing.Dict[str, float]) -> None:
+    baseline, *_ = timings.values()
+    print(f"{name}:")
+    for label, seconds in timings.items():
+        print(f"  {label:>12}: {seconds * 1000:9.2f} ms ({baseline / seconds:5.2f}x)")
+
+
+def _best(function: typing.Callable[[], object], number: int = 5) -> float:
+    return min(timeit.repeat(function, number=1, repeat=number))
+
+
+def bench_parse() -> None:
+    """core._parse vs. the original implementation."""
+    code = _quickened_code(_generate_source())
+    assert list(core._parse(code)) == list(_parse_reference(code))
+    _report(
+        "parse",
+        {
+            "reference": _best(lambda: list(_parse_reference(code))),
+            "core._parse": _best(lambda: list(core._parse(code))),
+        },
+    )
+
+
+def bench_classify() -> None:
+    """instructions.classify_code vs. dis.get_instructions."""
+    children = list(common.walk_code(_quickened_code(_generate_source())))
+
+    def reference() -> None:
+        for child in children:
+            previous = None
+            for instruction in dis.get_instructions(child, adaptive=True):
+                classify_instruction(instruction, previous)
+                previous = instruction
+
+    def scanner() -> None:
+        for child in children:
+            for _ in classify_code(child):
+                pass
+
+    _report("classify", {"dis": _best(reference), "classify_code": _best(scanner)})
+
+
+def bench_read() -> None:
+    """core._split vs. the original core._read loop."""
+    source = _generate_source()
+    chunks = list(core._parse(_quickened_code(source)))
+    with tempfile.TemporaryDirectory() as work:
+        path = pathlib.Path(work) / "bench.py"
+        path.write_text(source)
+        data = path.read_bytes()
+        assert list(core._split(data, chunks)) == list(_read_reference(path, chunks))
+        _report(
+            "read",
+            {
+                "reference": _best(lambda: list(_read_reference(path, chunks))),
+                "core._split": _best(lambda: list(core._split(data, chunks))),
+            },
+        )
+
+
+def bench_analyzer() -> None:
+    """analysis.Analyzer.update vs. core._read, with nothing re-quickened."""
+    source = _generate_source()
+    with tempfile.TemporaryDirectory() as work:
+        path = pathlib.Path(work) / "bench.py"
+        path.write_text(source)
+        code = compile(source, str(path), "exec")
+        exec(code, {"__name__": "<bench>"})
+        utils.register_code(code)
+        analyzer = analysis.Analyzer()
+        analyzer.update(path)
+        assert analyzer.results(path) == list(core._read(path))
+        _report(
+            "analyzer",
+            {
+                "core._read": _best(lambda: list(core._read(path))),
+                "Analyzer": _best(lambda: analyzer.update(path)),
+            },
+        )
+
+
+def bench_cache() -> None:
+    """Loading cached results vs. core._read (and recording them along the way)."""
+    source = _generate_source()
+    with tempfile.TemporaryDirectory() as work:
+        path = pathlib.Path(work) / "bench.py"
+        path.write_text(source)
+        code = compile(source, str(path), "exec")
+        exec(code, {"__name__": "<bench>"})
+        utils.register_code(code)
+        results = cache.ResultsCache(pathlib.Path(work) / "cache")
+        chunks = list(results.record(path, core._read(path)))
+        loaded = results.load(path)
+        assert loaded is not None and list(loaded) == chunks
+
+        def load() -> None:
+            loaded = results.load(path)
+            assert loaded is not None
+            for _ in loaded:
+                pass
+
+        _report(
+            "cache",
+            {
+                "core._read": _best(lambda: list(core._read(path))),
+                "record": _best(lambda: list(results.record(path, core._read(path)))),
+                "load": _best(load),
+            },
+        )
+
+
+def _analyze_code_reference(source: str) -> core.PathToResults:
+    """The original temporary-file implementation of core.analyze_code."""
+    with tempfile.TemporaryDirectory() as work:
+        path = pathlib.Path(work) / "__main__.py"
+        path.write_text(source)
+        with core._collect(None, None, path, []):
+            with utils.catch_exceptions() as caught:
+                runpy.run_path(str(path), run_name="__main__")
+        results = core._process_analysis(path, [], caught)
+        return {p: list(r) for p, r in results.items()}
+
+
+def bench_analyze_code() -> None:
+    """core.analyze_code (in memory) vs. running from a temporary file."""
+    snippets = [_generate_source(functions=i % 5 + 1) for i in range(100)]
+
+    def analyze(function: typing.Callable[[str], core.PathToResults]) -> None:
+        for snippet in snippets:
+            function(snippet)
+
+    reference, *_ = _analyze_code_reference(snippets[0]).values()
+    in_memory, *_ = core.analyze_code(snippets[0], targets=[]).values()
+    assert reference == in_memory
+    _report(
+        "analyze_code",
+        {
+            "reference": _best(lambda: analyze(_analyze_code_reference)),
+            "in memory": _best(
+                lambda: analyze(lambda s: core.analyze_code(s, targets=[]))
+            ),
+        },
+    )
+
+
+# Everything that importing specialist used to import eagerly:
+_EAGER_IMPORTS = [
+    "specialist.core",
+    "specialist.families",
+    "specialist.summary",
+    "specialist.writers",
+    "specialist.watch.monitor",
+    "concurrent.futures",
+    "http.server",
+    "multiprocessing",
+    "runpy",
+    "tempfile",
+    "webbrowser",
+]
+
+
+def _import_time(*modules: str) -> float:
+    """Time importing some modules in a fresh interpreter."""
+    statements = "; ".join(f"import {module}" for module in modules)
+    script = (
+        "import time; start = time.perf_counter(); "
+        f"{statements}; print(time.perf_counter() - start)"
+    )
+    root = str(pathlib.Path(__file__).resolve().parent)
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        check=True,
+        cwd=root,
+        text=True,
+    ).stdout
+    return float(output)
+
+
+def bench_import() -> None:
+    """import specialist vs. importing everything it used to pull in up front."""
+    imports = {
+        "eager": ["specialist", *_EAGER_IMPORTS],
+        "specialist": ["specialist"],
+        "core": ["specialist.core"],
+    }
+    _report(
+        "import",
+        {
+            label: min(_import_time(*modules) for _ in range(5))
+            for label, modules in imports.items()
+        },
+    )
+
+
+# The original audit hook, which every analysis added another copy of:
+_AUDIT_IMPORTS_REFERENCE = """
+import types
+from specialist.utils import register_code
+
+def audit_imports(event, args):
+    match event, args:
+        case "exec", [types.CodeType(co_name="<module>") as code]:
+            register_code(code)
+"""
+
+AUDIT_EVENTS = 1_000_000
+
+
+def _audit_time(setup: str) -> float:
+    """Time raising audit events (other than exec) in a fresh interpreter."""
+    script = (
+        f"import sys, time\n{setup}\nstart = time.perf_counter()\n"
+        f"for _ in range({AUDIT_EVENTS}):\n    sys.audit('spam', None)\n"
+        "print(time.perf_counter() - start)\n"
+    )
+    root = str(pathlib.Path(__file__).resolve().parent)
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        check=True,
+        cwd=root,
+        text=True,
+    ).stdout
+    return float(output)
+
+
+def bench_capture() -> None:
+    """utils.Capture's hook vs. the original (and its copies), per audit event."""
+    reference = _AUDIT_IMPORTS_REFERENCE + "sys.addaudithook(audit_imports)"
+    capture = "from specialist.utils import Capture"
+    setups = {
+        "reference": reference,
+        "reference x3": "\n".join([reference] * 3),
+        "stopped": f"{capture}\nwith Capture(['spam.py']):\n    pass",
+        "running": f"{capture}\nCapture(['spam.py']).start()",
+        "no hook": "",
+    }
+    _report(
+        "capture",
+        {
+            label: min(_audit_time(setup) for _ in range(5))
+            for label, setup in setups.items()
+        },
+    )
+
+
+def main(names: typing.Sequence[str]) -> None:
+    benchmarks = {
+        name.removeprefix("bench_"): function
+        for name, function in globals().items()
+        if name.startswith("bench_")
+    }
+    for name in names or benchmarks:
+        benchmarks[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
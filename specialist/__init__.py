@@ -1,18 +1,52 @@
 """Visualize CPython 3.11's specializing, adaptive interpreter."""
-import pathlib
+import importlib
 import sys
-import types
 import typing
 
 if sys.version_info < (3, 11) or sys.implementation.name != "cpython":
     raise RuntimeError("Specialist only supports CPython 3.11+!")
 
-CODE: typing.Set[types.CodeType] = set()
+from .registry import CodeRegistry
 
+# Every module-level code object that's been captured (see CodeRegistry):
+CODE = CodeRegistry()
 
-from .core import (
-    analyze_code as analyze_code,
-    analyze_file as analyze_file,
-    analyze_module as analyze_module,
-    watch as watch,
-)
+# The public API, and the modules it lives in. These are only imported once
+# they're first used (see __getattr__), so that importing specialist (which
+# spooled processes do at startup) stays cheap:
+_LAZY = {
+    "analyze_code": "core",
+    "analyze_file": "core",
+    "analyze_module": "core",
+    "watch": "core",
+    "analyze_families": "families",
+    "diff": "comparison",
+    "profile": "profiling",
+}
+
+if typing.TYPE_CHECKING:
+    from .core import (
+        analyze_code as analyze_code,
+        analyze_file as analyze_file,
+        analyze_module as analyze_module,
+        watch as watch,
+    )
+    from .comparison import diff as diff
+    from .families import analyze_families as analyze_families
+    from .profiling import profile as profile
+else:
+    # The watch function shares its name with the watch package, which would
+    # replace it here whenever the package is first imported. The package is
+    # cheap to import, so do that now (and then let __getattr__ find watch):
+    from . import watch
+
+    del watch
+
+
+def __getattr__(name: str) -> typing.Any:
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
@@ -1,16 +1,41 @@
 import pathlib
+import sys
 from shlex import quote
-from typing import Optional, Tuple
+from typing import Iterable, Optional, Tuple
 import click
 
+from specialist import CODE
+from specialist.binary import BinaryWriter
+from specialist.cache import DEFAULT_CACHE_DIR, ResultsCache
+from specialist.comparison import diff as do_diff
 from specialist.core import (
+    PathToResults,
     analyze_code,
     analyze_file,
     analyze_module,
+    check_index,
     view,
     watch as do_watch,
 )
-from specialist.watch import DEFAULT_WATCH_PORT
+from specialist.spool import Spool
+from specialist.summary import Index
+from specialist.timeline import (
+    DEFAULT_TIMELINE_CAPACITY,
+    DEFAULT_TIMELINE_INTERVAL,
+    Timeline,
+)
+from specialist.utils import main_file_for_module
+from specialist.writers import HTMLWriter, JSONWriter, VirtualHTMLWriter, Writer
+from specialist.watch import (
+    DEFAULT_WATCH_BUDGET,
+    DEFAULT_WATCH_BUFFER,
+    DEFAULT_WATCH_INTERVAL,
+    DEFAULT_WATCH_OVERFLOW,
+    DEFAULT_WATCH_PORT,
+    DEFAULT_WATCH_SERVER,
+)
+from specialist.watch.hub import OVERFLOW_POLICIES, OverflowPolicy
+from specialist.watch.monitor import SERVER_KINDS, ServerKind
 
 from ._mutex import mutex
 
@@ -20,6 +45,82 @@ def main():
     pass
 
 
+def _writer(report_format: str, virtual: bool, *, blue: bool, dark: bool) -> Writer:
+    if virtual and report_format != "html":
+        raise click.UsageError("--virtual only applies to HTML reports.")
+    if virtual:
+        return VirtualHTMLWriter(blue=blue, dark=dark)
+    if report_format == "json":
+        return JSONWriter()
+    if report_format == "binary":
+        return BinaryWriter()
+    return HTMLWriter(blue=blue, dark=dark)
+
+
+def _check_output(output: Optional[str], writer: Writer, index: bool) -> None:
+    # Checked before anything runs, since these can only be written to files:
+    if output:
+        return
+    if index:
+        raise click.UsageError("--index needs --output.")
+    if writer.BINARY:
+        raise click.UsageError("Binary reports need --output.")
+
+
+def _check_index(paths: Iterable[pathlib.Path], writer: Writer) -> None:
+    try:
+        check_index(paths, writer)
+    except ValueError as error:
+        raise click.UsageError(str(error)) from None
+
+
+def _echo_hotspots(hotspots: Optional[Index]) -> None:
+    if hotspots is None:
+        return
+    totals = hotspots.totals
+    click.echo(
+        f"{hotspots.files} files: {totals.specialized} specialized, "
+        f"{totals.adaptive} adaptive, {totals.unquickened} unquickened"
+    )
+    for hotspot in hotspots.ranking("functions_by_adaptive")[:5]:
+        click.echo(
+            f"{hotspot.name} (line {hotspot.lineno}): "
+            f"{hotspot.stats.adaptive} adaptive, {hotspot.ratio:.0%} specialized"
+        )
+
+
+# Options for writing reports (shared by run and render):
+_JOBS = click.option(
+    "--jobs",
+    "-j",
+    default=1,
+    type=click.IntRange(min=1),
+    help="How many reports to write at once (with --output). (Default: 1)",
+)
+_FORMAT = click.option(
+    "--format",
+    "report_format",
+    default="html",
+    type=click.Choice(["html", "json", "binary"]),
+    help=(
+        "The format of the reports. JSON and binary reports can be compared with "
+        "specialist diff. (Default: html)"
+    ),
+)
+_VIRTUAL = click.option(
+    "--virtual",
+    default=False,
+    is_flag=True,
+    help="Only render the visible part of HTML reports (for very large files).",
+)
+_INDEX = click.option(
+    "--index",
+    default=False,
+    is_flag=True,
+    help="Rank the hot spots of every report in index.html (with --output).",
+)
+
+
 @main.command(
     context_settings={
         "ignore_unknown_options": True,
@@ -45,6 +146,55 @@ def main():
     help="A glob-style pattern indicating target files to analyze.",
 )
 @click.option("--output", default=None, help="Output for the reports.")
+@click.option(
+    "--processes",
+    default=False,
+    is_flag=True,
+    help="Also analyze (and merge the results of) any child processes.",
+)
+@_JOBS
+@_FORMAT
+@_VIRTUAL
+@_INDEX
+@click.option(
+    "--cache-dir",
+    default=DEFAULT_CACHE_DIR,
+    help=(
+        "Where to cache the results, so that specialist render can render them "
+        f"again later. (Default: {DEFAULT_CACHE_DIR})"
+    ),
+)
+@click.option(
+    "--no-cache",
+    default=False,
+    is_flag=True,
+    help="Don't cache the results.",
+)
+@click.option(
+    "--families",
+    default=False,
+    is_flag=True,
+    help="Break each code object's stats down by specialization family.",
+)
+@click.option(
+    "--timeline",
+    default=None,
+    help="Sample each code object's stats over time, and save them to this file.",
+)
+@click.option(
+    "--timeline-interval",
+    default=DEFAULT_TIMELINE_INTERVAL,
+    help=f"Seconds between timeline samples. (Default: {DEFAULT_TIMELINE_INTERVAL})",
+)
+@click.option(
+    "--timeline-capacity",
+    default=DEFAULT_TIMELINE_CAPACITY,
+    type=click.IntRange(min=1),
+    help=(
+        "How many timeline samples to keep (the oldest are dropped first). "
+        f"(Default: {DEFAULT_TIMELINE_CAPACITY})"
+    ),
+)
 @click.argument("source")
 @click.argument("args", nargs=-1, type=click.UNPROCESSED)
 def run(
@@ -52,27 +202,150 @@ def run(
     m: Optional[str],
     targets: Optional[str],
     output: Optional[str],
+    processes: bool,
+    jobs: int,
+    report_format: str,
+    virtual: bool,
+    index: bool,
+    cache_dir: str,
+    no_cache: bool,
+    families: bool,
+    timeline: Optional[str],
+    timeline_interval: float,
+    timeline_capacity: int,
     source: str,
     args: Tuple[str, ...],
 ):
     """Analyze your code."""
     argv = " ".join(quote(a) for a in args)
+    writer = _writer(report_format, virtual, blue=False, dark=False)
+    _check_output(output, writer, index)
 
     sources = []
     if targets is not None:
         sources = [p for p in pathlib.Path().glob(targets)]
+    if index:
+        # Code run with -c is reported as __main__, which can't collide:
+        main_file = None
+        if m:
+            main_file = main_file_for_module(source)
+        elif not c:
+            main_file = pathlib.Path(source)
+        _check_index(sources or [p for p in [main_file] if p is not None], writer)
 
+    spool = Spool() if processes else None
+    sampler = None
+    if timeline is not None:
+        sampler = Timeline(
+            pathlib.Path(timeline),
+            interval=timeline_interval,
+            capacity=timeline_capacity,
+        )
     if c:
-        results = analyze_code(source, argv, targets=sources)
+        results = analyze_code(
+            source, argv, targets=sources, spool=spool, timeline=sampler
+        )
     elif m:
-        results = analyze_module(source, argv, targets=sources)
+        results = analyze_module(
+            source, argv, targets=sources, spool=spool, timeline=sampler
+        )
     else:
-        results = analyze_file(source, argv, targets=sources)
+        results = analyze_file(
+            source, argv, targets=sources, spool=spool, timeline=sampler
+        )
+
+    if sampler is not None:
+        click.echo(
+            f"Saved {len(sampler)} timeline samples to {sampler.path} "
+            f"({sampler.dropped} dropped)"
+        )
+
+    if spool is not None:
+        for path in results:
+            click.echo(f"{path}: merged from {spool.workers(path)} processes")
+
+    if not no_cache:
+        cache = ResultsCache(pathlib.Path(cache_dir))
+        results = {path: cache.record(path, r) for path, r in results.items()}
 
     out_dir = None
     if output:
         out_dir = pathlib.Path(output)
-    view(results, out_dir=out_dir)
+    hotspots = view(
+        results,
+        writer=writer,
+        out_dir=out_dir,
+        jobs=jobs,
+        index=index,
+        families=families,
+    )
+    _echo_hotspots(hotspots)
+
+
+@main.command()
+@click.option("--output", default=None, help="Output for the reports.")
+@_JOBS
+@_FORMAT
+@_VIRTUAL
+@_INDEX
+@click.option(
+    "--cache-dir",
+    default=DEFAULT_CACHE_DIR,
+    help=f"Where the results were cached. (Default: {DEFAULT_CACHE_DIR})",
+)
+@click.option(
+    "--blue",
+    "-b",
+    default=False,
+    is_flag=True,
+    help="Use blue (rather than green) to indicate specialized code.",
+)
+@click.option(
+    "--dark",
+    "-d",
+    default=False,
+    is_flag=True,
+    help="Use light text on a dark background.",
+)
+@click.argument("sources", nargs=-1)
+def render(
+    output: Optional[str],
+    jobs: int,
+    report_format: str,
+    virtual: bool,
+    index: bool,
+    cache_dir: str,
+    blue: bool,
+    dark: bool,
+    sources: Tuple[str, ...],
+):
+    """Render cached results again (without re-running anything).
+
+    Renders the results for each of SOURCES, or for every cached file if none
+    are given. Files that have changed since they were analyzed are skipped.
+    """
+    writer = _writer(report_format, virtual, blue=blue, dark=dark)
+    _check_output(output, writer, index)
+    cache = ResultsCache(pathlib.Path(cache_dir))
+    paths = [pathlib.Path(source) for source in sources] or cache.paths()
+    results: PathToResults = {}
+    for path in paths:
+        chunks = cache.load(path)
+        if chunks is None:
+            click.echo(f"{path}: not cached (or changed since it was)", err=True)
+        else:
+            results[path] = chunks
+    if not results:
+        raise click.ClickException("There's nothing to render!")
+    if index:
+        _check_index(results, writer)
+
+    out_dir = None
+    if output:
+        out_dir = pathlib.Path(output)
+    _echo_hotspots(
+        view(results, writer=writer, out_dir=out_dir, jobs=jobs, index=index)
+    )
 
 
 @main.command(
@@ -105,6 +378,54 @@ def run(
     default=DEFAULT_WATCH_PORT,
     help=f"Set the port for the analysis socket. (Default: {DEFAULT_WATCH_PORT})",
 )
+@click.option(
+    "--interval",
+    default=DEFAULT_WATCH_INTERVAL,
+    help=f"Seconds between analysis snapshots. (Default: {DEFAULT_WATCH_INTERVAL})",
+)
+@click.option(
+    "--budget",
+    default=DEFAULT_WATCH_BUDGET,
+    help=(
+        "CPU seconds each snapshot may spend before deferring the remaining "
+        f"targets to the next one. (Default: {DEFAULT_WATCH_BUDGET})"
+    ),
+)
+@click.option(
+    "--buffer",
+    default=DEFAULT_WATCH_BUFFER,
+    help=(
+        "How many updates may be waiting to be sent to each client. "
+        f"(Default: {DEFAULT_WATCH_BUFFER})"
+    ),
+)
+@click.option(
+    "--overflow",
+    default=DEFAULT_WATCH_OVERFLOW,
+    type=click.Choice(OVERFLOW_POLICIES),
+    help=(
+        "What to do when a client's buffer is full. "
+        f"(Default: {DEFAULT_WATCH_OVERFLOW})"
+    ),
+)
+@click.option(
+    "--server",
+    default=DEFAULT_WATCH_SERVER,
+    type=click.Choice(SERVER_KINDS),
+    help=(
+        "Serve clients from a thread each, or all from one asyncio thread. "
+        f"(Default: {DEFAULT_WATCH_SERVER})"
+    ),
+)
+@click.option(
+    "--code-limit",
+    default=None,
+    type=click.IntRange(min=1),
+    help=(
+        "Hold on to code for at most this many files, evicting the least recently "
+        "used. (Default: no limit)"
+    ),
+)
 @click.argument("source")
 @click.argument("args", nargs=-1, type=click.UNPROCESSED)
 def watch(
@@ -112,6 +433,12 @@ def watch(
     m: Optional[str],
     targets: Optional[str],
     port: int,
+    interval: float,
+    budget: float,
+    buffer: int,
+    overflow: OverflowPolicy,
+    server: ServerKind,
+    code_limit: Optional[int],
     source: str,
     args: Tuple[str, ...],
 ):
@@ -125,7 +452,16 @@ def watch(
     if targets is not None:
         sources = [p for p in pathlib.Path().glob(targets)]
 
-    do_watch(targets=sources, port=port)
+    CODE.limit = code_limit
+    monitor = do_watch(
+        targets=sources,
+        port=port,
+        interval=interval,
+        budget=budget,
+        buffer=buffer,
+        overflow=overflow,
+        server=server,
+    )
     click.echo(f"Running! Analysis socket at localhost:{port}")
 
     if c:
@@ -134,3 +470,66 @@ def watch(
         analyze_module(source, argv, targets=sources)
     else:
         analyze_file(source, argv, targets=sources)
+
+    click.echo(f"Analysis overhead: {monitor.overhead}")
+    code = CODE.stats()
+    click.echo(
+        f"Captured code: {code.files} files ({code.size} bytes), {code.other} other, "
+        f"{code.evicted} evicted"
+    )
+    for client in monitor.clients:
+        click.echo(
+            f"Client {client.name}: {client.lag} waiting (at most {client.max_lag}), "
+            f"{client.delivered} delivered, {client.coalesced} coalesced, "
+            f"{client.dropped} dropped"
+        )
+
+
+@main.command()
+@click.option("--output", default=None, help="Output for the diff reports.")
+@click.option(
+    "--threshold",
+    default=0,
+    type=click.IntRange(min=0),
+    help=(
+        "Exit with an error if the total number of adaptive instructions grows by "
+        "more than this. (Default: 0)"
+    ),
+)
+@click.argument("baseline")
+@click.argument("candidate")
+def diff(output: Optional[str], threshold: int, baseline: str, candidate: str):
+    """Compare two runs, saved as JSON or binary reports.
+
+    BASELINE and CANDIDATE are either two output directories (of specialist run
+    --format json or binary), or two reports of the same file.
+    """
+    out_dir = None
+    if output:
+        out_dir = pathlib.Path(output)
+    try:
+        comparison = do_diff(
+            pathlib.Path(baseline), pathlib.Path(candidate), out_dir=out_dir
+        )
+    except ValueError as error:
+        raise click.ClickException(str(error)) from None
+    delta = comparison.delta
+    click.echo(
+        f"{comparison.files} files ({len(comparison.changed())} changed): "
+        f"{delta.specialized:+} specialized, {delta.adaptive:+} adaptive, "
+        f"{delta.unquickened:+} unquickened"
+    )
+    for entry in comparison.changed():
+        for function in entry["functions"]:
+            grown = function["candidate"]["adaptive"] - function["baseline"]["adaptive"]
+            if grown > 0:
+                click.echo(
+                    f"{entry['name']}:{function['name']} (line {function['lineno']}): "
+                    f"{grown:+} adaptive"
+                )
+    if delta.adaptive > threshold:
+        click.echo(
+            f"Adaptive instructions grew by {delta.adaptive} (more than {threshold})!",
+            err=True,
+        )
+        sys.exit(1)
@@ -0,0 +1,205 @@
+"""Incremental analysis, for repeatedly re-reading the same files."""
+import array
+import os
+import pathlib
+import types
+import typing
+
+from .core import (
+    FIRST_POSTION,
+    LAST_POSITION,
+    AnalysisResults,
+    _line_starts,
+    _new_deltas,
+    _split,
+    _sum_chunks,
+)
+from .common import walk_code
+from .instructions import ADAPTIVE, SPECIALIZED, Fingerprint, classify_code
+from .utils import get_code_for_path
+
+__all__ = ("Analyzer",)
+
+_Position = tuple[int | None, int | None, int | None, int | None]
+
+# The category of instructions that haven't been scored yet:
+_UNSCORED = 0xFF
+
+
+class _Child:
+    """The cached analysis of a single (possibly nested) code object."""
+
+    __slots__ = (
+        "code",
+        "fingerprinter",
+        "fingerprint",
+        "starts",
+        "stops",
+        "categories",
+        "opcodes",
+    )
+
+    def __init__(self, code: types.CodeType) -> None:
+        self.code = code
+        self.fingerprinter = Fingerprint(code)
+        # A fingerprint of the quickened instructions that were last scored:
+        self.fingerprint: int | None = None
+        # Indices into the file's positions for each instruction (or -1, for
+        # instructions without any location information):
+        self.starts = array.array("l")
+        self.stops = array.array("l")
+        # The category each instruction was last scored as:
+        self.categories = array.array("B")
+        # The opcode each instruction was last specialized to (or 0, if it
+        # never has been):
+        self.opcodes = array.array("B")
+
+
+class _Source(typing.NamedTuple):
+    """A file's contents, along with what's needed to tell if it's changed."""
+
+    key: tuple[int, int]
+    data: bytes
+    starts: "array.array[int]"
+
+
+class _FileAnalysis:
+    """The cached analysis of a file's module-level code object."""
+
+    def __init__(self, code: types.CodeType) -> None:
+        self.code = code
+        self.children = [_Child(child) for child in walk_code(code)]
+        # Where instructions are in the source never changes, so we only need
+        # to map each one to its start and stop positions once:
+        events: list[list[_Position | None]] = []
+        for child in self.children:
+            # co_positions has an entry for every code unit, including CACHEs:
+            positions = list(child.code.co_positions())
+            events.append(
+                [
+                    None if None in positions[index] else positions[index]
+                    for index, _ in classify_code(child.code)
+                ]
+            )
+        self.positions = sorted(
+            {FIRST_POSTION, LAST_POSITION}
+            | {(p[0], p[2]) for e in events for p in e if p is not None}
+            | {(p[1], p[3]) for e in events for p in e if p is not None}
+        )
+        index = {position: i for i, position in enumerate(self.positions)}
+        for child, child_events in zip(self.children, events):
+            for position in child_events:
+                if position is None:
+                    child.starts.append(-1)
+                    child.stops.append(-1)
+                else:
+                    lineno, end_lineno, col_offset, end_col_offset = position
+                    child.starts.append(index[lineno, col_offset])
+                    child.stops.append(index[end_lineno, end_col_offset])
+            child.categories = array.array("B", [_UNSCORED]) * len(child_events)
+            child.opcodes = array.array("B", bytes(len(child_events)))
+        self.deltas = _new_deltas(len(self.positions))
+        # Another difference array, for churn (the last Stats field):
+        self.deltas.append(array.array("q", bytes(8 * len(self.positions))))
+
+    def update(self) -> bool:
+        """Re-score any code whose quickened bytecode has changed.
+
+        Comparing each instruction with how it was last scored also counts its
+        churn: deoptimizing (specialized to adaptive), respecializing (adaptive
+        to specialized, after having been specialized before), and switching
+        from one specialization to another. Anything that happens (and undoes
+        itself) between updates can't be seen.
+        """
+        changed = False
+        deltas = self.deltas
+        churn = deltas[-1]
+        for child in self.children:
+            fingerprint = child.fingerprinter()
+            if fingerprint == child.fingerprint:
+                continue
+            child.fingerprint = fingerprint
+            starts, stops, categories = child.starts, child.stops, child.categories
+            opcodes = child.opcodes
+            quickened = child.code._co_code_adaptive[::2]  # type: ignore # attr is defined
+            for i, (index, category) in enumerate(classify_code(child.code)):
+                old = categories[i]
+                start = starts[i]
+                if start < 0:
+                    continue
+                if category == SPECIALIZED:
+                    opcode = quickened[index]
+                    last = opcodes[i]
+                    opcodes[i] = opcode
+                    # Switched specializations, or respecialized:
+                    churned = last != 0 and (last != opcode or old == ADAPTIVE)
+                else:
+                    # Deoptimized:
+                    churned = old == SPECIALIZED and category == ADAPTIVE
+                if churned:
+                    churn[start] += 1
+                    churn[stops[i]] -= 1
+                    changed = True
+                if old == category:
+                    continue
+                stop = stops[i]
+                if old != _UNSCORED:
+                    deltas[old][start] -= 1
+                    deltas[old][stop] += 1
+                deltas[category][start] += 1
+                deltas[category][stop] -= 1
+                categories[i] = category
+                changed = True
+        return changed
+
+
+class Analyzer:
+    """Analyze files repeatedly, only re-scoring code that has been re-quickened.
+
+    Each code object's quickened instructions (but not their inline caches) are
+    fingerprinted, and only code whose fingerprint has changed since the last
+    update is re-scored. Source text (and
+    its line index) is cached until the file itself changes. Since every update
+    is compared with the last, results also count each chunk's churn.
+    """
+
+    def __init__(self) -> None:
+        self._files: dict[pathlib.Path, _FileAnalysis] = {}
+        self._sources: dict[pathlib.Path, _Source] = {}
+        self._results: dict[pathlib.Path, list[AnalysisResults]] = {}
+
+    def _source(self, path: pathlib.Path) -> tuple[_Source, bool]:
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        source = self._sources.get(path)
+        if source is not None and source.key == key:
+            return source, False
+        data = path.read_bytes()
+        source = self._sources[path] = _Source(key, data, _line_starts(data))
+        return source, True
+
+    def update(self, path: pathlib.Path) -> bool:
+        """Update the analysis of a file, and return whether its results changed.
+
+        Files without any code (yet, or any more) are skipped, keeping their last
+        results (if any).
+        """
+        code = get_code_for_path(path)
+        if code is None:
+            self._files.pop(path, None)
+            return False
+        analysis = self._files.get(path)
+        if analysis is None or analysis.code is not code:
+            analysis = self._files[path] = _FileAnalysis(code)
+        source, reloaded = self._source(path)
+        if not analysis.update() and not reloaded and path in self._results:
+            return False
+        chunks = _sum_chunks(analysis.positions, analysis.deltas)
+        results = list(_split(source.data, chunks, source.starts))
+        changed = results != self._results.get(path)
+        self._results[path] = results
+        return changed
+
+    def results(self, path: pathlib.Path) -> list[AnalysisResults]:
+        """Get the results from the last update of a file."""
+        return self._results[path]
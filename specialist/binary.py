@@ -0,0 +1,219 @@
+"""A compact, columnar binary format for reports.
+
+A report is a file header followed by any number of segments, each holding a
+run of chunks. Since every segment is self-contained, more chunks can be added
+to an existing report by appending segments to it. Every part is 8-byte aligned
+and little-endian, so the counters can be used in place from a memory map:
+
+    file header:    magic (b"SPCL"), version (u32)
+    segment header: magic (b"SPCS"), reserved (u32), chunks (u64), text size (u64)
+    columns:        specialized, adaptive, unquickened, churn, and the end
+                    offset of each chunk's text (u64 each, one per chunk)
+    text:           the UTF-8 source of every chunk, padded to 8 bytes
+
+Version 2 added the churn column (see Stats.churn).
+"""
+import array
+import itertools
+import mmap
+import os
+import pathlib
+import struct
+import typing
+from typing_extensions import Self
+
+from .common import LITTLE_ENDIAN, padding
+from .stats import Stats
+from .writers import Writer
+
+__all__ = ("BinaryReport", "BinaryWriter")
+
+MAGIC = b"SPCL"
+VERSION = 2
+FILE_HEADER = struct.Struct("<4sI")
+SEGMENT_MAGIC = b"SPCS"
+SEGMENT_HEADER = struct.Struct("<4sIQQ")
+
+_COLUMNS = 5
+
+
+class BinaryWriter(Writer):
+    """Write reports in the binary format, one segment every so many chunks."""
+
+    EXTENSION: typing.ClassVar[str] = "spcl"
+    BINARY: typing.ClassVar[bool] = True
+    # How many chunks to buffer before writing them out as a segment:
+    SEGMENT_CHUNKS: typing.ClassVar[int] = 1 << 16
+
+    def __init__(self) -> None:
+        self._chunks: typing.List[typing.Tuple[str, Stats]] = []
+
+    def add(self, source: str, stats: Stats) -> None:
+        self._chunks.append((source, stats))
+
+    def emit(self) -> str:
+        raise TypeError("Binary reports can only be written to files!")
+
+    def copy(self) -> Self:
+        return BinaryWriter()
+
+    @staticmethod
+    def _segment(chunks: typing.List[typing.Tuple[str, Stats]]) -> typing.List[bytes]:
+        columns = [array.array("Q") for _ in range(_COLUMNS)]
+        specialized, adaptive, unquickened, churn, ends = columns
+        text = bytearray()
+        for source, stats in chunks:
+            text += source.encode("utf-8")
+            specialized.append(stats.specialized)
+            adaptive.append(stats.adaptive)
+            unquickened.append(stats.unquickened)
+            churn.append(stats.churn)
+            ends.append(len(text))
+        if not LITTLE_ENDIAN:
+            for column in columns:
+                column.byteswap()
+        header = SEGMENT_HEADER.pack(SEGMENT_MAGIC, 0, len(chunks), len(text))
+        return [header, *(c.tobytes() for c in columns), text, padding(len(text))]
+
+    def write(
+        self,
+        chunks: typing.Iterable[typing.Tuple[str, Stats]],
+        file: typing.IO[typing.Any],
+    ) -> None:
+        """Write (or append, for a file opened with "ab") chunks to a report."""
+        if not file.tell():
+            file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        segment: typing.List[typing.Tuple[str, Stats]] = []
+        for chunk in itertools.chain(self._chunks, chunks):
+            segment.append(chunk)
+            if len(segment) == self.SEGMENT_CHUNKS:
+                file.writelines(self._segment(segment))
+                segment = []
+        if segment:
+            file.writelines(self._segment(segment))
+
+
+class _Segment(typing.NamedTuple):
+    count: int
+    # Columns (as u64 views of the map, or copies on big-endian machines):
+    specialized: typing.Sequence[int]
+    adaptive: typing.Sequence[int]
+    unquickened: typing.Sequence[int]
+    churn: typing.Sequence[int]
+    ends: typing.Sequence[int]
+    text: memoryview
+
+
+class BinaryReport:
+    """A memory-mapped binary report, as a sequence of (source, Stats) chunks.
+
+    Reports can be passed straight to view (or any Writer) to re-emit them in
+    another format, without re-running anything.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self._segments: typing.List[_Segment] = []
+        self._views: typing.List[memoryview] = []
+        with path.open("rb") as file:
+            if os.fstat(file.fileno()).st_size < FILE_HEADER.size:
+                raise ValueError(f"{path} isn't a binary report!")
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._load()
+        except BaseException:
+            self.close()
+            raise
+
+    def _view(self, start: int, stop: int) -> memoryview:
+        if not self._views:
+            self._views.append(memoryview(self._map))
+        view = self._views[0][start:stop]
+        self._views.append(view)
+        return view
+
+    def _column(self, start: int, count: int) -> typing.Sequence[int]:
+        view = self._view(start, start + 8 * count)
+        if LITTLE_ENDIAN:
+            column = view.cast("Q")
+            self._views.append(column)
+            return column
+        copy = array.array("Q", view)
+        copy.byteswap()
+        return copy
+
+    def _load(self) -> None:
+        magic, version = FILE_HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} isn't a binary report!")
+        if version != VERSION:
+            raise ValueError(f"Unsupported binary report version {version}!")
+        offset = FILE_HEADER.size
+        while offset < len(self._map):
+            magic, _, count, size = SEGMENT_HEADER.unpack_from(self._map, offset)
+            if magic != SEGMENT_MAGIC:
+                raise ValueError(f"Corrupt segment at offset {offset} of {self.path}!")
+            offset += SEGMENT_HEADER.size
+            columns = []
+            for _ in range(_COLUMNS):
+                columns.append(self._column(offset, count))
+                offset += 8 * count
+            text = self._view(offset, offset + size)
+            offset += size + len(padding(size))
+            self._segments.append(_Segment(count, *columns, text))
+
+    def __len__(self) -> int:
+        return sum(segment.count for segment in self._segments)
+
+    def __iter__(self) -> typing.Iterator[typing.Tuple[str, Stats]]:
+        for segment in self._segments:
+            start = 0
+            for *counts, end in zip(
+                segment.specialized,
+                segment.adaptive,
+                segment.unquickened,
+                segment.churn,
+                segment.ends,
+            ):
+                source = str(segment.text[start:end], "utf-8")
+                yield source, Stats(*counts)
+                start = end
+
+    def __getitem__(self, index: int) -> typing.Tuple[str, Stats]:
+        if index < 0:
+            index += len(self)
+        for segment in self._segments:
+            if 0 <= index < segment.count:
+                start = segment.ends[index - 1] if index else 0
+                source = str(segment.text[start : segment.ends[index]], "utf-8")
+                stats = Stats(
+                    segment.specialized[index],
+                    segment.adaptive[index],
+                    segment.unquickened[index],
+                    segment.churn[index],
+                )
+                return source, stats
+            index -= segment.count
+        raise IndexError("chunk index out of range")
+
+    def totals(self) -> Stats:
+        """Sum every chunk's counters (without decoding any source)."""
+        return Stats(
+            sum(sum(segment.specialized) for segment in self._segments),
+            sum(sum(segment.adaptive) for segment in self._segments),
+            sum(sum(segment.unquickened) for segment in self._segments),
+            sum(sum(segment.churn) for segment in self._segments),
+        )
+
+    def close(self) -> None:
+        self._segments.clear()
+        for view in reversed(self._views):
+            view.release()
+        self._views.clear()
+        self._map.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
@@ -0,0 +1,186 @@
+"""A content-addressed, on-disk cache of analysis results, for re-rendering them.
+
+Each file's results are stored under the running Python's version, then a hash
+of the file's path, then a hash of its source. Only the positions and stats of
+each chunk are stored (the text is sliced back out of the source when they're
+loaded), so results are only usable while the source still hashes the same:
+
+    <cache>/<python version>/<path hash>/<source hash>.spcc
+
+Every part of an entry is 8-byte aligned and little-endian:
+
+    header:  magic (b"SPCC"), version (u32), chunks (u64), path size (u64)
+    path:    the UTF-8 path of the source, padded to 8 bytes
+    columns: the end offset of each chunk's text, then its specialized,
+             adaptive, unquickened, and churn counts (i64 each, one per chunk)
+"""
+import array
+import hashlib
+import os
+import pathlib
+import struct
+import sys
+import typing
+
+from .common import LITTLE_ENDIAN, normalize_path, padding
+from .stats import Stats
+
+__all__ = ("DEFAULT_CACHE_DIR", "ResultsCache")
+
+DEFAULT_CACHE_DIR = ".specialist_cache"
+
+MAGIC = b"SPCC"
+VERSION = 1
+HEADER = struct.Struct("<4sIQQ")
+EXTENSION = ".spcc"
+
+_COLUMNS = 5
+
+# Results (and even bytecode) can differ between any two releases:
+PYTHON_VERSION = f"{sys.implementation.cache_tag}-{sys.hexversion:08x}"
+
+
+def _hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultsCache:
+    """Store the results of each analyzed file, and load them again later.
+
+    Storing results for a file replaces any stored for older versions of its
+    source, and loading them for a file whose source has changed since (or no
+    longer exists) removes them, so nothing stale is ever loaded.
+    """
+
+    def __init__(
+        self, directory: pathlib.Path, *, python_version: str = PYTHON_VERSION
+    ) -> None:
+        self.directory = directory
+        self.python_version = python_version
+
+    def _entries(self, path: pathlib.Path) -> pathlib.Path:
+        """Find the directory holding a source file's entries."""
+        key = _hash(normalize_path(path).encode("utf-8"))[:32]
+        return self.directory / self.python_version / key
+
+    def record(
+        self,
+        path: pathlib.Path,
+        chunks: typing.Iterable[typing.Tuple[str, Stats]],
+    ) -> typing.Iterator[typing.Tuple[str, Stats]]:
+        """Pass chunks through, storing them once they've all been consumed.
+
+        The source is hashed from the chunks themselves (which always cover it
+        exactly), so it's the version that was actually analyzed. Results for
+        files that don't exist (like code analyzed in memory) aren't stored.
+        """
+        if not path.is_file():
+            yield from chunks
+            return
+        source = hashlib.sha256()
+        columns = [array.array("q") for _ in range(_COLUMNS)]
+        ends, specialized, adaptive, unquickened, churn = columns
+        end = 0
+        for text, stats in chunks:
+            data = text.encode("utf-8")
+            source.update(data)
+            end += len(data)
+            ends.append(end)
+            specialized.append(stats.specialized)
+            adaptive.append(stats.adaptive)
+            unquickened.append(stats.unquickened)
+            churn.append(stats.churn)
+            yield text, stats
+        self._store(path, source.hexdigest(), columns)
+
+    def _store(
+        self,
+        path: pathlib.Path,
+        key: str,
+        columns: typing.List["array.array[int]"],
+    ) -> None:
+        entries = self._entries(path)
+        entries.mkdir(parents=True, exist_ok=True)
+        name = str(path.absolute()).encode("utf-8")
+        parts = [HEADER.pack(MAGIC, VERSION, len(columns[0]), len(name))]
+        parts += [name, padding(len(name))]
+        for column in columns:
+            if not LITTLE_ENDIAN:
+                column.byteswap()
+            parts.append(column.tobytes())
+        entry = entries / f"{key}{EXTENSION}"
+        # Write somewhere else first, so that a half-written entry is never seen:
+        temporary = entries / f"{key}.{os.getpid()}.tmp"
+        temporary.write_bytes(b"".join(parts))
+        os.replace(temporary, entry)
+        for other in entries.glob(f"*{EXTENSION}"):
+            if other != entry:
+                other.unlink(missing_ok=True)
+
+    def load(
+        self, path: pathlib.Path
+    ) -> typing.Optional[typing.Iterator[typing.Tuple[str, Stats]]]:
+        """Load a file's results (or None, if there aren't any for its source)."""
+        entries = self._entries(path)
+        try:
+            source = path.read_bytes()
+            columns = self._read(entries / f"{_hash(source)}{EXTENSION}")
+        except (OSError, ValueError, EOFError):
+            # The source has changed (or is gone), or the entry is corrupt, so
+            # anything stored for it is stale:
+            for stale in entries.glob(f"*{EXTENSION}"):
+                stale.unlink(missing_ok=True)
+            return None
+        return self._chunks(source, columns)
+
+    @staticmethod
+    def _read_header(
+        file: typing.BinaryIO, entry: pathlib.Path
+    ) -> typing.Tuple[int, pathlib.Path]:
+        """Read an entry's header and path, returning its chunk count and path."""
+        header = file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{entry} isn't a cache entry!")
+        magic, version, count, size = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError(f"{entry} isn't a cache entry!")
+        if version != VERSION:
+            raise ValueError(f"Unsupported cache entry version {version}!")
+        path = pathlib.Path(str(file.read(size), "utf-8"))
+        file.read(len(padding(size)))
+        return count, path
+
+    @classmethod
+    def _read(cls, entry: pathlib.Path) -> typing.List["array.array[int]"]:
+        with entry.open("rb") as file:
+            count, _ = cls._read_header(file, entry)
+            columns = []
+            for _ in range(_COLUMNS):
+                column = array.array("q")
+                column.fromfile(file, count)
+                if not LITTLE_ENDIAN:
+                    column.byteswap()
+                columns.append(column)
+        return columns
+
+    @staticmethod
+    def _chunks(
+        source: bytes, columns: typing.List["array.array[int]"]
+    ) -> typing.Iterator[typing.Tuple[str, Stats]]:
+        start = 0
+        for end, *counts in zip(*columns):
+            yield source[start:end].decode("utf-8"), Stats(*counts)
+            start = end
+
+    def paths(self) -> typing.List[pathlib.Path]:
+        """Every source file with results stored (for this Python version)."""
+        paths = []
+        entries = self.directory / self.python_version
+        for entry in sorted(entries.glob(f"*/*{EXTENSION}")):
+            try:
+                with entry.open("rb") as file:
+                    _, path = self._read_header(file, entry)
+            except (OSError, ValueError):
+                continue
+            paths.append(path)
+        return paths
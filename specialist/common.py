@@ -0,0 +1,28 @@
+"""Small helpers shared by several modules (all cheap to import)."""
+import os
+import sys
+import types
+import typing
+
+__all__ = ("LITTLE_ENDIAN", "normalize_path", "padding", "walk_code")
+
+# Whether binary data (which is always little-endian) can be used as-is:
+LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+def normalize_path(filename: str | os.PathLike[str]) -> str:
+    """Normalize a path, so that different spellings of it compare equal."""
+    return os.path.normcase(os.path.abspath(filename))
+
+
+def padding(size: int) -> bytes:
+    """The zeros needed to pad something of this size to 8 bytes."""
+    return bytes(-size % 8)
+
+
+def walk_code(code: types.CodeType) -> typing.Generator[types.CodeType, None, None]:
+    """Walk a code object, yielding all of its sub-code objects."""
+    yield code
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            yield from walk_code(constant)
@@ -0,0 +1,530 @@
+"""Compare two saved runs (directories of JSON or binary reports) chunk by chunk."""
+import dataclasses
+import html
+import json
+import pathlib
+import typing
+
+from .common import walk_code
+from .stats import Stats
+
+__all__ = (
+    "ChunkDiff",
+    "Comparison",
+    "FileDiff",
+    "FunctionDiff",
+    "compare_chunks",
+    "diff",
+    "load_report",
+)
+
+# The extensions of the reports that can be compared (see JSONWriter and
+# BinaryWriter):
+REPORT_EXTENSIONS = (".json", ".spcl")
+
+# What Comparison.write writes (next to each changed file's page):
+DIFF_FILES = ("diff.html", "diff.json")
+# JSON that might be written next to the reports, rather than being one (see
+# Index.write and Comparison.write):
+_OUTPUTS = ("index.json", "diff.json")
+
+Chunks = typing.Iterable[typing.Tuple[str, Stats]]
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class ChunkDiff:
+    """One chunk of source, and its stats in each run."""
+
+    source: str
+    # Where the chunk starts in the candidate (or the baseline, if it was
+    # removed), as a 1-indexed line and 0-indexed column:
+    lineno: int
+    column: int
+    # None if the chunk was added (or removed):
+    baseline: typing.Optional[Stats]
+    candidate: typing.Optional[Stats]
+
+    @property
+    def delta(self) -> Stats:
+        return (self.candidate or Stats()) - (self.baseline or Stats())
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class FunctionDiff:
+    """A function's stats (summed from its chunks) in each run."""
+
+    name: str
+    lineno: int
+    baseline: Stats
+    candidate: Stats
+
+    @property
+    def delta(self) -> Stats:
+        return self.candidate - self.baseline
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class FileDiff:
+    """Every chunk of a file, aligned across both runs."""
+
+    # The report's path (without its extension), relative to its run:
+    name: str
+    # In candidate order (including added chunks):
+    chunks: typing.Tuple[ChunkDiff, ...]
+    # In baseline order:
+    removed: typing.Tuple[ChunkDiff, ...]
+    # Only those that changed, in candidate order (then any that were removed):
+    functions: typing.Tuple[FunctionDiff, ...]
+    baseline: Stats
+    candidate: Stats
+
+    @property
+    def delta(self) -> Stats:
+        return self.candidate - self.baseline
+
+    @property
+    def changed(self) -> bool:
+        """Whether any chunk's stats changed (even if the totals didn't)."""
+        return any(_any_count(c.delta) for c in (*self.chunks, *self.removed))
+
+    def write_html(self, file: typing.TextIO) -> None:
+        """Write the candidate's source, colored by how each chunk changed."""
+        delta = self.delta
+        file.write(
+            "<!doctype html><html><head>"
+            "<meta http-equiv='content-type' content='text/html;charset=utf-8'/>"
+            f"<style>{_STYLE}</style></head><body>"
+            f"<p>{html.escape(self.name)}: {_describe(delta)}</p><pre>"
+        )
+        plain: typing.List[str] = []
+        for chunk in self.chunks:
+            name = _class(chunk.delta)
+            if name is None:
+                plain.append(chunk.source)
+                continue
+            file.write(html.escape("".join(plain)))
+            plain = []
+            title = html.escape(_describe(chunk.delta), quote=True)
+            source = html.escape(chunk.source)
+            file.write(f"<span class='{name}' title='{title}'>{source}</span>")
+        file.write(html.escape("".join(plain)))
+        file.write("</pre>")
+        _table(
+            file,
+            "Functions",
+            [(f.name, f.lineno, f.delta) for f in self.functions],
+        )
+        _table(
+            file,
+            "Removed",
+            [
+                (c.source, c.lineno, c.delta)
+                for c in self.removed
+                if _any_count(c.delta)
+            ],
+        )
+        file.write("</body></html>")
+
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        """Everything that changed (unchanged chunks are left out)."""
+        chunks = []
+        for chunk in (*self.chunks, *self.removed):
+            if not _any_count(chunk.delta):
+                continue
+            status = "changed"
+            if chunk.baseline is None:
+                status = "added"
+            elif chunk.candidate is None:
+                status = "removed"
+            chunks.append(
+                {
+                    "source": chunk.source,
+                    "lineno": chunk.lineno,
+                    "column": chunk.column,
+                    "status": status,
+                    "baseline": _counts(chunk.baseline or Stats()),
+                    "candidate": _counts(chunk.candidate or Stats()),
+                }
+            )
+        functions = [
+            {
+                "name": function.name,
+                "lineno": function.lineno,
+                "baseline": _counts(function.baseline),
+                "candidate": _counts(function.candidate),
+            }
+            for function in self.functions
+        ]
+        return {
+            "name": self.name,
+            "baseline": _counts(self.baseline),
+            "candidate": _counts(self.candidate),
+            "functions": functions,
+            "chunks": chunks,
+        }
+
+
+_STYLE = (
+    ".worse{background-color:#ffc0c0}.better{background-color:#c0ffc0}"
+    "td,th{padding:0 1em;text-align:right}"
+    "td:first-child,th:first-child{text-align:left}"
+)
+
+
+def _any_count(stats: Stats) -> bool:
+    return bool(stats.specialized or stats.adaptive or stats.unquickened)
+
+
+def _counts(stats: Stats) -> typing.Dict[str, int]:
+    return {
+        "specialized": stats.specialized,
+        "adaptive": stats.adaptive,
+        "unquickened": stats.unquickened,
+        "churn": stats.churn,
+    }
+
+
+def _describe(delta: Stats) -> str:
+    return (
+        f"{delta.specialized:+} specialized, {delta.adaptive:+} adaptive, "
+        f"{delta.unquickened:+} unquickened"
+    )
+
+
+def _class(delta: Stats) -> typing.Optional[str]:
+    """Red for more adaptive (or less specialized) code, green for the opposite."""
+    if delta.adaptive > 0 or (not delta.adaptive and delta.specialized < 0):
+        return "worse"
+    if delta.adaptive < 0 or (not delta.adaptive and delta.specialized > 0):
+        return "better"
+    return None
+
+
+def _table(
+    file: typing.TextIO, title: str, rows: typing.List[typing.Tuple[str, int, Stats]]
+) -> None:
+    if not rows:
+        return
+    file.write(
+        f"<h2>{title}</h2><table><tr><th>Name</th><th>Line</th><th>Specialized</th>"
+        "<th>Adaptive</th><th>Unquickened</th></tr>"
+    )
+    for name, lineno, delta in rows:
+        file.write(
+            f"<tr class='{_class(delta) or ''}'><td>{html.escape(name)}</td>"
+            f"<td>{lineno}</td><td>{delta.specialized:+}</td>"
+            f"<td>{delta.adaptive:+}</td><td>{delta.unquickened:+}</td></tr>"
+        )
+    file.write("</table>")
+
+
+def load_report(path: pathlib.Path) -> typing.Iterator[typing.Tuple[str, Stats]]:
+    """Lazily load the chunks of a JSON or binary report."""
+    if path.suffix == ".json":
+        with path.open(encoding="utf-8") as file:
+            document = json.load(file)
+        if not isinstance(document, dict) or "data" not in document:
+            raise ValueError(f"{path} isn't a report!")
+        for payload in document["data"]:
+            yield payload["source"], Stats(**payload["stats"])
+        return
+    from .binary import BinaryReport
+
+    with BinaryReport(path) as report:
+        yield from report
+
+
+class _Positioned(typing.NamedTuple):
+    lineno: int
+    column: int
+    source: str
+    stats: Stats
+
+
+def _position(
+    chunks: Chunks,
+) -> typing.Tuple[str, typing.List[_Positioned]]:
+    """Find where each chunk starts (and put the whole source back together)."""
+    positioned = []
+    sources = []
+    lineno, column = 1, 0
+    for source, stats in chunks:
+        positioned.append(_Positioned(lineno, column, source, stats))
+        sources.append(source)
+        newlines = source.count("\n")
+        if newlines:
+            lineno += newlines
+            column = len(source) - source.rindex("\n") - 1
+        else:
+            column += len(source)
+    return "".join(sources), positioned
+
+
+def _match_lines(
+    baseline: typing.List[str], candidate: typing.List[str]
+) -> typing.Dict[int, int]:
+    """Map (1-indexed) candidate lines to the baseline lines they came from.
+
+    Lines are matched in order first. Whatever's left over is matched again (in
+    order, amongst itself), which finds lines that were moved past others.
+    """
+    import difflib
+
+    mapping: typing.Dict[int, int] = {}
+    old = list(range(len(baseline)))
+    new = list(range(len(candidate)))
+    for _ in range(2):
+        matcher = difflib.SequenceMatcher(
+            None,
+            [baseline[i] for i in old],
+            [candidate[j] for j in new],
+            autojunk=False,
+        )
+        matched_old, matched_new = set(), set()
+        for i, j, size in matcher.get_matching_blocks():
+            for k in range(size):
+                mapping[new[j + k] + 1] = old[i + k] + 1
+                matched_old.add(i + k)
+                matched_new.add(j + k)
+        old = [line for i, line in enumerate(old) if i not in matched_old]
+        new = [line for j, line in enumerate(new) if j not in matched_new]
+        if not old or not new:
+            break
+    return mapping
+
+
+def _owners(source: str, name: str) -> typing.List[typing.Tuple[str, int]]:
+    """Find the innermost function (and its first line) that owns each line.
+
+    Module-level lines (and all of them, if the source doesn't compile) are
+    owned by an empty name.
+    """
+    lines = source.count("\n") + 2
+    owners = [("", 0)] * lines
+    try:
+        code = compile(source, name, "exec", dont_inherit=True)
+    except (SyntaxError, ValueError):
+        return owners
+    spans = []
+    for child in walk_code(code):
+        if child is code:
+            continue
+        last = max(
+            (end for _, end, _, _ in child.co_positions() if end is not None),
+            default=child.co_firstlineno,
+        )
+        # Sorted by first line, then by last line (descending):
+        spans.append((child.co_firstlineno, -last, child.co_qualname))
+    # Outer functions first, so that nested ones overwrite them:
+    for first, negated_last, qualname in sorted(spans):
+        last = -negated_last
+        owners[first : last + 1] = [(qualname, first)] * (last + 1 - first)
+    return owners
+
+
+def _functions(
+    source: str, name: str, chunks: typing.List[_Positioned]
+) -> typing.Dict[str, typing.Tuple[int, Stats]]:
+    owners = _owners(source, name)
+    functions: typing.Dict[str, typing.Tuple[int, Stats]] = {}
+    for chunk in chunks:
+        qualname, lineno = owners[chunk.lineno]
+        if qualname:
+            _, stats = functions.get(qualname, (lineno, Stats()))
+            functions[qualname] = lineno, stats + chunk.stats
+    return functions
+
+
+def compare_chunks(name: str, baseline: Chunks, candidate: Chunks) -> FileDiff:
+    """Align the chunks of two runs of a file, and compare them.
+
+    Chunks are aligned by where they start, once the baseline's lines have been
+    matched up with the candidate's (so chunks still line up after lines are
+    added, removed, or moved). Function totals are summed from the chunks that
+    start in them, so instructions spanning several chunks count more than once
+    (but the same way in both runs).
+    """
+    old_source, old_chunks = _position(baseline)
+    new_source, new_chunks = _position(candidate)
+    lines = _match_lines(
+        old_source.splitlines(keepends=True), new_source.splitlines(keepends=True)
+    )
+    unmatched = {(c.lineno, c.column, c.source): c for c in old_chunks}
+    chunks = []
+    for chunk in new_chunks:
+        old_lineno = lines.get(chunk.lineno)
+        match = unmatched.pop((old_lineno, chunk.column, chunk.source), None)
+        chunks.append(
+            ChunkDiff(
+                chunk.source,
+                chunk.lineno,
+                chunk.column,
+                None if match is None else match.stats,
+                chunk.stats,
+            )
+        )
+    removed = tuple(
+        ChunkDiff(c.source, c.lineno, c.column, c.stats, None)
+        for c in unmatched.values()
+    )
+    old_functions = _functions(old_source, name, old_chunks)
+    new_functions = _functions(new_source, name, new_chunks)
+    functions = []
+    for qualname in {**new_functions, **old_functions}:
+        old_lineno, old_stats = old_functions.get(qualname, (0, Stats()))
+        new_lineno, new_stats = new_functions.get(qualname, (old_lineno, Stats()))
+        if old_stats != new_stats:
+            functions.append(FunctionDiff(qualname, new_lineno, old_stats, new_stats))
+    return FileDiff(
+        name,
+        tuple(chunks),
+        removed,
+        tuple(functions),
+        sum((c.stats for c in old_chunks), Stats()),
+        sum((c.stats for c in new_chunks), Stats()),
+    )
+
+
+def _is_report(path: pathlib.Path) -> bool:
+    """Check whether some JSON is a report (and not an index or a comparison)."""
+    try:
+        with path.open(encoding="utf-8") as file:
+            document = json.load(file)
+    except ValueError:
+        return False
+    return isinstance(document, dict) and "data" in document
+
+
+def _reports(run: pathlib.Path) -> typing.Dict[str, pathlib.Path]:
+    """Find a run's reports, by their paths (relative to the run) sans extension."""
+    if not run.is_dir():
+        return {run.stem: run}
+    reports: typing.Dict[str, pathlib.Path] = {}
+    for path in sorted(run.rglob("*")):
+        if path.suffix not in REPORT_EXTENSIONS or not path.is_file():
+            continue
+        relative = path.relative_to(run)
+        if relative.as_posix() in _OUTPUTS and not _is_report(path):
+            continue
+        name = relative.with_suffix("").as_posix()
+        if name in reports:
+            raise ValueError(f"{run} has more than one report for {name}!")
+        reports[name] = path
+    return reports
+
+
+class Comparison:
+    """The totals of every file compared, and everything that changed in them.
+
+    Files can be added one at a time, and only what changed is kept between
+    additions.
+    """
+
+    def __init__(self) -> None:
+        self.files = 0
+        self.baseline = Stats()
+        self.candidate = Stats()
+        self._changed: typing.List[typing.Dict[str, typing.Any]] = []
+
+    @property
+    def delta(self) -> Stats:
+        return self.candidate - self.baseline
+
+    def add(self, file_diff: FileDiff) -> None:
+        self.files += 1
+        self.baseline += file_diff.baseline
+        self.candidate += file_diff.candidate
+        if file_diff.changed:
+            self._changed.append(file_diff.as_dict())
+
+    def changed(self) -> typing.List[typing.Dict[str, typing.Any]]:
+        """Each file that changed (see the "changed" key of diff.json)."""
+        return list(self._changed)
+
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "files": self.files,
+            "baseline": _counts(self.baseline),
+            "candidate": _counts(self.candidate),
+            "changed": self._changed,
+        }
+
+    def write_json(self, file: typing.TextIO) -> None:
+        json.dump(self.as_dict(), file, indent=1)
+
+    def write_html(self, file: typing.TextIO) -> None:
+        file.write(
+            "<!doctype html><html><head>"
+            "<meta http-equiv='content-type' content='text/html;charset=utf-8'/>"
+            f"<style>{_STYLE}</style></head><body>"
+            f"<p>{self.files} files: {_describe(self.delta)}</p>"
+            "<table><tr><th>File</th><th>Specialized</th><th>Adaptive</th>"
+            "<th>Unquickened</th></tr>"
+        )
+        for entry in self._changed:
+            delta = Stats(**entry["candidate"]) - Stats(**entry["baseline"])
+            link = html.escape(f"{entry['name']}.html", quote=True)
+            file.write(
+                f"<tr class='{_class(delta) or ''}'><td><a href='{link}'>"
+                f"{html.escape(entry['name'])}</a></td>"
+                f"<td>{delta.specialized:+}</td><td>{delta.adaptive:+}</td>"
+                f"<td>{delta.unquickened:+}</td></tr>"
+            )
+        file.write("</table></body></html>")
+
+    def write(self, out_dir: pathlib.Path) -> typing.List[pathlib.Path]:
+        """Write diff.html and diff.json to a directory."""
+        written = []
+        for name, write in zip(DIFF_FILES, [self.write_html, self.write_json]):
+            path = out_dir / name
+            with path.open("w", encoding="utf-8") as file:
+                write(file)
+            written.append(path)
+        return written
+
+
+def diff(
+    baseline: pathlib.Path,
+    candidate: pathlib.Path,
+    *,
+    out_dir: typing.Optional[pathlib.Path] = None,
+) -> Comparison:
+    """Compare two runs, saved as reports (or two reports of the same file).
+
+    Reports are paired up by their paths, and loaded (and compared) one pair at
+    a time, so only one file's chunks are ever held at once. Files missing from
+    either run are compared against nothing. With an output directory, a
+    diff-colored HTML page is written for each file that changed, along with
+    diff.html and diff.json for the whole comparison (raising ValueError first
+    if a file named diff would have its page overwritten by them).
+    """
+    if baseline.is_dir() != candidate.is_dir():
+        raise ValueError("Compare two directories of reports, or two reports!")
+    new_reports = _reports(candidate)
+    if baseline.is_dir():
+        old_reports = _reports(baseline)
+    else:
+        # Two single reports are compared regardless of their names:
+        old_reports = {candidate.stem: baseline}
+    if out_dir is not None:
+        # Each changed file's page is written next to diff.html:
+        if any(f"{name}.html" in DIFF_FILES for name in {*old_reports, *new_reports}):
+            raise ValueError("diff.html would overwrite the page for diff!")
+        out_dir.mkdir(parents=True, exist_ok=True)
+    comparison = Comparison()
+    for name in sorted({*old_reports, *new_reports}):
+        old_path, new_path = old_reports.get(name), new_reports.get(name)
+        file_diff = compare_chunks(
+            name,
+            () if old_path is None else load_report(old_path),
+            () if new_path is None else load_report(new_path),
+        )
+        comparison.add(file_diff)
+        if out_dir is not None and file_diff.changed:
+            page = out_dir / f"{name}.html"
+            page.parent.mkdir(parents=True, exist_ok=True)
+            with page.open("w", encoding="utf-8") as file:
+                file_diff.write_html(file)
+    if out_dir is not None:
+        comparison.write(out_dir)
+    return comparison
@@ -1,156 +1,359 @@
-import collections
-import dis
-import inspect
+import array
+import contextlib
+import io
 import itertools
+import mmap
 import os
 import pathlib
-import runpy
+import re
 import sys
-import tempfile
 import typing
 import types
 
-from . import CODE
-from .instructions import score_instruction
+from .common import walk_code
+from .instructions import classify_code
 from .stats import Stats, SourceChunk
 from .utils import (
+    Capture,
     catch_exceptions,
     main_file_for_module,
     patch_sys_argv,
     browse,
     get_code_for_path,
+    register_code,
     validate_targets,
-    audit_imports,
 )
 
-from .watch import WatchMonitor, DEFAULT_WATCH_PORT
-from .writers import Writer, HTMLWriter
+# Only the defaults are imported from the watch package up front (everything
+# else that isn't needed for analysis is imported as it's used, so that
+# importing this module stays cheap):
+from .watch import (
+    DEFAULT_WATCH_BUDGET,
+    DEFAULT_WATCH_BUFFER,
+    DEFAULT_WATCH_INTERVAL,
+    DEFAULT_WATCH_OVERFLOW,
+    DEFAULT_WATCH_PORT,
+    DEFAULT_WATCH_SERVER,
+)
+
+if typing.TYPE_CHECKING:
+    from . import summary
+    from .spool import Spool
+    from .timeline import Timeline
+    from .watch import WatchMonitor
+    from .watch.hub import OverflowPolicy
+    from .watch.monitor import ServerKind
+    from .writers import Writer
 
 FIRST_POSTION = (1, 0)
 LAST_POSITION = (sys.maxsize, 0)
 
 
-def _walk_code(code: types.CodeType) -> typing.Generator[types.CodeType, None, None]:
-    """Walk a code object, yielding all of its sub-code objects."""
-    yield code
-    for constant in code.co_consts:
-        if isinstance(constant, types.CodeType):
-            yield from _walk_code(constant)
-
-
 def _parse(code: types.CodeType) -> typing.Generator[SourceChunk, None, None]:
     """Parse a code object's source code into SourceChunks."""
-    events: collections.defaultdict[tuple[int, int], Stats] = collections.defaultdict(
-        Stats
-    )
-    events[FIRST_POSTION] = Stats()
-    events[LAST_POSITION] = Stats()
-    previous = None
-    for child in _walk_code(code):
-        # dis has a bug in how position information is computed for CACHEs:
-        fixed_positions = list(child.co_positions())
-        for instruction in dis.get_instructions(child, adaptive=True):
-            position = fixed_positions[instruction.offset // 2]
-            lineno, end_lineno, col_offset, end_col_offset = position
+    # Each scored instruction contributes one start event and one stop event.
+    # Rather than accumulating Stats objects, we record the positions and
+    # categories in flat arrays and turn them into per-chunk totals with a
+    # single prefix sum over each counter:
+    starts: list[tuple[int, int]] = []
+    stops: list[tuple[int, int]] = []
+    categories = array.array("B")
+    for child in walk_code(code):
+        # co_positions has an entry for every code unit, including CACHEs:
+        positions = list(child.co_positions())
+        for index, category in classify_code(child):
+            lineno, end_lineno, col_offset, end_col_offset = positions[index]
             if (
                 lineno is None
                 or end_lineno is None
                 or col_offset is None
                 or end_col_offset is None
             ):
-                previous = instruction
                 continue
-            stats = score_instruction(instruction, previous)
-            events[lineno, col_offset] += stats
-            events[end_lineno, end_col_offset] -= stats
-            previous = instruction
-    stats = Stats()
-    for (start, event), (stop, _) in itertools.pairwise(sorted(events.items())):
-        stats += event
-        yield SourceChunk(start, stop, stats)
+            starts.append((lineno, col_offset))
+            stops.append((end_lineno, end_col_offset))
+            categories.append(category)
+    yield from _build_chunks(starts, stops, categories)
+
+
+def _build_chunks(
+    starts: typing.Sequence[tuple[int, int]],
+    stops: typing.Sequence[tuple[int, int]],
+    categories: typing.Sequence[int],
+) -> typing.Generator[SourceChunk, None, None]:
+    """Turn start/stop events into contiguous SourceChunks."""
+    positions = sorted({FIRST_POSTION, LAST_POSITION, *starts, *stops})
+    index = {position: i for i, position in enumerate(positions)}
+    deltas = _new_deltas(len(positions))
+    for start, stop, category in zip(starts, stops, categories):
+        delta = deltas[category]
+        delta[index[start]] += 1
+        delta[index[stop]] -= 1
+    yield from _sum_chunks(positions, deltas)
+
+
+def _new_deltas(size: int) -> list["array.array[int]"]:
+    """Create one (zeroed) difference array per Stats field."""
+    # These are indexed by instructions.SPECIALIZED, ADAPTIVE, and UNQUICKENED:
+    return [array.array("q", bytes(8 * size)) for _ in range(3)]
+
+
+def _sum_chunks(
+    positions: typing.Sequence[tuple[int, int]],
+    deltas: typing.Sequence["array.array[int]"],
+) -> typing.Generator[SourceChunk, None, None]:
+    """Prefix-sum difference arrays into the SourceChunks between positions.
+
+    There's one difference array per Stats field, in order (any trailing ones,
+    like churn, may be left out).
+    """
+    totals = [itertools.accumulate(delta) for delta in deltas]
+    for start, stop, *counts in zip(positions, positions[1:], *totals):
+        yield SourceChunk(start, stop, Stats(*counts))
 
 
 AnalysisResults = typing.Tuple[str, Stats]
+PathToResults = typing.Dict[pathlib.Path, typing.Iterable[AnalysisResults]]
+
+
+def _line_starts(source: bytes | mmap.mmap) -> "array.array[int]":
+    """Find the offset of the start of each line, plus one for the end."""
+    starts = array.array("Q", [0])
+    find = source.find
+    offset = find(b"\n")
+    while offset != -1:
+        starts.append(offset + 1)
+        offset = find(b"\n", offset + 1)
+    if starts[-1] != len(source):
+        starts.append(len(source))
+    return starts
+
+
+def _split(
+    source: bytes | mmap.mmap,
+    chunks: typing.Iterable[SourceChunk],
+    starts: typing.Optional["array.array[int]"] = None,
+) -> typing.Generator[AnalysisResults, None, None]:
+    """Slice source code up into the text for each chunk."""
+    if starts is None:
+        starts = _line_starts(source)
+    lines = len(starts) - 1
+    stats = Stats()
+    start = 0
+    for chunk in chunks:
+        stats = chunk.stats
+        # Positions are (1-indexed) lines and UTF-8 byte offsets into them.
+        # Any that don't land on an actual byte of the source (like
+        # LAST_POSITION) end the final chunk at the end of the file:
+        lineno, col_offset = chunk.stop
+        if not 0 < lineno <= lines:
+            break
+        stop = starts[lineno - 1] + col_offset
+        if stop >= starts[lineno]:
+            break
+        # Slicing bytes or an mmap copies just this chunk's bytes (in C), which
+        # is cheaper for typical chunk sizes than decoding a memoryview slice:
+        yield source[start:stop].decode("utf-8"), stats
+        start = stop
+    yield source[start:].decode("utf-8"), stats
 
 
 def _read(path: pathlib.Path) -> typing.Iterable[AnalysisResults]:
     """Read the code and accumulate the results."""
     code = get_code_for_path(path)
     assert code is not None
-    parser = _parse(code)
-    chunk = next(parser)
-    group = bytearray()
-    with path.open("rb") as file:
-        for lineno, line in enumerate(file, 1):
-            for col_offset, character in enumerate(line):
-                if chunk.stop == (lineno, col_offset):
-                    yield group.decode("utf-8"), chunk.stats
-                    group.clear()
-                    chunk = next(parser)
-                    assert chunk.start == (lineno, col_offset)
-                group.append(character)
+    return _read_chunks(path, _parse(code))
 
-    yield group.decode("utf-8"), chunk.stats
+
+def _read_chunks(
+    path: pathlib.Path, chunks: typing.Iterable[SourceChunk]
+) -> typing.Generator[AnalysisResults, None, None]:
+    """Read a file, split up into the given chunks."""
+    with path.open("rb") as file:
+        if not os.fstat(file.fileno()).st_size:
+            # Empty files can't be mapped:
+            yield from _split(b"", chunks)
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as source:
+            yield from _split(source, chunks)
 
 
 def _process_analysis(
     path: typing.Optional[pathlib.Path],
     targets: typing.List[pathlib.Path],
     caught: typing.List[BaseException],
-):
-    paths = validate_targets(path, targets)
+    spool: typing.Optional["Spool"] = None,
+) -> PathToResults:
+    if spool is None:
+        paths = validate_targets(path, targets)
+    else:
+        paths = validate_targets(path, targets, found=spool.has)
 
     if caught:
         raise caught[0] from None
 
-    return paths
+    if spool is None:
+        return {p: _read(p) for p in paths}
+    return {p: spool.read(p) for p in paths}
 
 
-PathToResults = typing.Dict[pathlib.Path, typing.Iterable[AnalysisResults]]
+@contextlib.contextmanager
+def _collect(
+    spool: typing.Optional["Spool"],
+    timeline: typing.Optional["Timeline"],
+    path: typing.Optional[pathlib.Path],
+    targets: typing.List[pathlib.Path],
+) -> typing.Generator[None, None, None]:
+    """Capture the code run in this block.
+
+    Results are also collected from other processes, and a timeline sampled, if
+    asked.
+    """
+    paths = targets or ([] if path is None else [path])
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(Capture(paths=[str(p) for p in paths]))
+        if spool is not None:
+            stack.enter_context(spool.collect(paths))
+        if timeline is not None:
+            stack.enter_context(timeline.sampling(paths))
+        yield
+
+
+# Numbers the virtual filenames of code analyzed in memory:
+_VIRTUAL_FILES = itertools.count(1)
+
+# Code that mentions either of these might start processes by spawning them,
+# which re-runs __main__ (from its file) in each one:
+_SPAWNS = re.compile(r"\b(?:multiprocessing|concurrent)\b")
+
+
+def _analyze_in_memory(
+    code: str, argv: typing.Sequence[str], targets: typing.List[pathlib.Path]
+) -> PathToResults:
+    import linecache
+
+    filename = f"<specialist-{next(_VIRTUAL_FILES)}>"
+    # Entries without an mtime are never checked against (or reloaded from) disk:
+    linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+    compiled = None
+    main = sys.modules.get("__main__")
+    # Like "python -c", there's no __file__, since there's no file. Otherwise,
+    # spawned processes would try (and fail) to run it:
+    module = types.ModuleType("__main__")
+    try:
+        with _collect(None, None, None, targets):
+            with patch_sys_argv(argv), catch_exceptions() as caught:
+                compiled = compile(code, filename, "exec")
+                # Registered directly, rather than captured, since it's not a file:
+                register_code(compiled)
+                # Like runpy, replace __main__ while the code runs:
+                sys.modules["__main__"] = module
+                try:
+                    exec(compiled, module.__dict__)
+                finally:
+                    if main is None:
+                        del sys.modules["__main__"]
+                    else:
+                        sys.modules["__main__"] = main
+    finally:
+        linecache.cache.pop(filename, None)
+    if targets:
+        return _process_analysis(None, targets, caught)
+    if caught:
+        raise caught[0] from None
+    assert compiled is not None
+    source = code.encode("utf-8")
+    # Reported as __main__ (like code run from a file), since the virtual
+    # filename isn't a valid filename everywhere:
+    return {pathlib.Path("__main__.py"): list(_split(source, _parse(compiled)))}
 
 
 def analyze_code(
-    code: str, /, *argv: str, targets: typing.List[pathlib.Path]
+    code: str,
+    /,
+    *argv: str,
+    targets: typing.List[pathlib.Path],
+    spool: typing.Optional["Spool"] = None,
+    timeline: typing.Optional["Timeline"] = None,
 ) -> PathToResults:
-    sys.addaudithook(audit_imports)
+    """Analyze some source code, run as __main__.
+
+    It's compiled and run in memory, under a virtual filename (like
+    "<specialist-1>") that linecache can find its source under while it runs,
+    and its results are reported as "__main__.py". Spools and timelines look
+    their targets up on disk, though, and processes started by multiprocessing
+    may need to re-run __main__ from its file. So with a spool or timeline, or
+    for code that looks like it uses multiprocessing, the code is written to a
+    temporary file and run from there.
+    """
+    if spool is None and timeline is None and not _SPAWNS.search(code):
+        return _analyze_in_memory(code, argv, targets)
+
+    import runpy
+    import tempfile
+
     with tempfile.TemporaryDirectory() as work:
         path = pathlib.Path(work) / "__main__.py"
         path.write_text(code)
 
-        with patch_sys_argv(argv), catch_exceptions() as caught:
-            runpy.run_path(str(path), run_name="__main__")
+        with _collect(spool, timeline, path, targets):
+            with patch_sys_argv(argv), catch_exceptions() as caught:
+                runpy.run_path(str(path), run_name="__main__")
 
-        paths = _process_analysis(path, targets, caught)
-        return {p: _read(p) for p in paths}
+        results = _process_analysis(path, targets, caught, spool)
+        # The file is about to be deleted, so read everything now:
+        return {p: list(r) for p, r in results.items()}
 
 
 def analyze_module(
-    module: str, /, *argv: str, targets: typing.List[pathlib.Path]
+    module: str,
+    /,
+    *argv: str,
+    targets: typing.List[pathlib.Path],
+    spool: typing.Optional["Spool"] = None,
+    timeline: typing.Optional["Timeline"] = None,
 ) -> PathToResults:
-    with patch_sys_argv(argv), catch_exceptions() as caught:
-        runpy.run_module(module, run_name="__main__")
+    import runpy
 
     path = main_file_for_module(module)
-    paths = _process_analysis(path, targets, caught)
-    return {p: _read(p) for p in paths}
+    with _collect(spool, timeline, path, targets):
+        with patch_sys_argv(argv), catch_exceptions() as caught:
+            runpy.run_module(module, run_name="__main__")
+
+    return _process_analysis(path, targets, caught, spool)
 
 
 def analyze_file(
-    source: str, /, *argv: str, targets: typing.List[pathlib.Path]
+    source: str,
+    /,
+    *argv: str,
+    targets: typing.List[pathlib.Path],
+    spool: typing.Optional["Spool"] = None,
+    timeline: typing.Optional["Timeline"] = None,
 ) -> PathToResults:
-    sys.addaudithook(audit_imports)
-    with patch_sys_argv(argv), catch_exceptions() as caught:
-        runpy.run_path(source, run_name="__main__")
+    import runpy
 
     path = pathlib.Path(source)
-    paths = _process_analysis(path, targets, caught)
-    return {p: _read(p) for p in paths}
+    with _collect(spool, timeline, path, targets):
+        with patch_sys_argv(argv), catch_exceptions() as caught:
+            runpy.run_path(source, run_name="__main__")
+
+    return _process_analysis(path, targets, caught, spool)
 
 
 def watch(
-    *, targets: typing.List[pathlib.Path] = [], port: int = DEFAULT_WATCH_PORT
-) -> None:
-    sys.addaudithook(audit_imports)
+    *,
+    targets: typing.List[pathlib.Path] = [],
+    port: int = DEFAULT_WATCH_PORT,
+    interval: float = DEFAULT_WATCH_INTERVAL,
+    budget: float = DEFAULT_WATCH_BUDGET,
+    buffer: int = DEFAULT_WATCH_BUFFER,
+    overflow: "OverflowPolicy" = DEFAULT_WATCH_OVERFLOW,
+    server: "ServerKind" = DEFAULT_WATCH_SERVER,
+) -> "WatchMonitor":
+    import inspect
+
+    from .watch import WatchMonitor
 
     curr = inspect.currentframe()
     assert curr is not None
@@ -158,41 +361,182 @@ def watch(
     prev = curr.f_back
     assert prev is not None
 
-    CODE.add(prev.f_code)
+    register_code(prev.f_code)
     filename = prev.f_code.co_filename
 
     paths = validate_targets(pathlib.Path(filename), targets)
-    WatchMonitor(paths, port=port).start()
+    monitor = WatchMonitor(
+        paths,
+        capture=Capture(paths=[str(p) for p in paths]),
+        port=port,
+        interval=interval,
+        budget=budget,
+        buffer=buffer,
+        overflow=overflow,
+        server=server,
+    )
+    monitor.start()
+    return monitor
+
+
+class _ViewTask(typing.NamedTuple):
+    writer: "Writer"
+    path: pathlib.Path
+    results: typing.Iterable[AnalysisResults]
+    out_file: pathlib.Path
+    # The report's path relative to the index, if one is being written:
+    report: typing.Optional[str]
+    # Whether to add each code object's stats, by family, to the report:
+    families: bool
+
+
+# The reports being written by view's worker processes (which inherit this when
+# they're forked, rather than having unpicklable results sent to them):
+_VIEW_TASKS: typing.List[_ViewTask] = []
+
+
+def _write_report(task: _ViewTask) -> typing.Optional["summary.FileSummary"]:
+    from . import summary
+    from .families import code_stats
+
+    results: typing.Iterable[AnalysisResults] = task.results
+    finish = None
+    code = get_code_for_path(task.path)
+    if task.families and code is not None:
+        task.writer.add_code(code_stats(code))
+    if task.report is not None:
+        results, finish = summary.summarize(task.path, task.report, code, results)
+    task.out_file.unlink(missing_ok=True)
+    task.out_file.parent.mkdir(parents=True, exist_ok=True)
+    with task.out_file.open("wb" if task.writer.BINARY else "w") as file:
+        task.writer.write(results, file)
+    return None if finish is None else finish()
+
+
+def _write_view_task(index: int) -> typing.Optional["summary.FileSummary"]:
+    return _write_report(_VIEW_TASKS[index])
+
+
+def _write_reports(
+    tasks: typing.List[_ViewTask], jobs: int
+) -> typing.Iterator[typing.Optional["summary.FileSummary"]]:
+    """Write reports on a pool of processes (or threads, if we can't fork)."""
+    global _VIEW_TASKS
+    if jobs == 1 or len(tasks) < 2:
+        yield from map(_write_report, tasks)
+        return
+    import concurrent.futures
+    import multiprocessing
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        with concurrent.futures.ThreadPoolExecutor(jobs) as threads:
+            yield from threads.map(_write_report, tasks)
+        return
+    _VIEW_TASKS = tasks
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            jobs, mp_context=multiprocessing.get_context("fork")
+        ) as processes:
+            yield from processes.map(_write_view_task, range(len(tasks)))
+    finally:
+        _VIEW_TASKS = []
+
+
+def _reports(
+    paths: typing.Iterable[pathlib.Path], writer: "Writer"
+) -> typing.Dict[pathlib.Path, pathlib.Path]:
+    """Find where each file's report goes, relative to the output directory."""
+    paths = list(paths)
+    # Paths may be relative (like the virtual files of code analyzed in memory):
+    common_path = pathlib.Path(os.path.commonpath([p.absolute().parent for p in paths]))
+    return {
+        p: p.absolute().relative_to(common_path).with_suffix(f".{writer.EXTENSION}")
+        for p in paths
+    }
+
+
+def _check_index(reports: typing.Iterable[pathlib.Path]) -> None:
+    from .summary import INDEX_FILES
+
+    for report in reports:
+        if report.as_posix() in INDEX_FILES:
+            raise ValueError(f"The index would overwrite the report {report}!")
+
+
+def check_index(paths: typing.Iterable[pathlib.Path], writer: "Writer") -> None:
+    """Make sure that an index won't overwrite the report of any of these files."""
+    paths = list(paths)
+    if paths:
+        _check_index(_reports(paths, writer).values())
 
 
 def view(
     results: PathToResults,
     *,
-    writer: typing.Optional[Writer] = None,
+    writer: typing.Optional["Writer"] = None,
     out_dir: pathlib.Path | None,
-) -> None:
-    """View a code object's source code."""
+    jobs: int = 1,
+    index: bool = False,
+    families: bool = False,
+) -> typing.Optional["summary.Index"]:
+    """View a code object's source code.
+
+    With an output directory, reports are streamed to their files, on up to
+    jobs worker processes at once. With index, the files and functions with the
+    most adaptive instructions (and the lowest specialization rates) are also
+    ranked in index.html and index.json, which link to the reports (and which
+    refuse to overwrite any of them, raising ValueError first). With
+    families, each report also breaks down its code objects' stats by
+    specialization family (for writers that support it).
+    """
+    if jobs < 1:
+        raise ValueError("The number of jobs must be positive!")
+    from . import summary
+    from .families import code_stats
+
     if writer is None:
-        writer = HTMLWriter(blue=False, dark=False)
+        from .writers import HTMLWriter
 
-    common_path = pathlib.Path(os.path.commonpath(list(results.keys()))).resolve()
-    if out_dir is not None:
-        out_dir = out_dir.resolve()
-        out_dir.mkdir(parents=True, exist_ok=True)
+        writer = HTMLWriter(blue=False, dark=False)
 
+    if out_dir is None:
+        if writer.BINARY or index:
+            raise ValueError("This needs an output directory!")
+        for p, r in results.items():
+            page = io.StringIO()
+            page_writer = writer.copy()
+            code = get_code_for_path(p)
+            if families and code is not None:
+                page_writer.add_code(code_stats(code))
+            page_writer.write(r, page)
+            browse(page.getvalue())
+        return None
+
+    reports = _reports(results, writer)
+    if index:
+        _check_index(reports.values())
+    out_dir = out_dir.resolve()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tasks = []
     for p, r in results.items():
-        writer = writer.copy()
-
-        for source, stats in r:
-            writer.add(source, stats)
-
-        written = writer.emit()
-
-        if out_dir is not None:
-            out_file = out_dir / p.relative_to(common_path).with_suffix(
-                f".{writer.EXTENSION}"
+        report = reports[p]
+        tasks.append(
+            _ViewTask(
+                writer.copy(),
+                p,
+                r,
+                out_dir / report,
+                report.as_posix() if index else None,
+                families,
             )
-            out_file.unlink(missing_ok=True)
-            out_file.write_text(written)
-        else:
-            browse(written)
+        )
+    if not index:
+        for _ in _write_reports(tasks, jobs):
+            pass
+        return None
+    hotspots = summary.Index()
+    for file_summary in _write_reports(tasks, jobs):
+        assert file_summary is not None
+        hotspots.add(file_summary)
+    hotspots.write(out_dir)
+    return hotspots
@@ -0,0 +1,63 @@
+"""Per-code-object statistics, broken down by specialization family."""
+import array
+import dataclasses
+import pathlib
+import types
+import typing
+
+from .common import walk_code
+from .instructions import FAMILIES, count_families
+from .stats import Stats
+from .utils import get_code_for_path
+
+__all__ = ("CodeStats", "analyze_families", "code_stats")
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class CodeStats:
+    """The instruction counts for one code object (not including nested code)."""
+
+    qualname: str
+    lineno: int
+    # Indexed by 3 * family + category (see instructions.count_families):
+    counts: "array.array[int]"
+
+    def family(self, name: str) -> Stats:
+        """Get the counts for one family (like "LOAD_ATTR")."""
+        i = 3 * FAMILIES.index(name)
+        return Stats(*self.counts[i : i + 3])
+
+    def families(self) -> typing.Dict[str, Stats]:
+        """Get the counts for every family with any instructions."""
+        return {
+            name: Stats(*self.counts[3 * i : 3 * i + 3])
+            for i, name in enumerate(FAMILIES)
+            if any(self.counts[3 * i : 3 * i + 3])
+        }
+
+    @property
+    def total(self) -> Stats:
+        return Stats(*(sum(self.counts[i::3]) for i in range(3)))
+
+
+def code_stats(code: types.CodeType) -> typing.List[CodeStats]:
+    """Count the instructions in a code object, and every code object in it."""
+    return [
+        CodeStats(child.co_qualname, child.co_firstlineno, count_families(child))
+        for child in walk_code(code)
+    ]
+
+
+def analyze_families(
+    paths: typing.Iterable[pathlib.Path],
+) -> typing.Dict[pathlib.Path, typing.List[CodeStats]]:
+    """Get the code stats for files that have been run (like analyze_*'s results).
+
+    For example: analyze_families(analyze_file("spam.py", targets=[]))
+    """
+    results = {}
+    for path in paths:
+        code = get_code_for_path(path)
+        if code is not None:
+            results[path] = code_stats(code)
+    return results
@@ -1,28 +1,174 @@
+import array
 import dis
 import opcode
+import types
+import typing
+import weakref
 
 from .stats import Stats
 
 SPECIALIZED_INSTRUCTIONS = frozenset(opcode._specialized_instructions)  # type: ignore # attr is defined
 
+# Categories are indices into Stats' fields, in order:
+SPECIALIZED = 0
+ADAPTIVE = 1
+UNQUICKENED = 2
+# Only used internally by classify_code, and always reported as SPECIALIZED:
+SUPERINSTRUCTION = 3
+
+_SCORES = (Stats(specialized=1), Stats(adaptive=1), Stats(unquickened=1))
+
+
+def _kind(name: str) -> int:
+    if name not in SPECIALIZED_INSTRUCTIONS:
+        return UNQUICKENED
+    if "__" in name:
+        return SUPERINSTRUCTION
+    if name.endswith("_ADAPTIVE"):
+        return ADAPTIVE
+    return SPECIALIZED
+
+
+# Lookup tables indexed by (possibly quickened) opcode. _KINDS holds each
+# opcode's category, and _STEPS holds the number of code units to advance past
+# it (the instruction itself, plus any inline CACHE entries):
+_KINDS = bytes(_kind(name) for name in dis._all_opname)  # type: ignore # attr is defined
+_STEPS = bytes(
+    1 + opcode._inline_cache_entries[dis._deoptop(op)]  # type: ignore # attrs are defined
+    for op in range(len(dis._all_opname))  # type: ignore # attr is defined
+)
+
+# Specialization families, named after the instructions that get specialized
+# (plus OTHER, for everything else). FAMILY maps each (possibly quickened)
+# opcode to the index of its family:
+FAMILIES: typing.Tuple[str, ...] = (*opcode._specializations, "OTHER")  # type: ignore # attr is defined
+OTHER = len(FAMILIES) - 1
+
+
+def _family(op: int) -> int:
+    name = dis._all_opname[dis._deoptop(op)]  # type: ignore # attrs are defined
+    return FAMILIES.index(name) if name in FAMILIES else OTHER
+
+
+FAMILY = bytes(_family(op) for op in range(len(dis._all_opname)))  # type: ignore # attr is defined
+
+_JUMP_TARGETS: "weakref.WeakKeyDictionary[types.CodeType, bytes]" = (
+    weakref.WeakKeyDictionary()
+)
+
 
 def is_superinstruction(instruction: dis.Instruction) -> bool:
     """Check if an instruction is a superinstruction."""
     return "__" in instruction.opname
 
 
-def score_instruction(
+def classify_instruction(
     instruction: dis.Instruction, previous: dis.Instruction | None
-) -> "Stats":
-    """Score an instruction's importance."""
+) -> int:
+    """Classify an instruction as SPECIALIZED, ADAPTIVE, or UNQUICKENED."""
     if instruction.opname in SPECIALIZED_INSTRUCTIONS:
         if instruction.opname.endswith("_ADAPTIVE"):
-            return Stats(adaptive=True)
-        return Stats(specialized=True)
+            return ADAPTIVE
+        return SPECIALIZED
     if (
         previous is not None
         and is_superinstruction(previous)
         and not instruction.is_jump_target
     ):
-        return Stats(specialized=True)
-    return Stats(unquickened=True)
+        return SPECIALIZED
+    return UNQUICKENED
+
+
+def score_instruction(
+    instruction: dis.Instruction, previous: dis.Instruction | None
+) -> "Stats":
+    """Score an instruction's importance."""
+    return _SCORES[classify_instruction(instruction, previous)]
+
+
+def _jump_targets(code: types.CodeType) -> bytes:
+    """Get a bitmap (one byte per code unit) of a code object's jump targets."""
+    targets = _JUMP_TARGETS.get(code)
+    if targets is None:
+        bitmap = bytearray(len(code.co_code) // 2)
+        # co_code is never quickened, so its jumps are all recognized by dis:
+        for offset in dis.findlabels(code.co_code):
+            bitmap[offset // 2] = True
+        for entry in dis._parse_exception_table(code):  # type: ignore # attr is defined
+            if entry.start < entry.end:
+                bitmap[entry.target // 2] = True
+        targets = _JUMP_TARGETS[code] = bytes(bitmap)
+    return targets
+
+
+def classify_code(code: types.CodeType) -> typing.Iterator[tuple[int, int]]:
+    """Classify each instruction in a code object's quickened bytecode.
+
+    This matches calling classify_instruction on the results of
+    dis.get_instructions(code, adaptive=True) (except that jump targets are
+    found in the unquickened bytecode), but works directly on the raw bytecode
+    without building any Instruction objects. It yields (index, category) pairs,
+    where index is measured in code units (so it lines up with
+    code.co_positions()).
+    """
+    opcodes = code._co_code_adaptive[::2]  # type: ignore # attr is defined
+    targets = _jump_targets(code)
+    kinds = _KINDS
+    steps = _STEPS
+    after_superinstruction = False
+    index = 0
+    size = len(opcodes)
+    while index < size:
+        op = opcodes[index]
+        kind = kinds[op]
+        if kind == SUPERINSTRUCTION or (
+            after_superinstruction and kind == UNQUICKENED and not targets[index]
+        ):
+            yield index, SPECIALIZED
+        else:
+            yield index, kind
+        after_superinstruction = kind == SUPERINSTRUCTION
+        index += steps[op]
+
+
+class Fingerprint:
+    """Fingerprint the quickened instructions of a code object, each time it's called.
+
+    Inline caches (like the counters of adaptive instructions) change on almost
+    every call, so they're masked out, leaving only the instructions themselves.
+    Their positions never change, so the mask is built once, up front. Masking
+    is only redone when the bytecode has changed at all since the last call.
+    """
+
+    __slots__ = ("code", "_mask", "_quickened", "_fingerprint")
+
+    def __init__(self, code: types.CodeType) -> None:
+        self.code = code
+        mask = bytearray(len(code.co_code))
+        for index, _ in classify_code(code):
+            mask[2 * index : 2 * index + 2] = b"\xff\xff"
+        self._mask = int.from_bytes(mask, "little")
+        self._quickened: typing.Optional[int] = None
+        self._fingerprint = 0
+
+    def __call__(self) -> int:
+        quickened = self.code._co_code_adaptive  # type: ignore # attr is defined
+        if hash(quickened) != self._quickened:
+            self._quickened = hash(quickened)
+            masked = int.from_bytes(quickened, "little") & self._mask
+            self._fingerprint = hash(masked)
+        return self._fingerprint
+
+
+def count_families(code: types.CodeType) -> "array.array[int]":
+    """Count a code object's own instructions by family and category.
+
+    The counts for FAMILIES[family] and category are at 3 * family + category.
+    Nested code objects aren't included.
+    """
+    counts = array.array("L", bytes(array.array("L").itemsize * 3 * len(FAMILIES)))
+    opcodes = code._co_code_adaptive[::2]  # type: ignore # attr is defined
+    family = FAMILY
+    for index, category in classify_code(code):
+        counts[3 * family[opcodes[index]] + category] += 1
+    return counts
@@ -0,0 +1,160 @@
+"""Profile a single function in-process: warm it up, then time it."""
+import dataclasses
+import linecache
+import time
+import types
+import typing
+
+from .common import walk_code
+from .core import AnalysisResults, _parse, _split
+from .instructions import Fingerprint, classify_code
+from .stats import SourceChunk, Stats
+
+__all__ = (
+    "DEFAULT_PROFILE_ITERATIONS",
+    "DEFAULT_PROFILE_STABLE",
+    "DEFAULT_PROFILE_WARMUP",
+    "Profile",
+    "Timing",
+    "profile",
+)
+
+DEFAULT_PROFILE_ITERATIONS = 1000
+DEFAULT_PROFILE_STABLE = 100
+DEFAULT_PROFILE_WARMUP = 10_000
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Timing:
+    """Statistics for the wall time (in seconds) of each timed call."""
+
+    iterations: int
+    total: float
+    mean: float
+    median: float
+    stdev: float
+    best: float
+    worst: float
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Profile:
+    """A function's specialization (after it was timed), and its timings."""
+
+    # The function's source, split into chunks:
+    results: typing.List[AnalysisResults]
+    timing: Timing
+    # How many warm-up calls were made:
+    warmup: int
+    # Whether it stabilized at all (rather than running out of warm-up calls):
+    stable: bool
+
+    @property
+    def totals(self) -> Stats:
+        return sum((stats for _, stats in self.results), Stats())
+
+
+def _code(function: typing.Callable[..., object]) -> types.CodeType:
+    code = getattr(getattr(function, "__func__", function), "__code__", None)
+    if not isinstance(code, types.CodeType):
+        raise TypeError(f"Can't profile {function!r} (it isn't a Python function)!")
+    return code
+
+
+class _Fingerprint:
+    """Fingerprint the quickened opcodes of some code, and all of its nested code."""
+
+    def __init__(self, code: types.CodeType) -> None:
+        self._children = [Fingerprint(child) for child in walk_code(code)]
+
+    def __call__(self) -> int:
+        return hash(tuple(fingerprint() for fingerprint in self._children))
+
+
+def _timing(times: typing.List[float]) -> Timing:
+    import statistics
+
+    return Timing(
+        len(times),
+        sum(times),
+        statistics.fmean(times),
+        statistics.median(times),
+        statistics.stdev(times) if len(times) > 1 else 0.0,
+        min(times),
+        max(times),
+    )
+
+
+def _results(
+    code: types.CodeType, module_globals: typing.Dict[str, typing.Any]
+) -> typing.List[AnalysisResults]:
+    """Split just the function's own lines of source up into chunks."""
+    lines = linecache.getlines(code.co_filename, module_globals)
+    if not lines:
+        raise ValueError(f"Can't find the source for {code.co_qualname}!")
+    first = code.co_firstlineno
+    last = max(
+        position[1]
+        for child in walk_code(code)
+        for position in child.co_positions()
+        if position[1] is not None
+    )
+    source = "".join(lines[first - 1 : last]).encode("utf-8")
+    # Positions are shifted to be relative to the first line, skipping the
+    # chunk before it:
+    chunks = (
+        SourceChunk(
+            (chunk.start[0] - first + 1, chunk.start[1]),
+            (chunk.stop[0] - first + 1, chunk.stop[1]),
+            chunk.stats,
+        )
+        for chunk in _parse(code)
+        if (first, 0) < chunk.stop
+    )
+    return list(_split(source, chunks))
+
+
+def profile(
+    function: typing.Callable[..., object],
+    args: typing.Sequence[object] = (),
+    kwargs: typing.Optional[typing.Mapping[str, object]] = None,
+    *,
+    iterations: int = DEFAULT_PROFILE_ITERATIONS,
+    warmup: int = DEFAULT_PROFILE_WARMUP,
+    stable: int = DEFAULT_PROFILE_STABLE,
+) -> Profile:
+    """Warm up and time calls to a function, then analyze its specialization.
+
+    The function is called until its quickened instructions (including those of
+    any nested code, like comprehensions) haven't changed for stable calls in a
+    row, or warmup calls have been made. Then each of iterations more calls is timed.
+    """
+    if iterations < 1:
+        raise ValueError("The number of iterations must be positive!")
+    if warmup < 0:
+        raise ValueError("The number of warm-up calls can't be negative!")
+    if stable < 1:
+        raise ValueError("The number of stable calls must be positive!")
+    if kwargs is None:
+        kwargs = {}
+    code = _code(function)
+    fingerprinter = _Fingerprint(code)
+    fingerprint = fingerprinter()
+    unchanged = 0
+    calls = 0
+    while calls < warmup and unchanged < stable:
+        function(*args, **kwargs)
+        calls += 1
+        last, fingerprint = fingerprint, fingerprinter()
+        unchanged = unchanged + 1 if fingerprint == last else 0
+    times = []
+    timer = time.perf_counter
+    for _ in range(iterations):
+        start = timer()
+        function(*args, **kwargs)
+        times.append(timer() - start)
+    function = getattr(function, "__func__", function)
+    module_globals = getattr(function, "__globals__", {})
+    return Profile(
+        _results(code, module_globals), _timing(times), calls, unchanged == stable
+    )
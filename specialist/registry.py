@@ -0,0 +1,185 @@
+"""The registry of captured module-level code objects (specialist.CODE)."""
+import collections
+import collections.abc
+import os
+import pathlib
+import sys
+import types
+import typing
+import weakref
+
+from .common import normalize_path, walk_code
+
+__all__ = ("CodeRegistry", "RegistryStats")
+
+
+class RegistryStats(typing.NamedTuple):
+    """How much a registry is holding on to."""
+
+    # Code held strongly (for files that existed when it was captured):
+    files: int
+    # Code held weakly (for anything else, like "<string>"), that's still alive:
+    other: int
+    # Files whose code was evicted to stay within the limit:
+    evicted: int
+    # Roughly how much memory the strongly held code (and its nested code) uses:
+    size: int
+
+
+def _size(code: types.CodeType) -> int:
+    return sum(
+        sys.getsizeof(child)
+        + sys.getsizeof(child.co_linetable)
+        + sys.getsizeof(child.co_exceptiontable)
+        for child in walk_code(code)
+    )
+
+
+class CodeRegistry(collections.abc.MutableSet[types.CodeType]):
+    """Captured module-level code, holding only the newest code for each file.
+
+    Adding code for a file replaces any code already held for it (so reloaded
+    modules resolve to their newest code). Nothing else usually keeps
+    module-level code alive once it's run, so code for real files is held
+    strongly: up to limit files (if there is a limit), evicting the least
+    recently added or looked-up file to make room. Pinned files (like watched
+    targets) count towards the limit, but are never evicted. Code for anything
+    else (like exec'd strings, which can't be looked up by path anyway) is only
+    held weakly.
+    Membership is by identity, since code objects from different files compare
+    equal if their contents do.
+    """
+
+    def __init__(self, *, limit: typing.Optional[int] = None) -> None:
+        self._files: collections.OrderedDict[str, types.CodeType] = (
+            collections.OrderedDict()
+        )
+        # Normalized filenames, keyed by the (st_dev, st_ino) of each file when
+        # its code was captured (and the other way around):
+        self._ids: typing.Dict[typing.Tuple[int, int], str] = {}
+        self._file_ids: typing.Dict[str, typing.Tuple[int, int]] = {}
+        self._other: "weakref.WeakValueDictionary[str, types.CodeType]" = (
+            weakref.WeakValueDictionary()
+        )
+        self._limit = limit
+        # How many times each normalized filename has been pinned:
+        self._pinned: collections.Counter[str] = collections.Counter()
+        self.evicted = 0
+
+    @property
+    def limit(self) -> typing.Optional[int]:
+        """The most files to hold code for (or None, for no limit)."""
+        return self._limit
+
+    @limit.setter
+    def limit(self, limit: typing.Optional[int]) -> None:
+        if limit is not None and limit < 1:
+            raise ValueError("The limit must be positive!")
+        self._limit = limit
+        self._evict()
+
+    def _forget(self, key: str) -> None:
+        del self._files[key]
+        file_id = self._file_ids.pop(key, None)
+        if file_id is not None and self._ids.get(file_id) == key:
+            del self._ids[file_id]
+
+    def pin(self, path: pathlib.Path) -> None:
+        """Never evict a file's code (until it's unpinned as many times)."""
+        self._pinned[normalize_path(path)] += 1
+
+    def unpin(self, path: pathlib.Path) -> None:
+        key = normalize_path(path)
+        self._pinned[key] -= 1
+        if self._pinned[key] <= 0:
+            del self._pinned[key]
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._limit is not None and self._limit < len(self._files):
+            key = next((key for key in self._files if key not in self._pinned), None)
+            if key is None:
+                # Everything left is pinned.
+                return
+            self._forget(key)
+            self.evicted += 1
+
+    def add(self, code: types.CodeType) -> None:
+        key = normalize_path(code.co_filename)
+        try:
+            stat = os.stat(code.co_filename)
+        except (OSError, ValueError):
+            if key in self._files:
+                self._forget(key)
+            self._other[key] = code
+            return
+        self._other.pop(key, None)
+        if key in self._files:
+            self._forget(key)
+        self._files[key] = code
+        file_id = stat.st_dev, stat.st_ino
+        self._ids[file_id] = key
+        self._file_ids[key] = file_id
+        self._evict()
+
+    def discard(self, code: types.CodeType) -> None:
+        key = normalize_path(code.co_filename)
+        if self._files.get(key) is code:
+            self._forget(key)
+        elif self._other.get(key) is code:
+            del self._other[key]
+
+    def __contains__(self, code: object) -> bool:
+        if not isinstance(code, types.CodeType):
+            return False
+        key = normalize_path(code.co_filename)
+        return self._files.get(key) is code or self._other.get(key) is code
+
+    def __iter__(self) -> typing.Iterator[types.CodeType]:
+        yield from list(self._files.values())
+        yield from list(self._other.values())
+
+    def __len__(self) -> int:
+        return len(self._files) + len(self._other)
+
+    @staticmethod
+    def _names(key: str, path: pathlib.Path, file_id: typing.Tuple[int, int]) -> bool:
+        """Check that a key still names the file with this id."""
+        if key == normalize_path(path):
+            return True
+        try:
+            stat = os.stat(key)
+        except (OSError, ValueError):
+            return False
+        return (stat.st_dev, stat.st_ino) == file_id
+
+    def get(self, path: pathlib.Path) -> typing.Optional[types.CodeType]:
+        """Get the code for a file (if it still exists)."""
+        try:
+            stat = path.stat()
+        except (OSError, ValueError):
+            return None
+        file_id = stat.st_dev, stat.st_ino
+        key = self._ids.get(file_id)
+        if key is not None and not self._names(key, path, file_id):
+            # The file was deleted (or moved) and its id reused, so it's stale:
+            del self._ids[file_id]
+            if self._file_ids.get(key) == file_id:
+                del self._file_ids[key]
+            key = None
+        code = None if key is None else self._files.get(key)
+        if code is None:
+            # The file may have been replaced since its code was captured:
+            key = normalize_path(path)
+            code = self._files.get(key)
+        if code is not None:
+            self._files.move_to_end(key)
+        return code
+
+    def stats(self) -> RegistryStats:
+        return RegistryStats(
+            len(self._files),
+            len(self._other),
+            self.evicted,
+            sum(map(_size, self._files.values())),
+        )
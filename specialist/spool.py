@@ -0,0 +1,316 @@
+"""Collect and merge results from other processes (like workers and test runners).
+
+While a Spool is collecting, child processes started with the current environment
+(by subprocess, multiprocessing, pytest-xdist, gunicorn, and so on) capture their
+own code, and write their results for the target files into a spool directory
+when they exit or are terminated (or whenever they call snapshot()). Forked
+children do the same. Processes that are killed outright (or that leave with
+os._exit) never get the chance, so their results are missing.
+Afterwards, each file's results are merged by summing the Stats of every process
+that ran it.
+"""
+import atexit
+import contextlib
+import json
+import os
+import pathlib
+import signal
+import sys
+import types
+import typing
+
+from .core import (
+    FIRST_POSTION,
+    LAST_POSITION,
+    AnalysisResults,
+    _new_deltas,
+    _parse,
+    _read_chunks,
+    _sum_chunks,
+)
+from .stats import SourceChunk
+from .utils import Capture, get_code_for_path
+
+__all__ = ("ENVIRONMENT_VARIABLE", "Spool", "enable", "snapshot")
+
+# The spool directory for child processes to write their results to:
+ENVIRONMENT_VARIABLE = "SPECIALIST_SPOOL"
+
+_ROOT = str(pathlib.Path(__file__).resolve().parent.parent)
+_TARGETS = "targets.json"
+_SITE = "site"
+
+# Loaded by child processes at startup (see the site module), this enables
+# capturing and then runs any other sitecustomize module that it's shadowing.
+# Specialist itself may not be installed (or even on the path yet):
+_SITECUSTOMIZE = """\
+import importlib.machinery
+import importlib.util
+import sys
+
+if importlib.util.find_spec("specialist") is None:
+    sys.path.append({root!r})
+try:
+    import specialist.spool
+except ImportError:
+    pass
+else:
+    specialist.spool.enable()
+
+_path = [entry for entry in sys.path if entry != {site!r}]
+_spec = importlib.machinery.PathFinder.find_spec("sitecustomize", _path)
+if _spec is not None and _spec.loader is not None:
+    _spec.loader.exec_module(sys.modules[__name__])
+"""
+
+# [start_lineno, start_col_offset, stop_lineno, stop_col_offset, specialized,
+# adaptive, unquickened] for each chunk:
+_Row = typing.List[int]
+
+# The process that enable() was last called in, and this process's spool file:
+_ENABLED_PID: typing.Optional[int] = None
+_SPOOL_FILE: typing.Optional[typing.Tuple[int, str]] = None
+_FORK_HOOK_REGISTERED = False
+
+
+def _spool_file(directory: pathlib.Path) -> pathlib.Path:
+    global _SPOOL_FILE
+    pid = os.getpid()
+    if _SPOOL_FILE is None or _SPOOL_FILE[0] != pid:
+        # Process IDs can be reused by later workers, so make the name unique:
+        _SPOOL_FILE = pid, f"{pid}-{os.urandom(16).hex()}.json"
+    return directory / _SPOOL_FILE[1]
+
+
+def snapshot(
+    directory: typing.Optional[pathlib.Path] = None,
+) -> typing.Optional[pathlib.Path]:
+    """Write this process's current results for the spool's targets.
+
+    Later snapshots from the same process replace earlier ones.
+    """
+    if directory is None:
+        spool = os.environ.get(ENVIRONMENT_VARIABLE)
+        if spool is None:
+            return None
+        directory = pathlib.Path(spool)
+    targets = _read_targets(directory)
+    if targets is None:
+        # The spool has already been collected.
+        return None
+    files: typing.Dict[str, typing.List[_Row]] = {}
+    for target in targets:
+        code = get_code_for_path(pathlib.Path(target))
+        if code is not None:
+            files[target] = _rows(code)
+    path = _spool_file(directory)
+    temporary = path.with_suffix(".tmp")
+    temporary.write_text(json.dumps({"pid": os.getpid(), "files": files}))
+    temporary.replace(path)
+    return path
+
+
+def _read_targets(directory: pathlib.Path) -> typing.Optional[typing.List[str]]:
+    try:
+        return json.loads((directory / _TARGETS).read_text())
+    except FileNotFoundError:
+        return None
+
+
+def _rows(code: types.CodeType) -> typing.List[_Row]:
+    rows = []
+    for chunk in _parse(code):
+        stats = chunk.stats
+        rows.append(
+            [
+                *chunk.start,
+                *chunk.stop,
+                stats.specialized,
+                stats.adaptive,
+                stats.unquickened,
+            ]
+        )
+    return rows
+
+
+def _snapshot_at_exit() -> None:
+    if _ENABLED_PID == os.getpid():
+        snapshot()
+
+
+def _snapshot_on_sigterm(signum: int, _: typing.Optional[types.FrameType]) -> None:
+    # multiprocessing terminates workers with SIGTERM (for instance, when leaving
+    # a "with Pool(...)" block), which skips both atexit and its finalizers:
+    _snapshot_at_exit()
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+
+def _register_sigterm_handler() -> None:
+    # Leave any handler that the code being run installed itself alone:
+    if signal.getsignal(signal.SIGTERM) not in {signal.SIG_DFL, _snapshot_on_sigterm}:
+        return
+    try:
+        signal.signal(signal.SIGTERM, _snapshot_on_sigterm)
+    except ValueError:
+        # Only the main thread can handle signals.
+        pass
+
+
+class _AfterFork:
+    """Something for multiprocessing to keep a weak reference to."""
+
+
+_AFTER_FORK = _AfterFork()
+
+
+def _register_finalizer(_: object = None) -> None:
+    from multiprocessing.util import Finalize
+
+    Finalize(None, _snapshot_at_exit, exitpriority=0)
+
+
+def _register_exit_hooks() -> None:
+    global _ENABLED_PID
+    _ENABLED_PID = os.getpid()
+    atexit.register(_snapshot_at_exit)
+    _register_sigterm_handler()
+    # multiprocessing's children skip atexit, but do run its finalizers. Forked
+    # ones throw away their parent's finalizers first, then run these hooks:
+    if "multiprocessing.util" in sys.modules:
+        from multiprocessing.util import register_after_fork
+
+        _register_finalizer()
+        register_after_fork(_AFTER_FORK, _register_finalizer)
+
+
+def _after_fork_in_child() -> None:
+    # Forked children already have the parent's audit hook and captured code:
+    if ENVIRONMENT_VARIABLE in os.environ:
+        _register_exit_hooks()
+
+
+def _register_fork_hook() -> None:
+    global _FORK_HOOK_REGISTERED
+    if not _FORK_HOOK_REGISTERED:
+        os.register_at_fork(after_in_child=_after_fork_in_child)
+        _FORK_HOOK_REGISTERED = True
+
+
+def enable() -> None:
+    """Start capturing code in a child process, and snapshot it at exit."""
+    if ENVIRONMENT_VARIABLE not in os.environ or _ENABLED_PID == os.getpid():
+        return
+    # Only the targets are captured (or everything, if they can't be read):
+    Capture(paths=_read_targets(pathlib.Path(os.environ[ENVIRONMENT_VARIABLE]))).start()
+    _register_exit_hooks()
+    _register_fork_hook()
+
+
+def _merge(
+    results: typing.Iterable[typing.List[_Row]],
+) -> typing.Generator[SourceChunk, None, None]:
+    """Sum several processes' chunks into one set of chunks."""
+    # Turn each process's chunks back into difference events, and sum those:
+    events: typing.Dict[typing.Tuple[int, int], typing.List[int]] = {
+        FIRST_POSTION: [0, 0, 0],
+        LAST_POSITION: [0, 0, 0],
+    }
+    for rows in results:
+        previous = (0, 0, 0)
+        stop = LAST_POSITION
+        for start_lineno, start_col, stop_lineno, stop_col, *stats in rows:
+            delta = events.setdefault((start_lineno, start_col), [0, 0, 0])
+            for i in range(3):
+                delta[i] += stats[i] - previous[i]
+            previous = tuple(stats)
+            stop = (stop_lineno, stop_col)
+        delta = events.setdefault(stop, [0, 0, 0])
+        for i in range(3):
+            delta[i] -= previous[i]
+    positions = sorted(events)
+    deltas = _new_deltas(len(positions))
+    for i, position in enumerate(positions):
+        for delta, value in zip(deltas, events[position]):
+            delta[i] = value
+    return _sum_chunks(positions, deltas)
+
+
+class Spool:
+    """Gather results for target files from other processes.
+
+    Pass one to analyze_code, analyze_module, or analyze_file to include the
+    results of any processes started (or forked) while the code is running.
+    """
+
+    def __init__(self) -> None:
+        # Every other process's rows for each (resolved) target path:
+        self._results: typing.Dict[str, typing.List[typing.List[_Row]]] = {}
+
+    @contextlib.contextmanager
+    def collect(
+        self, targets: typing.Iterable[pathlib.Path]
+    ) -> typing.Generator[None, None, None]:
+        """Capture the targets in child processes started within this block."""
+        import tempfile
+
+        with tempfile.TemporaryDirectory(prefix="specialist-") as work:
+            directory = pathlib.Path(work)
+            paths = [str(target.resolve()) for target in targets]
+            (directory / _TARGETS).write_text(json.dumps(paths))
+            site = directory / _SITE
+            site.mkdir()
+            (site / "sitecustomize.py").write_text(
+                _SITECUSTOMIZE.format(root=_ROOT, site=str(site))
+            )
+            environment = {
+                name: os.environ.get(name)
+                for name in (ENVIRONMENT_VARIABLE, "PYTHONPATH")
+            }
+            python_path = environment["PYTHONPATH"]
+            os.environ[ENVIRONMENT_VARIABLE] = str(directory)
+            os.environ["PYTHONPATH"] = os.pathsep.join(
+                [str(site), *([python_path] if python_path else [])]
+            )
+            _register_fork_hook()
+            try:
+                yield
+            finally:
+                for name, value in environment.items():
+                    if value is None:
+                        os.environ.pop(name, None)
+                    else:
+                        os.environ[name] = value
+                # Stop any stragglers from writing more snapshots:
+                (directory / _TARGETS).unlink()
+                self._load(directory)
+
+    def _load(self, directory: pathlib.Path) -> None:
+        for path in directory.glob("*.json"):
+            try:
+                files = json.loads(path.read_text())["files"]
+            except (OSError, ValueError, KeyError):
+                # A worker died while writing it.
+                continue
+            for target, rows in files.items():
+                self._results.setdefault(target, []).append(rows)
+
+    def _all_results(self, path: pathlib.Path) -> typing.List[typing.List[_Row]]:
+        results = list(self._results.get(str(path.resolve()), []))
+        code = get_code_for_path(path)
+        if code is not None:
+            results.append(_rows(code))
+        return results
+
+    def has(self, path: pathlib.Path) -> bool:
+        """Check whether any process (including this one) ran a file."""
+        return self.workers(path) > 0
+
+    def workers(self, path: pathlib.Path) -> int:
+        """Count the processes (including this one) that ran a file."""
+        count = len(self._results.get(str(path.resolve()), []))
+        return count + (get_code_for_path(path) is not None)
+
+    def read(self, path: pathlib.Path) -> typing.Iterable[AnalysisResults]:
+        """Read a file, with the merged results of every process that ran it."""
+        return _read_chunks(path, _merge(self._all_results(path)))
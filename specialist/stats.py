@@ -8,6 +8,9 @@ class Stats:
     specialized: int = 0
     adaptive: int = 0
     unquickened: int = 0
+    # How many times instructions here have been seen to deoptimize, respecialize,
+    # or switch specializations (only tracked by analysis.Analyzer):
+    churn: int = 0
 
     def __add__(self, other: "Stats") -> "Stats":
         if not isinstance(other, Stats):
@@ -16,6 +19,7 @@ class Stats:
             specialized=self.specialized + other.specialized,
             adaptive=self.adaptive + other.adaptive,
             unquickened=self.unquickened + other.unquickened,
+            churn=self.churn + other.churn,
         )
 
     def __sub__(self, other: "Stats") -> "Stats":
@@ -25,6 +29,7 @@ class Stats:
             specialized=self.specialized - other.specialized,
             adaptive=self.adaptive - other.adaptive,
             unquickened=self.unquickened - other.unquickened,
+            churn=self.churn - other.churn,
         )
 
 
@@ -0,0 +1,198 @@
+"""Project-wide summaries, for finding hot spots across many reports."""
+import dataclasses
+import heapq
+import html
+import json
+import pathlib
+import types
+import typing
+
+from .families import code_stats
+from .stats import Stats
+
+__all__ = ("INDEX_FILES", "FileSummary", "Hotspot", "Index", "summarize")
+
+# What Index.write writes (next to the reports, which mustn't be named the same):
+INDEX_FILES = ("index.html", "index.json")
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Hotspot:
+    """The totals for one file or function."""
+
+    name: str
+    # The report for the file, relative to the index:
+    report: str
+    lineno: int
+    stats: Stats
+
+    @property
+    def quickened(self) -> int:
+        return self.stats.specialized + self.stats.adaptive
+
+    @property
+    def ratio(self) -> float:
+        """The fraction of quickened instructions that are specialized."""
+        return self.stats.specialized / self.quickened if self.quickened else 0.0
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class FileSummary:
+    """A file's totals, and those of each function in it."""
+
+    file: Hotspot
+    functions: typing.Tuple[Hotspot, ...]
+
+
+def summarize(
+    path: pathlib.Path,
+    report: str,
+    code: typing.Optional[types.CodeType],
+    chunks: typing.Iterable[typing.Tuple[str, Stats]],
+) -> typing.Tuple[
+    typing.Iterator[typing.Tuple[str, Stats]], typing.Callable[[], FileSummary]
+]:
+    """Summarize a file while its chunks are being streamed somewhere else.
+
+    Returns the chunks (to be consumed as usual), and a function to call once
+    they have been. Totals are exact instruction counts taken from the code, if
+    there is any. Otherwise (like for a loaded BinaryReport), they're summed
+    from the chunks, so instructions spanning several chunks count more than
+    once, and there are no functions.
+    """
+    name = str(path)
+    if code is not None:
+        module, *children = code_stats(code)
+        functions = tuple(
+            Hotspot(f"{name}:{child.qualname}", report, child.lineno, child.total)
+            for child in children
+            if any(child.counts)
+        )
+        totals = sum((function.stats for function in functions), module.total)
+        summary = FileSummary(Hotspot(name, report, 1, totals), functions)
+        return iter(chunks), lambda: summary
+
+    counts = [0, 0, 0]
+
+    def count() -> typing.Iterator[typing.Tuple[str, Stats]]:
+        for source, stats in chunks:
+            counts[0] += stats.specialized
+            counts[1] += stats.adaptive
+            counts[2] += stats.unquickened
+            yield source, stats
+
+    return count(), lambda: FileSummary(Hotspot(name, report, 1, Stats(*counts)), ())
+
+
+def _by_adaptive(hotspot: Hotspot) -> typing.Tuple[int, int]:
+    return hotspot.stats.adaptive, hotspot.quickened
+
+
+def _by_ratio(hotspot: Hotspot) -> typing.Tuple[float, int]:
+    # Worst first (so negated for heapq.nlargest), then the most quickened:
+    return -hotspot.ratio, hotspot.quickened
+
+
+class Index:
+    """Rank the files and functions of many reports, keeping only the top few.
+
+    Summaries can be added one file at a time, and only the best candidates
+    for each ranking are kept between additions.
+    """
+
+    def __init__(self, *, limit: int = 50) -> None:
+        self._limit = limit
+        self.totals = Stats()
+        self.files = 0
+        self._rankings: typing.Dict[str, typing.List[Hotspot]] = {
+            "files_by_adaptive": [],
+            "files_by_ratio": [],
+            "functions_by_adaptive": [],
+            "functions_by_ratio": [],
+        }
+
+    def _rank(self, name: str, hotspots: typing.Iterable[Hotspot]) -> None:
+        key = _by_adaptive if name.endswith("adaptive") else _by_ratio
+        candidates = [h for h in hotspots if h.quickened]
+        self._rankings[name] = heapq.nlargest(
+            self._limit, [*self._rankings[name], *candidates], key=key
+        )
+
+    def add(self, summary: FileSummary) -> None:
+        self.files += 1
+        self.totals += summary.file.stats
+        self._rank("files_by_adaptive", [summary.file])
+        self._rank("files_by_ratio", [summary.file])
+        self._rank("functions_by_adaptive", summary.functions)
+        self._rank("functions_by_ratio", summary.functions)
+
+    def ranking(self, name: str) -> typing.List[Hotspot]:
+        """Get one of the rankings (see the keys of the JSON index)."""
+        return list(self._rankings[name])
+
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        def entry(hotspot: Hotspot) -> typing.Dict[str, typing.Any]:
+            return {
+                "name": hotspot.name,
+                "report": hotspot.report,
+                "lineno": hotspot.lineno,
+                "specialized": hotspot.stats.specialized,
+                "adaptive": hotspot.stats.adaptive,
+                "unquickened": hotspot.stats.unquickened,
+                "ratio": hotspot.ratio,
+            }
+
+        return {
+            "files": self.files,
+            "totals": dataclasses.asdict(self.totals),
+            **{
+                name: [entry(hotspot) for hotspot in hotspots]
+                for name, hotspots in self._rankings.items()
+            },
+        }
+
+    def write_json(self, file: typing.TextIO) -> None:
+        json.dump(self.as_dict(), file, indent=1)
+
+    def write_html(self, file: typing.TextIO) -> None:
+        titles = {
+            "files_by_adaptive": "Files with the most adaptive instructions",
+            "files_by_ratio": "Files with the lowest specialized/quickened ratio",
+            "functions_by_adaptive": "Functions with the most adaptive instructions",
+            "functions_by_ratio": "Functions with the lowest specialized/quickened ratio",
+        }
+        total = self.totals
+        file.write(
+            "<!doctype html><html><head>"
+            "<meta http-equiv='content-type' content='text/html;charset=utf-8'/>"
+            "<style>td,th{padding:0 1em;text-align:right}"
+            "td:first-child,th:first-child{text-align:left}</style>"
+            "</head><body>"
+            f"<p>{self.files} files: {total.specialized} specialized, "
+            f"{total.adaptive} adaptive, {total.unquickened} unquickened</p>"
+        )
+        for name, title in titles.items():
+            file.write(
+                f"<h2>{title}</h2><table><tr><th>Name</th><th>Specialized</th>"
+                "<th>Adaptive</th><th>Unquickened</th><th>Ratio</th></tr>"
+            )
+            for hotspot in self._rankings[name]:
+                link = html.escape(hotspot.report, quote=True)
+                stats = hotspot.stats
+                file.write(
+                    f"<tr><td><a href='{link}'>{html.escape(hotspot.name)}</a></td>"
+                    f"<td>{stats.specialized}</td><td>{stats.adaptive}</td>"
+                    f"<td>{stats.unquickened}</td><td>{hotspot.ratio:.0%}</td></tr>"
+                )
+            file.write("</table>")
+        file.write("</body></html>")
+
+    def write(self, out_dir: pathlib.Path) -> typing.List[pathlib.Path]:
+        """Write index.html and index.json to a directory."""
+        written = []
+        for name, write in zip(INDEX_FILES, [self.write_html, self.write_json]):
+            path = out_dir / name
+            with path.open("w", encoding="utf-8") as file:
+                write(file)
+            written.append(path)
+        return written
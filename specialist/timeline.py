@@ -0,0 +1,188 @@
+"""Sample how code's specialization changes over the course of a run."""
+import array
+import collections
+import contextlib
+import itertools
+import json
+import pathlib
+import threading
+import time
+import types
+import typing
+
+from .common import walk_code
+from .instructions import Fingerprint, classify_code
+from .utils import get_code_for_path
+
+__all__ = ("DEFAULT_TIMELINE_CAPACITY", "DEFAULT_TIMELINE_INTERVAL", "Timeline")
+
+DEFAULT_TIMELINE_INTERVAL = 0.1
+DEFAULT_TIMELINE_CAPACITY = 4096
+
+
+class _Column:
+    """The most recent counts for one code object."""
+
+    __slots__ = ("code", "id", "fingerprinter", "fingerprint", "counts")
+
+    def __init__(self, code: types.CodeType, column_id: int) -> None:
+        # Columns are keyed by id, so keep the code alive (and its id unique):
+        self.code = code
+        # Unique for the life of the timeline (unlike the code's id):
+        self.id = column_id
+        self.fingerprinter = Fingerprint(code)
+        self.fingerprint: typing.Optional[int] = None
+        self.counts = (0, 0, 0)
+
+
+# The ids of the columns in a sample, in order:
+_Layout = typing.Tuple[int, ...]
+
+
+class Timeline:
+    """Sample each code object's counters into a fixed-size ring buffer.
+
+    Every sample is just a timestamp and a flat array of [specialized, adaptive,
+    unquickened] for each of the targets' current code objects (in the order
+    they were first seen), so memory stays bounded no matter how long the run
+    is: once the buffer holds capacity samples, each new one replaces the
+    oldest, and code that's been replaced (like that of a reloaded module) is
+    dropped from later samples. Code whose quickened instructions haven't
+    changed since the last sample isn't re-counted.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        *,
+        interval: float = DEFAULT_TIMELINE_INTERVAL,
+        capacity: int = DEFAULT_TIMELINE_CAPACITY,
+    ) -> None:
+        if interval <= 0:
+            raise ValueError("The interval must be positive!")
+        if capacity < 1:
+            raise ValueError("The capacity must be positive!")
+        # Where the samples are exported to, when sampling stops:
+        self.path = path
+        self._interval = interval
+        self._capacity = capacity
+        self._samples: collections.deque[
+            typing.Tuple[float, _Layout, "array.array[int]"]
+        ] = collections.deque(maxlen=capacity)
+        # Keyed by target and identity, since code objects from different files
+        # compare equal if their contents do. Only the current code is kept:
+        self._columns: typing.Dict[typing.Tuple[pathlib.Path, int], _Column] = {}
+        self._layout: _Layout = ()
+        # The label of every column that's in the layout of any sample:
+        self._labels: typing.Dict[int, typing.Tuple[str, str, int]] = {}
+        self._column_ids = itertools.count()
+        self._start = time.perf_counter()
+        # Samples that were pushed out of the buffer by newer ones:
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def sample(self, targets: typing.Iterable[pathlib.Path]) -> None:
+        """Take one sample of the current state of every target's code."""
+        columns = {}
+        for target in targets:
+            code = get_code_for_path(target)
+            if code is None:
+                continue
+            for child in walk_code(code):
+                key = target, id(child)
+                column = self._columns.get(key)
+                if column is None:
+                    column = _Column(child, next(self._column_ids))
+                    self._labels[column.id] = (
+                        str(target),
+                        child.co_qualname,
+                        child.co_firstlineno,
+                    )
+                columns[key] = column
+                fingerprint = column.fingerprinter()
+                if fingerprint != column.fingerprint:
+                    counts = [0, 0, 0]
+                    for _, category in classify_code(child):
+                        counts[category] += 1
+                    column.fingerprint = fingerprint
+                    column.counts = (counts[0], counts[1], counts[2])
+        if columns.keys() != self._columns.keys():
+            # Code was added or replaced, so drop any that's gone:
+            self._columns = columns
+            self._layout = tuple(column.id for column in columns.values())
+            self._prune()
+        counts = array.array("L")
+        for column in self._columns.values():
+            counts.extend(column.counts)
+        if len(self._samples) == self._capacity:
+            self.dropped += 1
+        self._samples.append((time.perf_counter() - self._start, self._layout, counts))
+
+    def _prune(self) -> None:
+        """Forget the labels of columns that aren't in any sample (or the layout)."""
+        used = set(self._layout)
+        for _, layout, _ in self._samples:
+            used.update(layout)
+        for column_id in self._labels.keys() - used:
+            del self._labels[column_id]
+
+    def _run(self, targets: typing.List[pathlib.Path], stop: threading.Event) -> None:
+        while not stop.wait(self._interval):
+            self.sample(targets)
+
+    @contextlib.contextmanager
+    def sampling(
+        self, targets: typing.List[pathlib.Path]
+    ) -> typing.Generator[None, None, None]:
+        """Sample in the background until the block exits, then export."""
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self._run,
+            args=(targets, stop),
+            name="specialist.timeline",
+            daemon=True,
+        )
+        self._start = time.perf_counter()
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+            self.sample(targets)
+            self.export()
+
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        """Get the samples, padding each with zeros for code it doesn't have."""
+        used = set()
+        for _, layout, _ in self._samples:
+            used.update(layout)
+        # Column ids are handed out in the order the code was first seen:
+        column_ids = sorted(used)
+        index = {column_id: i for i, column_id in enumerate(column_ids)}
+        width = 3 * len(column_ids)
+        rows = []
+        for _, layout, counts in self._samples:
+            row = [0] * width
+            for i, column_id in enumerate(layout):
+                start = 3 * index[column_id]
+                row[start : start + 3] = counts[3 * i : 3 * i + 3]
+            rows.append(row)
+        return {
+            "interval": self._interval,
+            "capacity": self._capacity,
+            "dropped": self.dropped,
+            "code": [
+                {"path": path, "qualname": qualname, "lineno": lineno}
+                for path, qualname, lineno in map(self._labels.__getitem__, column_ids)
+            ],
+            "times": [timestamp for timestamp, _, _ in self._samples],
+            # [specialized, adaptive, unquickened] for each code object:
+            "counts": rows,
+        }
+
+    def export(self) -> None:
+        with self.path.open("w", encoding="utf-8") as file:
+            json.dump(self.as_dict(), file)
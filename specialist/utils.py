@@ -1,16 +1,19 @@
 import contextlib
-import http.server
+import fnmatch
+import glob
 import importlib.util
+import os
 import pathlib
+import re
 import sys
 from types import CodeType
-import types
 import typing
-import webbrowser
 
 from . import CODE
+from .common import normalize_path
 
 __all__ = (
+    "Capture",
     "catch_exceptions",
     "patch_sys_argv",
     "main_file_for_module",
@@ -56,6 +59,8 @@ def main_file_for_module(module: str) -> pathlib.Path | None:
 
 def browse(page: str) -> None:
     """Open a web browser to display a page."""
+    import http.server
+    import webbrowser
 
     class RequestHandler(http.server.BaseHTTPRequestHandler):
         """A simple handler for a single web page."""
@@ -74,25 +79,31 @@ def browse(page: str) -> None:
         server.handle_request()
 
 
+def register_code(code: CodeType) -> None:
+    """Capture a module-level code object for later analysis."""
+    CODE.add(code)
+
+
 def get_code_for_path(path: pathlib.Path) -> CodeType | None:
     """Get the code object for a file."""
-    for code in CODE:
-        try:
-            if path.samefile(code.co_filename):
-                return code
-        except FileNotFoundError:
-            pass
-    return None
+    return CODE.get(path)
+
+
+def _has_code(path: pathlib.Path) -> bool:
+    return get_code_for_path(path) is not None
 
 
 def validate_targets(
-    path: typing.Optional[pathlib.Path], targets: typing.List[pathlib.Path]
+    path: typing.Optional[pathlib.Path],
+    targets: typing.List[pathlib.Path],
+    *,
+    found: typing.Callable[[pathlib.Path], bool] = _has_code,
 ) -> typing.List[pathlib.Path]:
     paths = []
 
     if targets:
         for target in targets:
-            if get_code_for_path(target) is not None:
+            if found(target):
                 paths.append(target.resolve())
     elif path is not None:
         paths.append(path.resolve())
@@ -103,15 +114,80 @@ def validate_targets(
     return paths
 
 
-def audit_imports(event: str, args: "typing.Sequence[object]") -> None:
-    """Intercept all exec() calls and grab a reference to the code they execute.
+class Capture:
+    """Capture module-level code as it's executed, while started.
 
-    This is the only way I know of to actually get ahold of module-level code
-    objects without modifying the code being run.
+    Auditing exec() is the only way I know of to actually get ahold of
+    module-level code objects without modifying the code being run. Audit hooks
+    can never be removed, though, so there's only ever one (installed the first
+    time any Capture starts), and it ignores everything unless a Capture is
+    running. Patterns are globs for the files to capture (where * also matches
+    across directories), and paths are files to capture exactly (even if their
+    names contain glob characters like [ or *). Passing neither captures
+    everything.
     """
-    match event, args:
-        case "exec", [types.CodeType(co_name="<module>") as code]:
-            CODE.add(code)
+
+    def __init__(
+        self,
+        patterns: typing.Optional[typing.Iterable[str]] = None,
+        *,
+        paths: typing.Optional[typing.Iterable[str]] = None,
+    ) -> None:
+        self._match: typing.Optional[typing.Callable[[str], object]] = None
+        if patterns is not None or paths is not None:
+            forms = {form for pattern in patterns or () for form in _forms(pattern)}
+            for path in paths or ():
+                forms.update(glob.escape(form) for form in _forms(path))
+            regex = "|".join(fnmatch.translate(form) for form in sorted(forms))
+            # An empty regex would match everything:
+            self._match = re.compile(regex or "(?!)").match
+
+    def matches(self, filename: str) -> bool:
+        """Check if code from a file would be captured."""
+        if self._match is None:
+            return True
+        return any(self._match(form) for form in _forms(filename))
+
+    def start(self) -> None:
+        global _HOOK_INSTALLED
+        if not _HOOK_INSTALLED:
+            sys.addaudithook(_capture_hook)
+            _HOOK_INSTALLED = True
+        _CAPTURES.append(self)
+
+    def stop(self) -> None:
+        if self in _CAPTURES:
+            _CAPTURES.remove(self)
+
+    def __enter__(self) -> "Capture":
+        self.start()
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.stop()
+
+
+def _forms(filename: str) -> typing.Set[str]:
+    """Get a file's normalized name, and the same with any symlinks resolved."""
+    return {normalize_path(filename), os.path.normcase(os.path.realpath(filename))}
+
+
+# Every Capture that's currently running:
+_CAPTURES: typing.List[Capture] = []
+_HOOK_INSTALLED = False
+
+
+def _capture_hook(event: str, args: typing.Tuple[object, ...]) -> None:
+    # This runs for every audit event in the process, so bail out fast:
+    if event != "exec" or not _CAPTURES:
+        return
+    code = args[0]
+    if type(code) is not CodeType or code.co_name != "<module>":
+        return
+    for capture in _CAPTURES:
+        if capture.matches(code.co_filename):
+            register_code(code)
+            return
 
 
 class _Missing:
@@ -1,3 +1,20 @@
-from .monitor import WatchMonitor as WatchMonitor
+from typing import TYPE_CHECKING, Any, Final
 
 DEFAULT_WATCH_PORT = 3111
+DEFAULT_WATCH_INTERVAL = 1.0
+DEFAULT_WATCH_BUDGET = 0.05
+DEFAULT_WATCH_BUFFER = 256
+DEFAULT_WATCH_OVERFLOW: Final = "coalesce"
+DEFAULT_WATCH_SERVER: Final = "thread"
+
+if TYPE_CHECKING:
+    from .monitor import WatchMonitor as WatchMonitor
+
+
+def __getattr__(name: str) -> Any:
+    # The monitor (and everything it needs) is only imported once it's used:
+    if name == "WatchMonitor":
+        from .monitor import WatchMonitor
+
+        return WatchMonitor
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,128 @@
+import asyncio
+import socket
+from threading import Lock, Thread
+from typing import Dict, Optional, Tuple
+
+import msgpack
+
+from .hub import Hub
+from .payload import Frame, Session, Store, hello
+from .socket import BACKLOG, HEADER
+
+
+class AsyncWatchServer(Thread):
+    """Serve every client from a single thread running an asyncio event loop.
+
+    WatchSocket starts a new thread for each client, and every one of those
+    competes for the GIL with the code being watched. This server uses one
+    thread, no matter how many clients are connected.
+    """
+
+    def __init__(self, hub: Hub, store: Store, *, port: int) -> None:
+        self._hub = hub
+        self._store = store
+        self._port = port
+        self._lock = Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing: Optional[asyncio.Event] = None
+        self._closed = False
+        # Each client's task, and what's needed to wake it up and disconnect it:
+        self._clients: Dict[
+            "asyncio.Task[None]", Tuple[asyncio.Event, asyncio.StreamWriter]
+        ] = {}
+        super().__init__(name="specialist.watch.server")
+
+    def run(self) -> None:
+        asyncio.run(self._serve())
+
+    def close(self) -> None:
+        """Disconnect every client and stop serving (from any thread)."""
+        with self._lock:
+            self._closed = True
+            if self._loop is not None and self._closing is not None:
+                self._loop.call_soon_threadsafe(self._closing.set)
+
+    async def _serve(self) -> None:
+        closing = asyncio.Event()
+        with self._lock:
+            if self._closed:
+                return
+            self._loop = asyncio.get_running_loop()
+            self._closing = closing
+        server = await asyncio.start_server(
+            self._client,
+            socket.gethostname(),
+            self._port,
+            backlog=BACKLOG,
+            reuse_address=True,
+        )
+        async with server:
+            await closing.wait()
+        for changed, writer in self._clients.values():
+            changed.set()
+            writer.close()
+        await asyncio.gather(*self._clients, return_exceptions=True)
+
+    async def _client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        task = asyncio.current_task()
+        assert task is not None and self._closing is not None
+        closing = self._closing
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        self._clients[task] = changed, writer
+
+        def on_put() -> None:
+            try:
+                loop.call_soon_threadsafe(changed.set)
+            except RuntimeError:
+                # The loop has already been closed.
+                pass
+
+        host, port, *_ = writer.get_extra_info("peername")
+        subscription = self._hub.subscribe(f"{host}:{port}", on_put=on_put)
+        session = Session(self._store)
+        receiver = asyncio.create_task(self._receive(reader, session, changed))
+        try:
+            await self._write(writer, hello())
+            while not (
+                closing.is_set() or subscription.disconnected or receiver.done()
+            ):
+                for frame in session.frames():
+                    await self._write(writer, frame)
+                await changed.wait()
+                changed.clear()
+                session.notify(*subscription.drain(0))
+        except ConnectionError:
+            # The client went away.
+            pass
+        finally:
+            receiver.cancel()
+            subscription.close()
+            writer.close()
+            del self._clients[task]
+
+    @staticmethod
+    async def _receive(
+        reader: asyncio.StreamReader, session: Session, changed: asyncio.Event
+    ) -> None:
+        """Handle acks and resyncs until the client disconnects."""
+        try:
+            while True:
+                (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+                session.receive(msgpack.unpackb(await reader.readexactly(length)))
+                changed.set()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            # Wake up the writer, so it notices:
+            changed.set()
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, frame: Frame) -> None:
+        as_bytes = msgpack.packb(frame)
+        # Write the header and body without concatenating them, then wait for
+        # the transport's buffer to drain if the client is falling behind:
+        writer.writelines([HEADER.pack(len(as_bytes)), as_bytes])
+        await writer.drain()
@@ -0,0 +1,175 @@
+import collections
+import dataclasses
+from threading import Condition, Lock
+from typing import Callable, Dict, List, Literal, Optional, Tuple
+
+OverflowPolicy = Literal["drop-oldest", "coalesce", "disconnect"]
+OVERFLOW_POLICIES: Tuple[OverflowPolicy, ...] = (
+    "drop-oldest",
+    "coalesce",
+    "disconnect",
+)
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class ClientStats:
+    """Counters for one subscriber."""
+
+    name: str
+    # Notifications waiting to be sent right now, and the most there have been:
+    lag: int
+    max_lag: int
+    delivered: int
+    # Notifications merged into one already waiting for the same path:
+    coalesced: int
+    dropped: int
+    disconnected: bool
+
+
+class Subscription:
+    """A bounded buffer of changed paths, waiting to be sent to one client.
+
+    When the buffer is full, the overflow policy decides what happens:
+    "drop-oldest" forgets the oldest notification, "coalesce" does the same but
+    first merges repeated notifications for the same path, and "disconnect"
+    gives up on the client. Since the client is always sent everything that
+    changed since its last acknowledged version, dropped notifications only
+    mean that every path is checked (rather than just the notified ones) the
+    next time the buffer is drained.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        /,
+        *,
+        size: int,
+        policy: OverflowPolicy,
+        on_put: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.name = name
+        # Called (from the publishing thread) whenever a path is put:
+        self._on_put = on_put
+        self._size = size
+        self._policy = policy
+        # An ordered set when coalescing, since only the latest matters:
+        self._paths: collections.OrderedDict[str, None] = collections.OrderedDict()
+        self._queue: collections.deque[str] = collections.deque()
+        self._condition = Condition(Lock())
+        self._missed = False
+        self._max_lag = 0
+        self._delivered = 0
+        self._coalesced = 0
+        self._dropped = 0
+        self.disconnected = False
+
+    def _lag(self) -> int:
+        return len(self._paths) + len(self._queue)
+
+    def put(self, path: str) -> None:
+        with self._condition:
+            if self.disconnected:
+                return
+            if self._policy == "coalesce":
+                if path in self._paths:
+                    self._paths.move_to_end(path)
+                    self._coalesced += 1
+                    return
+                self._paths[path] = None
+            else:
+                self._queue.append(path)
+            if self._size < self._lag():
+                if self._policy == "disconnect":
+                    self.disconnected = True
+                    self._paths.clear()
+                    self._queue.clear()
+                elif self._policy == "coalesce":
+                    self._paths.popitem(last=False)
+                    self._missed = True
+                    self._dropped += 1
+                else:
+                    self._queue.popleft()
+                    self._missed = True
+                    self._dropped += 1
+            self._max_lag = max(self._max_lag, self._lag())
+            self._condition.notify()
+        if self._on_put is not None:
+            self._on_put()
+
+    def drain(self, timeout: float) -> Tuple[List[str], bool]:
+        """Wait for (and take) any changed paths.
+
+        Also returns whether any notifications have been dropped since the last
+        drain, in which case every path should be considered changed.
+        """
+        with self._condition:
+            if not self._lag() and not self.disconnected:
+                self._condition.wait(timeout)
+            paths = [*self._paths, *self._queue]
+            missed = self._missed
+            self._paths.clear()
+            self._queue.clear()
+            self._missed = False
+            self._delivered += len(paths)
+            return paths, missed
+
+    def close(self) -> None:
+        with self._condition:
+            self.disconnected = True
+            self._paths.clear()
+            self._queue.clear()
+            self._condition.notify()
+
+    def stats(self) -> ClientStats:
+        with self._condition:
+            return ClientStats(
+                name=self.name,
+                lag=self._lag(),
+                max_lag=self._max_lag,
+                delivered=self._delivered,
+                coalesced=self._coalesced,
+                dropped=self._dropped,
+                disconnected=self.disconnected,
+            )
+
+
+class Hub:
+    """Broadcast changed paths to every subscriber."""
+
+    def __init__(self, *, size: int, policy: OverflowPolicy) -> None:
+        if size < 1:
+            raise ValueError("The buffer size must be positive!")
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {policy!r}!")
+        self._size = size
+        self._policy = policy
+        self._lock = Lock()
+        self._subscriptions: Dict[int, Subscription] = {}
+
+    def subscribe(
+        self, name: str, *, on_put: Optional[Callable[[], None]] = None
+    ) -> Subscription:
+        subscription = Subscription(
+            name, size=self._size, policy=self._policy, on_put=on_put
+        )
+        with self._lock:
+            self._subscriptions[id(subscription)] = subscription
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscriptions.pop(id(subscription), None)
+
+    def publish(self, path: str) -> None:
+        with self._lock:
+            for key, subscription in list(self._subscriptions.items()):
+                if subscription.disconnected:
+                    del self._subscriptions[key]
+            subscriptions = list(self._subscriptions.values())
+        for subscription in subscriptions:
+            subscription.put(path)
+
+    def clients(self) -> List[ClientStats]:
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+        return [subscription.stats() for subscription in subscriptions]
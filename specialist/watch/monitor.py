@@ -1,50 +1,119 @@
 import pathlib
-from queue import Queue
 from threading import Event, Thread
-from typing import TYPE_CHECKING, DefaultDict, List
+from typing import TYPE_CHECKING, List, Literal, Optional, Protocol, Tuple
+
+from .. import CODE
+from . import (
+    DEFAULT_WATCH_BUDGET,
+    DEFAULT_WATCH_BUFFER,
+    DEFAULT_WATCH_INTERVAL,
+    DEFAULT_WATCH_OVERFLOW,
+    DEFAULT_WATCH_SERVER,
+)
+from .hub import ClientStats, Hub, OverflowPolicy
+from .payload import Store
+from .scheduler import Overhead, Scheduler
 
+if TYPE_CHECKING:
+    from ..utils import Capture
 
-from .payload import data_dict, Payload
+# "thread" serves each client from its own thread (with WatchSocket), while
+# "asyncio" serves all of them from one thread (with AsyncWatchServer):
+ServerKind = Literal["thread", "asyncio"]
+SERVER_KINDS: Tuple[ServerKind, ...] = ("thread", "asyncio")
 
-if TYPE_CHECKING:
-    from ..core import AnalysisResults
+
+class _Server(Protocol):
+    def start(self) -> None:
+        ...
+
+    def close(self) -> None:
+        ...
 
 
 class WatchMonitor(Thread):
-    def __init__(self, targets: List[pathlib.Path], /, *, port: int) -> None:
+    def __init__(
+        self,
+        targets: List[pathlib.Path],
+        /,
+        *,
+        port: int,
+        interval: float = DEFAULT_WATCH_INTERVAL,
+        budget: float = DEFAULT_WATCH_BUDGET,
+        buffer: int = DEFAULT_WATCH_BUFFER,
+        overflow: OverflowPolicy = DEFAULT_WATCH_OVERFLOW,
+        server: ServerKind = DEFAULT_WATCH_SERVER,
+        capture: Optional["Capture"] = None,
+    ) -> None:
+        if server not in SERVER_KINDS:
+            raise ValueError(f"Unknown server {server!r}!")
         self._targets = targets
         self._port = port
-
-        self._previous: DefaultDict[
-            pathlib.Path, List["AnalysisResults"]
-        ] = DefaultDict(list)
-
-        self._queue: Queue[Payload] = Queue()
+        self._server_kind = server
+        self._server: Optional[_Server] = None
+        # Captures the targets' code for as long as the monitor is running:
+        self._capture = capture
+        self._scheduler = Scheduler(targets, interval=interval, budget=budget)
+
+        self._store = Store()
+        self._hub = Hub(size=buffer, policy=overflow)
         self._running = Event()
+        self._stopped = Event()
+        self._pinned = False
         super().__init__(name="specialist.watch.monitor")
 
-    def run(self):
-        from ..core import _read
+    @property
+    def overhead(self) -> Overhead:
+        """The CPU time spent analyzing targets so far."""
+        return self._scheduler.overhead
 
-        self._running.set()
+    @property
+    def clients(self) -> List[ClientStats]:
+        """Lag and drop counters for each connected client."""
+        return self._hub.clients()
+
+    def run(self):
+        from ..analysis import Analyzer
 
-        while self._running.is_set():
-            for t in self._targets:
-                result = [r for r in _read(t)]
-                previous = self._previous[t]
+        analyzer = Analyzer()
 
-                if not previous or result != previous:
-                    self._previous[t] = result
+        def analyze(t: pathlib.Path) -> None:
+            if analyzer.update(t):
+                self._store.update(str(t), analyzer.results(t))
 
-                    payload = data_dict(t, result)
+                self._hub.publish(str(t))
 
-                    self._queue.put(payload)
+        self._scheduler.run(analyze, self._stopped)
 
     def close(self):
         self._running.clear()
+        self._stopped.set()
+        if self._capture is not None:
+            self._capture.stop()
+        if self._pinned:
+            self._pinned = False
+            for target in self._targets:
+                CODE.unpin(target)
+        if self._server is not None:
+            self._server.close()
 
     def start(self):
-        from .socket import WatchSocket
-
+        # However low the registry's limit, the targets' code is never evicted:
+        for target in self._targets:
+            CODE.pin(target)
+        self._pinned = True
+        if self._capture is not None:
+            self._capture.start()
+        self._running.set()
         super().start()
-        WatchSocket(self._queue, self._running).start()
+        if self._server_kind == "asyncio":
+            from .aio import AsyncWatchServer
+
+            self._server = AsyncWatchServer(self._hub, self._store, port=self._port)
+        else:
+            from .socket import WatchSocket
+
+            self._server = WatchSocket(
+                self._hub, self._store, self._running, port=self._port
+            )
+        self._server.start()
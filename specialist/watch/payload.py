@@ -1,19 +1,228 @@
-import pathlib
-from typing import TYPE_CHECKING, List, TypedDict
-
-from ..writers import JSONPayload, JSONWriter
+from threading import Lock
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+    TypedDict,
+    Union,
+)
 
 if TYPE_CHECKING:
     from ..core import AnalysisResults
 
+# Protocol:
+#
+# Every message (in both directions) is a msgpack-encoded map, prefixed with its
+# length as a 4-byte big-endian unsigned integer. The server starts by sending a
+# "hello". The first frame it sends for each path is a "snapshot" with the
+# path's chunk layout (the source text of each chunk) and the stats for every
+# chunk. Later frames for the same layout are "delta"s, holding only the chunks
+# whose stats have changed since the client's last acknowledged version. Stats
+# in deltas are absolute, so applying a delta more than once is harmless.
+#
+# Clients acknowledge the versions they've applied with "ack", and can ask for
+# fresh snapshots (of one path, or of every path if "path" is None) with
+# "resync". If a path's layout changes (because its source or code changed),
+# clients get a new snapshot for it.
+#
+# Version 2 added churn (see Stats.churn) to the end of every chunk's stats.
+
+PROTOCOL_VERSION = 2
+
+
+class Hello(TypedDict):
+    type: Literal["hello"]
+    protocol: int
+
 
-class Payload(TypedDict):
+class Snapshot(TypedDict):
+    type: Literal["snapshot"]
     path: str
-    results: List[JSONPayload]
+    layout: int
+    version: int
+    sources: List[str]
+    # [specialized, adaptive, unquickened, churn] for each chunk:
+    stats: List[List[int]]
+
+
+class Delta(TypedDict):
+    type: Literal["delta"]
+    path: str
+    layout: int
+    base: int
+    version: int
+    # [index, specialized, adaptive, unquickened, churn] for each changed chunk:
+    stats: List[List[int]]
+
+
+Frame = Union[Hello, Snapshot, Delta]
+
+
+class Ack(TypedDict):
+    type: Literal["ack"]
+    path: str
+    layout: int
+    version: int
+
+
+class Resync(TypedDict):
+    type: Literal["resync"]
+    path: Optional[str]
+
+
+ClientMessage = Union[Ack, Resync]
+
+
+def hello() -> Hello:
+    return {"type": "hello", "protocol": PROTOCOL_VERSION}
+
+
+class Record:
+    """What one client has been sent (and has acknowledged) for one path."""
+
+    __slots__ = ("layout", "base", "sent")
+
+    def __init__(self, layout: int, version: int) -> None:
+        self.layout = layout
+        # The newest version the client has acknowledged:
+        self.base = version
+        # The newest version the client has been sent:
+        self.sent = version
+
+    def ack(self, layout: int, version: int) -> None:
+        if layout == self.layout and self.base < version:
+            self.base = min(version, self.sent)
+
+
+class _PathState:
+    __slots__ = ("layout", "version", "sources", "stats", "modified")
+
+    def __init__(self) -> None:
+        self.layout = 0
+        self.version = 0
+        self.sources: List[str] = []
+        self.stats: List[List[int]] = []
+        # The version each chunk's stats last changed in:
+        self.modified: List[int] = []
+
+
+class Store:
+    """The latest results for every watched path, versioned per chunk."""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._paths: Dict[str, _PathState] = {}
+
+    def paths(self) -> List[str]:
+        with self._lock:
+            return list(self._paths)
+
+    def update(self, path: str, results: List["AnalysisResults"]) -> None:
+        """Record new results for a path."""
+        sources = [source for source, _ in results]
+        stats = [
+            [stats.specialized, stats.adaptive, stats.unquickened, stats.churn]
+            for _, stats in results
+        ]
+        with self._lock:
+            state = self._paths.get(path)
+            if state is None:
+                state = self._paths[path] = _PathState()
+            if sources != state.sources:
+                state.version += 1
+                state.layout += 1
+                state.sources = sources
+                state.stats = stats
+                state.modified = [state.version] * len(stats)
+                return
+            changed = [i for i, (a, b) in enumerate(zip(state.stats, stats)) if a != b]
+            if changed:
+                state.version += 1
+                for i in changed:
+                    state.stats[i] = stats[i]
+                    state.modified[i] = state.version
+
+    def frame(
+        self, path: str, record: Optional[Record]
+    ) -> Tuple[Optional[Union[Snapshot, Delta]], Optional[Record]]:
+        """Get the next frame (if any) to send a client for a path.
+
+        Returns the frame, along with the client's updated record for the path.
+        """
+        with self._lock:
+            state = self._paths.get(path)
+            if state is None:
+                return None, record
+            if record is None or record.layout != state.layout:
+                snapshot: Snapshot = {
+                    "type": "snapshot",
+                    "path": path,
+                    "layout": state.layout,
+                    "version": state.version,
+                    "sources": state.sources,
+                    "stats": state.stats.copy(),
+                }
+                return snapshot, Record(state.layout, state.version)
+            if state.version <= record.sent:
+                return None, record
+            base = record.base
+            delta: Delta = {
+                "type": "delta",
+                "path": path,
+                "layout": state.layout,
+                "base": base,
+                "version": state.version,
+                "stats": [
+                    [i, *stats]
+                    for i, (stats, modified) in enumerate(
+                        zip(state.stats, state.modified)
+                    )
+                    if base < modified
+                ],
+            }
+            record.sent = state.version
+            return delta, record
+
+
+class Session:
+    """The protocol state for one client, independent of how it's connected."""
+
+    def __init__(self, store: Store) -> None:
+        self._store = store
+        # What this client has been sent for each path:
+        self._records: Dict[str, Optional[Record]] = {}
+        # Paths that may need a frame sent (every path, for a new client):
+        self._pending: Set[str] = set(store.paths())
+
+    def receive(self, message: ClientMessage) -> None:
+        """Handle an ack or resync from the client."""
+        if message["type"] == "ack":
+            record = self._records.get(message["path"])
+            if record is not None:
+                record.ack(message["layout"], message["version"])
+        elif message["type"] == "resync":
+            path = message["path"]
+            paths = self._store.paths() if path is None else [path]
+            for path in paths:
+                self._records.pop(path, None)
+                self._pending.add(path)
 
+    def notify(self, paths: Iterable[str], missed: bool) -> None:
+        """Note paths that have changed (or that some changes were missed)."""
+        self._pending.update(self._store.paths() if missed else paths)
 
-def data_dict(path: pathlib.Path, result: List["AnalysisResults"]) -> Payload:
-    return {
-        "path": str(path),
-        "results": [JSONWriter.as_dict(source, stats) for source, stats in result],
-    }
+    def frames(self) -> Iterator[Union[Snapshot, Delta]]:
+        """Get the frames needed to bring the client up to date."""
+        pending, self._pending = self._pending, set()
+        for path in pending:
+            frame, self._records[path] = self._store.frame(
+                path, self._records.get(path)
+            )
+            if frame is not None:
+                yield frame
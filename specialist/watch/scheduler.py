@@ -0,0 +1,79 @@
+import dataclasses
+import pathlib
+import time
+from threading import Event
+from typing import Callable, List
+
+
+@dataclasses.dataclass(slots=True)
+class Overhead:
+    """The CPU time watch mode has spent analyzing, out of the time it's run."""
+
+    ticks: int = 0
+    # Targets that were put off until a later tick to stay within the budget:
+    deferred: int = 0
+    cpu_time: float = 0.0
+    wall_time: float = 0.0
+
+    @property
+    def fraction(self) -> float:
+        """The fraction of one core used."""
+        return self.cpu_time / self.wall_time if self.wall_time else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.cpu_time:.3f}s CPU over {self.wall_time:.1f}s "
+            f"({self.fraction:.1%} of one core, {self.ticks} ticks, "
+            f"{self.deferred} deferred)"
+        )
+
+
+class Scheduler:
+    """Analyze targets periodically, within a per-tick CPU budget.
+
+    Every interval seconds, targets are analyzed round-robin (picking up where
+    the last tick left off) until the tick has used budget seconds of CPU time.
+    If a single target blows through the budget, the next tick is pushed back to
+    compensate, so the overall overhead stays under budget / interval.
+    """
+
+    def __init__(
+        self, targets: List[pathlib.Path], /, *, interval: float, budget: float
+    ) -> None:
+        if interval < 0:
+            raise ValueError("The interval can't be negative!")
+        if budget <= 0:
+            raise ValueError("The budget must be positive!")
+        self._targets = targets
+        self._interval = interval
+        self._budget = budget
+        self._next = 0
+        self.overhead = Overhead()
+
+    def tick(self, analyze: Callable[[pathlib.Path], None]) -> float:
+        """Analyze as many targets as fit in the budget, and return the CPU used."""
+        start = time.thread_time()
+        used = 0.0
+        count = len(self._targets)
+        done = 0
+        while done < count and used < self._budget:
+            analyze(self._targets[self._next])
+            self._next = (self._next + 1) % count
+            done += 1
+            used = time.thread_time() - start
+        self.overhead.ticks += 1
+        self.overhead.deferred += count - done
+        self.overhead.cpu_time += used
+        return used
+
+    def run(self, analyze: Callable[[pathlib.Path], None], stop: Event) -> None:
+        """Run ticks until stop is set."""
+        started = time.monotonic()
+        while not stop.is_set():
+            tick_started = time.monotonic()
+            used = self.tick(analyze)
+            elapsed = time.monotonic() - tick_started
+            delay = max(self._interval, used * self._interval / self._budget)
+            self.overhead.wall_time = time.monotonic() - started
+            stop.wait(max(0.0, delay - elapsed))
+            self.overhead.wall_time = time.monotonic() - started
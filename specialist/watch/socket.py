@@ -1,62 +1,146 @@
+import selectors
 import socket
 import struct
 from threading import Thread, Event
-from queue import Empty, Queue
+from typing import Iterator
 
 import msgpack
 
-from . import DEFAULT_WATCH_PORT
 from ..utils import MISSING
-from .payload import Payload
+from .hub import Hub, Subscription
+from .payload import ClientMessage, Frame, Session, Store, hello
+
+# How many connections may be waiting to be accepted at once:
+BACKLOG = 16
 
 
 class WatchSocket(Thread):
-    def __init__(self, queue: Queue[Payload], running: Event):
+    def __init__(self, hub: Hub, store: Store, running: Event, *, port: int):
         self._socket: socket.socket = MISSING
-        self._queue = queue
+        self._hub = hub
+        self._store = store
+        self._port = port
         self.running = running
         super().__init__(name="specialist.watch.socket")
 
     def setup(self):
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.bind((socket.gethostname(), DEFAULT_WATCH_PORT))
-        self._socket.listen(1)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((socket.gethostname(), self._port))
+        self._socket.listen(BACKLOG)
 
     def accept(self):
         while self.running.is_set():
-            sock, _ = self._socket.accept()
-
-            thread = WatchThread(sock, self._queue, self.running)
+            try:
+                sock, address = self._socket.accept()
+            except OSError:
+                if self.running.is_set():
+                    raise
+                break
+
+            subscription = self._hub.subscribe(f"{address[0]}:{address[1]}")
+            thread = WatchThread(sock, subscription, self._store, self.running)
             thread.start()
 
     def run(self):
         self.setup()
-        self.accept()
+        try:
+            self.accept()
+        finally:
+            self._socket.close()
+
+    def close(self):
+        """Stop accepting connections (the running event should be cleared first)."""
+        if self._socket is not MISSING:
+            try:
+                # This wakes up the blocked accept() call:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
 
 MSG_LEN = 1024
 
+# How long stream threads block waiting for a payload before checking whether
+# they should still be running:
+POLL_INTERVAL = 0.5
+
 # Payload format:
 # 4 bytes for length
 # Rest for content
+HEADER = struct.Struct("!I")
+
+
+def pack(frame: Frame) -> bytes:
+    as_bytes = msgpack.packb(frame)
+    return HEADER.pack(len(as_bytes)) + as_bytes
+
+
+class FrameReader:
+    """Reassemble length-prefixed messages from a stream of bytes."""
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> Iterator[ClientMessage]:
+        self._buffer += data
+        while len(self._buffer) >= HEADER.size:
+            (length,) = HEADER.unpack_from(self._buffer)
+            end = HEADER.size + length
+            if len(self._buffer) < end:
+                break
+            message = msgpack.unpackb(self._buffer[HEADER.size : end])
+            del self._buffer[:end]
+            yield message
 
 
 class WatchThread(Thread):
-    def __init__(self, sock: socket.socket, queue: Queue[Payload], running: Event):
+    def __init__(
+        self,
+        sock: socket.socket,
+        subscription: Subscription,
+        store: Store,
+        running: Event,
+    ):
         self._sock = sock
-        self._queue = queue
+        self._subscription = subscription
+        self._session = Session(store)
+        self._reader = FrameReader()
+        # Unlike select.select, selectors (like epoll) work with any descriptor,
+        # even past FD_SETSIZE in processes with lots of open files:
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(sock, selectors.EVENT_READ)
         self.running = running
         super().__init__(name="specialist.watch.stream")
 
-    def run(self):
-        while self.running.is_set():
-            try:
-                payload = self._queue.get_nowait()
-            except Empty:
-                continue
-
-            as_bytes = msgpack.packb(payload)
-            total_length = len(as_bytes)
+    def receive(self) -> bool:
+        """Handle any acks and resyncs, and return False if the client is gone."""
+        while self._selector.select(0):
+            data = self._sock.recv(MSG_LEN)
+            if not data:
+                return False
+            for message in self._reader.feed(data):
+                self._session.receive(message)
+        return True
+
+    def stream(self):
+        self._sock.sendall(pack(hello()))
+        while self.running.is_set() and self.receive():
+            for frame in self._session.frames():
+                self._sock.sendall(pack(frame))
+
+            paths, missed = self._subscription.drain(POLL_INTERVAL)
+            if self._subscription.disconnected:
+                break
+            self._session.notify(paths, missed)
 
-            msg = struct.pack("!I", total_length) + as_bytes
-            self._sock.sendall(msg)
+    def run(self):
+        try:
+            self.stream()
+        except OSError:
+            # The client went away.
+            pass
+        finally:
+            self._subscription.close()
+            self._selector.close()
+            self._sock.close()
@@ -1,14 +1,21 @@
 import colorsys
+import functools
 import html
+import io
 import json
 import typing
 from typing_extensions import Self
 
 from .stats import Stats
 
+if typing.TYPE_CHECKING:
+    from .families import CodeStats
+
 
 class Writer(typing.Protocol):
     EXTENSION: typing.ClassVar[str]
+    # Whether write expects a file opened in binary mode (and emit is unusable):
+    BINARY: typing.ClassVar[bool] = False
 
     def add(self, source: str, stats: "Stats") -> None:
         ...
@@ -19,65 +26,352 @@ class Writer(typing.Protocol):
     def copy(self) -> Self:
         ...
 
+    def write(
+        self,
+        chunks: typing.Iterable[typing.Tuple[str, "Stats"]],
+        file: typing.IO[typing.Any],
+    ) -> None:
+        """Write a whole document to a file (by default, with add and emit)."""
+        for source, stats in chunks:
+            self.add(source, stats)
+        file.write(self.emit())
+
+    def add_code(self, code: typing.Sequence["CodeStats"]) -> None:
+        """Add per-code-object stats to the output (ignored by default)."""
+
+
+# How finely the hit rate (hue) and the fraction of quickened code (lightness)
+# are quantized. Every chunk's color comes from this fixed palette:
+HUE_LEVELS = 16
+LIGHTNESS_LEVELS = 8
+
+
+@functools.lru_cache(maxsize=None)
+def _rgb(hue_level: int, lightness_level: int, blue: bool) -> str:
+    """Compute an RGB color code for a palette entry."""
+    # Red is 0/3, green is 1/3. This gives a hue along the red-green gradient
+    # that reflects the hit rate:
+    hue = 1 / 3 * hue_level / HUE_LEVELS
+    if blue:
+        # This turns our red-green (0/3 to 1/3) gradient into a red-blue (0/3 to
+        # -1/3) gradient:
+        hue = -hue
+    lightness = 1 / 2 + 1 / 2 * lightness_level / LIGHTNESS_LEVELS
+    # Always fully saturate the color:
+    saturation = 1
+    rgb = colorsys.hls_to_rgb(hue, lightness, saturation)
+    return f"#{int(255 * rgb[0]):02x}{int(255 * rgb[1]):02x}{int(255 * rgb[2]):02x}"
+
+
+@functools.lru_cache(maxsize=None)
+def _style(blue: bool, dark: bool) -> str:
+    """Build the stylesheet with a class for every palette entry."""
+    background_color, color = ("black", "white") if dark else ("white", "black")
+    attribute = "color" if dark else "background-color"
+    rules = [
+        f"body{{background-color:{background_color};color:{color}}}",
+        # Chunks with any churn (see Stats.churn):
+        ".churn{text-decoration:underline wavy red}",
+    ]
+    for hue_level in range(HUE_LEVELS + 1):
+        # The lightest level is always white, so it doesn't get a class:
+        for lightness_level in range(LIGHTNESS_LEVELS):
+            rgb = _rgb(hue_level, lightness_level, blue)
+            rules.append(f".h{hue_level}l{lightness_level}{{{attribute}:{rgb}}}")
+    return "".join(["<style>", *rules, "</style>"])
+
 
 class HTMLWriter(Writer):
-    """Write HTML for a source code view."""
+    """Write HTML for a source code view.
+
+    Chunks are colored with classes from a fixed palette (see HUE_LEVELS and
+    LIGHTNESS_LEVELS), and neighboring chunks with the same class share a span.
+    """
 
     EXTENSION: typing.ClassVar[str] = "html"
 
     def __init__(self, *, blue: bool, dark: bool) -> None:
         self._blue = blue
         self._dark = dark
-        background_color, color = ("black", "white") if dark else ("white", "black")
-        self._parts = [
-            "<!doctype html>",
-            "<html>",
-            "<head>",
-            "<meta http-equiv='content-type' content='text/html;charset=utf-8'/>",
-            "</head>",
-            f"<body style='background-color:{background_color};color:{color}'>",
-            "<pre>",
+        self._chunks: typing.List[typing.Tuple[str, "Stats"]] = []
+        self._code: typing.Sequence["CodeStats"] = ()
+
+    def add_code(self, code: typing.Sequence["CodeStats"]) -> None:
+        """Add a table of each code object's stats, by family, after the source."""
+        self._code = code
+
+    def _table(self) -> str:
+        if not self._code:
+            return ""
+        rows = [
+            "<table><tr><th>Code</th><th>Line</th><th>Family</th>"
+            "<th>Specialized</th><th>Adaptive</th><th>Unquickened</th></tr>"
         ]
+        for code in self._code:
+            for family, stats in code.families().items():
+                rows.append(
+                    f"<tr><td>{html.escape(code.qualname)}</td><td>{code.lineno}</td>"
+                    f"<td>{family}</td><td>{stats.specialized}</td>"
+                    f"<td>{stats.adaptive}</td><td>{stats.unquickened}</td></tr>"
+                )
+        rows.append("</table>")
+        return "".join(rows)
+
+    def _footer(self) -> str:
+        return f"</pre>{self._table()}</body></html>"
+
+    def _header(self) -> str:
+        return "".join(
+            [
+                "<!doctype html>",
+                "<html>",
+                "<head>",
+                "<meta http-equiv='content-type' content='text/html;charset=utf-8'/>",
+                _style(self._blue, self._dark),
+                "</head>",
+                "<body>",
+                "<pre>",
+            ]
+        )
+
+    def _spans(
+        self, chunks: typing.Iterable[typing.Tuple[str, "Stats"]]
+    ) -> typing.Iterator[str]:
+        """Render chunks, merging neighbors that have the same class."""
+        current: typing.Optional[str] = None
+        sources: typing.List[str] = []
+        for source, stats in chunks:
+            name = self._class(stats)
+            if name != current and sources:
+                yield self._span(current, sources)
+                sources = []
+            current = name
+            sources.append(source)
+        if sources:
+            yield self._span(current, sources)
+
+    @staticmethod
+    def _span(name: typing.Optional[str], sources: typing.List[str]) -> str:
+        source = html.escape("".join(sources))
+        if name is None:
+            return source
+        return f"<span class='{name}'>{source}</span>"
 
     def add(self, source: str, stats: "Stats") -> None:
         """Add a chunk of code to the output."""
-        color = self._color(stats)
-        attribute = "color" if self._dark else "background-color"
-        source = html.escape(source)
-        if color != "#ffffff":
-            source = f"<span style='{attribute}:{color}'>{source}</span>"
-        self._parts.append(source)
+        self._chunks.append((source, stats))
 
     def emit(self) -> str:
         """Emit the HTML."""
-        return "".join([*self._parts, "</pre></body></html>"])
+        return "".join([self._header(), *self._spans(self._chunks), self._footer()])
 
     def copy(self) -> Self:
         return HTMLWriter(blue=self._blue, dark=self._dark)
 
-    def _color(self, stats: "Stats") -> str:
-        """Compute an RGB color code for this chunk."""
+    def write(
+        self,
+        chunks: typing.Iterable[typing.Tuple[str, "Stats"]],
+        file: typing.IO[typing.Any],
+    ) -> None:
+        """Stream the HTML to a file, one span at a time."""
+        file.write(self._header())
+        for span in self._spans(chunks):
+            file.write(span)
+        file.write(self._footer())
+
+    @staticmethod
+    def _palette_index(stats: "Stats") -> int:
+        """Find the palette entry for this chunk (or -1, for white)."""
         quickened = stats.specialized + stats.adaptive
         if not quickened:
-            return "#ffffff"
-        # Red is 0/3, green is 1/3. This gives a hue along the red-green gradient
-        # that reflects the hit rate:
-        hue = 1 / 3 * stats.specialized / quickened
-        if self._blue:
-            # This turns our red-green (0/3 to 1/3) gradient into a red-blue (0/3 to
-            # -1/3) gradient:
-            hue = -hue
-        lightness = max(1 / 2, stats.unquickened / (quickened + stats.unquickened))
-        # Always fully saturate the color:
-        saturation = 1
-        rgb = colorsys.hls_to_rgb(hue, lightness, saturation)
-        return f"#{int(255 * rgb[0]):02x}{int(255 * rgb[1]):02x}{int(255 * rgb[2]):02x}"
+            return -1
+        hue_level = round(HUE_LEVELS * stats.specialized / quickened)
+        # Lightness runs from 1/2 (all quickened) to 1 (none quickened):
+        total = quickened + stats.unquickened
+        lightness = (2 * stats.unquickened - total) / total
+        lightness_level = max(0, round(LIGHTNESS_LEVELS * lightness))
+        if lightness_level == LIGHTNESS_LEVELS:
+            return -1
+        return hue_level * LIGHTNESS_LEVELS + lightness_level
+
+    @classmethod
+    def _class(cls, stats: "Stats") -> typing.Optional[str]:
+        """Find the palette class for this chunk (or None, for white).
+
+        Chunks with any churn get the "churn" class, too.
+        """
+        index = cls._palette_index(stats)
+        if index < 0:
+            return "churn" if stats.churn else None
+        hue_level, lightness_level = divmod(index, LIGHTNESS_LEVELS)
+        if stats.churn:
+            return f"h{hue_level}l{lightness_level} churn"
+        return f"h{hue_level}l{lightness_level}"
+
+
+# Renders only the lines that are scrolled into view, parsing each block of
+# lines the first time any of them is shown. LINES, LINES_PER_BLOCK, and
+# LIGHTNESS_LEVELS are defined just before this:
+_VIEWER = """\
+(() => {
+  const blocks = document.getElementsByClassName("specialist-block");
+  const view = document.getElementById("specialist-view");
+  const pre = document.getElementById("specialist-lines");
+  const parsed = new Map();
+  const OVERSCAN = 50;
+  const ESCAPES = {"&": "&amp;", "<": "&lt;", ">": "&gt;"};
+  const escape = (text) => text.replace(/[&<>]/g, (c) => ESCAPES[c]);
+  function line(n) {
+    const i = Math.floor(n / LINES_PER_BLOCK);
+    let block = parsed.get(i);
+    if (block === undefined) {
+      block = JSON.parse(blocks[i].textContent);
+      parsed.set(i, block);
+    }
+    return block[n % LINES_PER_BLOCK];
+  }
+  pre.textContent = "x";
+  const height = pre.getBoundingClientRect().height;
+  view.style.height = `${LINES * height}px`;
+  function render() {
+    const top = window.scrollY - view.offsetTop;
+    const first = Math.max(0, Math.floor(top / height) - OVERSCAN);
+    const last = Math.min(LINES, Math.ceil((top + window.innerHeight) / height) + OVERSCAN);
+    const parts = [];
+    for (let n = first; n < last; n++) {
+      const segments = line(n);
+      for (let j = 0; j < segments.length; j += 2) {
+        const text = escape(segments[j]), index = segments[j + 1] >> 1;
+        const classes = [];
+        if (index >= 0) {
+          const hue = Math.floor(index / LIGHTNESS_LEVELS), lightness = index % LIGHTNESS_LEVELS;
+          classes.push(`h${hue}l${lightness}`);
+        }
+        if (segments[j + 1] & 1) {
+          classes.push("churn");
+        }
+        parts.push(classes.length ? `<span class="${classes.join(" ")}">${text}</span>` : text);
+      }
+    }
+    pre.style.top = `${first * height}px`;
+    pre.innerHTML = parts.join("");
+  }
+  let pending = false;
+  function schedule() {
+    if (!pending) {
+      pending = true;
+      requestAnimationFrame(() => {
+        pending = false;
+        render();
+      });
+    }
+  }
+  window.addEventListener("scroll", schedule, {passive: true});
+  window.addEventListener("resize", schedule);
+  render();
+})();
+"""
+
+
+class VirtualHTMLWriter(HTMLWriter):
+    """Write HTML for a source code view that only renders what's visible.
+
+    Rather than one big <pre> for the browser to lay out all at once, the page
+    holds blocks of lines as inert JSON, and a small script renders (and parses
+    the blocks for) only the lines that are currently scrolled into view. Each
+    line is a flat list of [text, class, text, class, ...], where each class is
+    the palette index (or -1, for white) shifted left by one, with the lowest
+    bit set for text with any churn.
+    """
+
+    LINES_PER_BLOCK: typing.ClassVar[int] = 512
+
+    def _header(self) -> str:
+        return "".join(
+            [
+                "<!doctype html>",
+                "<html>",
+                "<head>",
+                "<meta http-equiv='content-type' content='text/html;charset=utf-8'/>",
+                _style(self._blue, self._dark),
+                "<style>",
+                "#specialist-view{position:relative}",
+                "#specialist-lines{position:absolute;left:0;right:0;margin:0}",
+                "</style>",
+                "</head>",
+                "<body>",
+                "<div id='specialist-view'><pre id='specialist-lines'></pre></div>",
+            ]
+        )
+
+    def emit(self) -> str:
+        """Emit the HTML."""
+        page = io.StringIO()
+        self.write(self._chunks, page)
+        return page.getvalue()
+
+    def copy(self) -> Self:
+        return VirtualHTMLWriter(blue=self._blue, dark=self._dark)
+
+    def _footer(self) -> str:
+        return f"{self._table()}</body></html>"
+
+    @staticmethod
+    def _block(lines: typing.List[typing.List[typing.Union[str, int]]]) -> str:
+        data = json.dumps(lines, ensure_ascii=False, separators=(",", ":"))
+        # "<" only appears in strings, where it can be escaped to keep "</script>"
+        # (and "<!--") from ending the block early:
+        data = data.replace("<", "\\u003c")
+        return (
+            f"<script type='application/json' class='specialist-block'>{data}</script>"
+        )
+
+    def write(
+        self,
+        chunks: typing.Iterable[typing.Tuple[str, "Stats"]],
+        file: typing.IO[typing.Any],
+    ) -> None:
+        """Stream the HTML to a file, one block of lines at a time."""
+        file.write(self._header())
+        lines = 0
+        block: typing.List[typing.List[typing.Union[str, int]]] = []
+        segments: typing.List[typing.Union[str, int]] = []
+        for source, stats in chunks:
+            index = self._palette_index(stats) << 1 | bool(stats.churn)
+            *complete, rest = source.split("\n")
+            for text in [*(text + "\n" for text in complete), rest]:
+                if not text:
+                    continue
+                if segments and segments[-1] == index:
+                    segments[-2] += text  # type: ignore # always a str
+                else:
+                    segments += [text, index]
+                if text[-1] == "\n":
+                    block.append(segments)
+                    segments = []
+                    if len(block) == self.LINES_PER_BLOCK:
+                        file.write(self._block(block))
+                        lines += len(block)
+                        block = []
+        if segments:
+            block.append(segments)
+        if block:
+            file.write(self._block(block))
+            lines += len(block)
+        file.write(
+            "<script>"
+            f"const LINES={lines},LINES_PER_BLOCK={self.LINES_PER_BLOCK},"
+            f"LIGHTNESS_LEVELS={LIGHTNESS_LEVELS};"
+            f"{_VIEWER}</script>{self._footer()}"
+        )
 
 
 class JSONStats(typing.TypedDict):
     specialized: int
     adaptive: int
     unquickened: int
+    # Only present for chunks with any churn:
+    churn: typing.NotRequired[int]
 
 
 class JSONPayload(typing.TypedDict):
@@ -85,16 +379,37 @@ class JSONPayload(typing.TypedDict):
     stats: JSONStats
 
 
+class JSONFamilies(typing.TypedDict):
+    qualname: str
+    lineno: int
+    families: typing.Dict[str, JSONStats]
+
+
 class JSONWriter(Writer):
     EXTENSION: typing.ClassVar[str] = "json"
 
     def __init__(self, *, indent: int | str | None = None) -> None:
         self._indent = indent
         self._data: typing.List[JSONPayload] = []
+        self._code: typing.List[JSONFamilies] = []
+
+    def add_code(self, code: typing.Sequence["CodeStats"]) -> None:
+        """Add each code object's stats, by family, under "code"."""
+        self._code = [
+            {
+                "qualname": stats.qualname,
+                "lineno": stats.lineno,
+                "families": {
+                    family: self.as_dict("", counts)["stats"]
+                    for family, counts in stats.families().items()
+                },
+            }
+            for stats in code
+        ]
 
     @staticmethod
     def as_dict(source: str, stats: "Stats") -> JSONPayload:
-        return {
+        payload: JSONPayload = {
             "source": source,
             "stats": {
                 "specialized": stats.specialized,
@@ -102,13 +417,55 @@ class JSONWriter(Writer):
                 "unquickened": stats.unquickened,
             },
         }
+        if stats.churn:
+            payload["stats"]["churn"] = stats.churn
+        return payload
 
     def add(self, source: str, stats: "Stats") -> None:
         self._data.append(self.as_dict(source, stats))
 
     def emit(self) -> str:
         """Emit the JSON data"""
+        if self._code:
+            document = {"data": self._data, "code": self._code}
+            return json.dumps(document, indent=self._indent)
         return json.dumps({"data": self._data}, indent=self._indent)
 
     def copy(self) -> Self:
         return JSONWriter(indent=self._indent)
+
+    def write(
+        self,
+        chunks: typing.Iterable[typing.Tuple[str, "Stats"]],
+        file: typing.IO[typing.Any],
+    ) -> None:
+        """Stream the JSON to a file, one chunk at a time.
+
+        This writes exactly what emit would, without building the whole list.
+        """
+        encoder = json.JSONEncoder(indent=self._indent)
+        if self._indent is None:
+            # Without indentation, json.dumps puts everything on one line:
+            outer = inner = last = ""
+            separator = ", "
+        else:
+            indent = (
+                self._indent if isinstance(self._indent, str) else " " * self._indent
+            )
+            # What comes before each key, each chunk, and the closing brace:
+            outer, inner, last = f"\n{indent}", f"\n{indent}{indent}", "\n"
+            separator = ","
+        file.write(f'{{{outer}"data": [')
+        first = True
+        for source, stats in chunks:
+            file.write(inner if first else f"{separator}{inner}")
+            encoded = encoder.encode(self.as_dict(source, stats))
+            # JSON strings never contain literal newlines, so this is safe:
+            file.write(encoded.replace("\n", inner) if inner else encoded)
+            first = False
+        file.write("]" if first else f"{outer}]")
+        if self._code:
+            encoded = encoder.encode(self._code)
+            file.write(f'{separator}{outer}"code": ')
+            file.write(encoded.replace("\n", outer) if outer else encoded)
+        file.write(f"{last}}}")
@@ -1,11 +1,36 @@
 """Tests for the Specialist command-line tool."""
+import dataclasses
+import dis
+import json
+import linecache
 import pathlib
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
 import types
+import typing
+import weakref
 
+import click.testing
+import msgpack
 import pytest
 
 import specialist
-from specialist import utils
+from specialist import analysis, binary, cache, common, core, families
+from specialist import instructions, summary, timeline
+from specialist import utils, writers
+from specialist import _cli as cli
+from specialist import spool as spool_module
+from specialist.registry import CodeRegistry
+from specialist.spool import Spool
+from specialist.stats import Stats
+from specialist.watch import hub, payload
+from specialist.watch import socket as watch_socket
+from specialist.watch.monitor import WatchMonitor
+from specialist.watch.scheduler import Scheduler
 
 
 @pytest.mark.parametrize("code", specialist.CODE)
@@ -14,3 +39,868 @@ def test_get_code_for_path(code: types.CodeType) -> None:
     path = pathlib.Path(code.co_filename)
     expected = code if path.is_file() else None
     assert utils.get_code_for_path(path) is expected
+
+
+def test_parse_chunks_are_contiguous() -> None:
+    """Test that parsed chunks tile the whole source, in order."""
+    code = compile("x = [i * 2 for i in range(100)]\ny = x[0] + 1\n", "<test>", "exec")
+    for _ in range(100):
+        exec(code, {})
+    chunks = list(core._parse(code))
+    assert chunks[-1].stop == core.LAST_POSITION
+    for before, after in zip(chunks, chunks[1:]):
+        assert before.stop == after.start
+    assert all(min(dataclasses.astuple(chunk.stats)) >= 0 for chunk in chunks)
+
+
+def test_classify_code() -> None:
+    """Test that classify_code agrees with classify_instruction."""
+    code = compile(
+        "def f(a, b):\n    c = a + b\n    return c * a.real\n"
+        "for i in range(100):\n    f(i, 1.0)\n",
+        "<test>",
+        "exec",
+    )
+    exec(code, {})
+    for child in common.walk_code(code):
+        expected = []
+        previous = None
+        for instruction in dis.get_instructions(child, adaptive=True):
+            category = instructions.classify_instruction(instruction, previous)
+            expected.append((instruction.offset // 2, category))
+            previous = instruction
+        assert list(instructions.classify_code(child)) == expected
+
+
+def test_read_multibyte(tmp_path: pathlib.Path) -> None:
+    """Test that chunks are sliced on UTF-8 byte offsets."""
+    path = tmp_path / "multibyte.py"
+    path.write_text("s = 'h\u00e9llo'\nfor _ in range(100):\n    n = len(s) + 1\n")
+    code = compile(path.read_bytes(), str(path), "exec")
+    exec(code, {})
+    specialist.CODE.add(code)
+    try:
+        results = list(core._read(path))
+    finally:
+        specialist.CODE.discard(code)
+    assert "".join(source for source, _ in results) == path.read_text()
+    assert "'h\u00e9llo'" in [source for source, _ in results]
+
+
+def test_get_code_for_replaced_path(tmp_path: pathlib.Path) -> None:
+    """Test lookups for files that are replaced or deleted after capture."""
+    path = tmp_path / "replaced.py"
+    path.write_text("x = 1\n")
+    code = compile(path.read_text(), str(path), "exec")
+    utils.register_code(code)
+    try:
+        assert utils.get_code_for_path(path) is code
+        replacement = tmp_path / "replacement.py"
+        replacement.write_text("x = 2\n")
+        replacement.replace(path)
+        assert utils.get_code_for_path(path) is code
+        path.unlink()
+        assert utils.get_code_for_path(path) is None
+    finally:
+        specialist.CODE.discard(code)
+
+
+def test_get_code_for_reused_file_id(tmp_path: pathlib.Path) -> None:
+    """Test that a new file reusing a deleted one's inode doesn't get its code."""
+    path, other, moved = [tmp_path / f"{name}.py" for name in ["a", "b", "c"]]
+    path.write_text("x = 1\n")
+    code = compile(path.read_text(), str(path), "exec")
+    utils.register_code(code)
+    try:
+        path.unlink()
+        # This usually reuses the inode, but may not:
+        other.write_text("x = 2\n")
+        assert utils.get_code_for_path(other) is None
+        # This always does:
+        path.write_text("x = 1\n")
+        utils.register_code(code)
+        path.rename(moved)
+        assert utils.get_code_for_path(moved) is None
+    finally:
+        specialist.CODE.discard(code)
+
+
+def test_analyzer(tmp_path: pathlib.Path) -> None:
+    """Test that incremental analysis agrees with a full re-read."""
+    path = tmp_path / "analyzed.py"
+    path.write_text("def f(a, b):\n    return a + b\n")
+    code = compile(path.read_text(), str(path), "exec")
+    namespace: dict[str, typing.Any] = {}
+    exec(code, namespace)
+    utils.register_code(code)
+    try:
+        analyzer = analysis.Analyzer()
+        assert analyzer.update(path)
+        assert analyzer.results(path) == list(core._read(path))
+        assert not analyzer.update(path)
+        for i in range(100):
+            namespace["f"](i, i)
+        assert analyzer.update(path)
+        assert analyzer.results(path) == list(core._read(path))
+    finally:
+        specialist.CODE.discard(code)
+
+
+def test_spool_merges_processes(tmp_path: pathlib.Path) -> None:
+    """Test that child processes' results are summed with this process's."""
+    path = tmp_path / "spooled.py"
+    path.write_text("def f(n):\n    return sum(i * 2 for i in range(n))\nf(100)\n")
+    source = f"""\
+import subprocess, sys
+sys.path.insert(0, {str(tmp_path)!r})
+import spooled
+for _ in range(2):
+    subprocess.run([sys.executable, "-c", "import spooled"], cwd={str(tmp_path)!r})
+"""
+    spool = Spool()
+    try:
+        results = core.analyze_code(source, targets=[path], spool=spool)
+    finally:
+        sys.modules.pop("spooled", None)
+    assert spool.workers(path) == 3
+    (merged,) = results.values()
+    assert "".join(text for text, _ in merged) == path.read_text()
+    code = compile(path.read_text(), str(path), "exec")
+    rows = spool_module._rows(code)
+    # Merging a process's results with itself doubles them:
+    assert list(spool_module._merge([rows, rows])) == [
+        dataclasses.replace(
+            chunk,
+            stats=Stats(
+                2 * chunk.stats.specialized,
+                2 * chunk.stats.adaptive,
+                2 * chunk.stats.unquickened,
+            ),
+        )
+        for chunk in core._parse(code)
+    ]
+
+
+def test_spool_terminated_workers(tmp_path: pathlib.Path) -> None:
+    """Test that pool workers terminated (rather than joined) still report."""
+    path = tmp_path / "pooled.py"
+    path.write_text("def f(n):\n    return sum(i * 2 for i in range(n))\n")
+    source = f"""\
+import multiprocessing, sys
+sys.path.insert(0, {str(tmp_path)!r})
+import pooled
+if __name__ == "__main__":
+    context = multiprocessing.get_context("spawn")
+    # Make sure both workers have started, since leaving the block terminates them:
+    with context.Pool(2, context.Barrier(2).wait) as pool:
+        pool.map(pooled.f, range(100))
+"""
+    spool = Spool()
+    try:
+        core.analyze_code(source, targets=[path], spool=spool)
+    finally:
+        sys.modules.pop("pooled", None)
+    assert spool.workers(path) == 3
+
+
+@pytest.mark.parametrize(
+    "writer",
+    [writers.HTMLWriter(blue=False, dark=True), writers.JSONWriter(indent=2)],
+)
+def test_view_parallel(tmp_path: pathlib.Path, writer: writers.Writer) -> None:
+    """Test that streamed, parallel reports match emitted, sequential ones."""
+    results: core.PathToResults = {}
+    for name in ["a", "b", "c"]:
+        path = tmp_path / f"{name}.py"
+        path.write_text(f"{name} = '\u00e9'\nfor _ in range(100):\n    {name} += 'x'\n")
+        code = compile(path.read_text(), str(path), "exec")
+        exec(code, {})
+        results[path] = list(core._split(path.read_bytes(), core._parse(code)))
+    core.view(results, writer=writer, out_dir=tmp_path / "sequential")
+    core.view(results, writer=writer, out_dir=tmp_path / "parallel", jobs=2)
+    for path, chunks in results.items():
+        emitted = writer.copy()
+        for source, stats in chunks:
+            emitted.add(source, stats)
+        name = path.with_suffix(f".{writer.EXTENSION}").name
+        for out_dir in ["sequential", "parallel"]:
+            assert (tmp_path / out_dir / name).read_text() == emitted.emit()
+
+
+def test_html_writer_palette() -> None:
+    """Test that chunks are colored by class, and merged when they match."""
+    writer = writers.HTMLWriter(blue=False, dark=False)
+    for source, stats in [
+        ("a", Stats(specialized=1)),
+        ("b", Stats(specialized=2)),
+        ("<c>", Stats()),
+        ("d", Stats(adaptive=1, unquickened=100)),
+        ("e", Stats(adaptive=1)),
+    ]:
+        writer.add(source, stats)
+    html = writer.emit()
+    assert html.count("<style>") == 1 and "style='" not in html
+    assert "<span class='h16l0'>ab</span>&lt;c&gt;d<span class='h0l0'>e</span>" in html
+
+
+def test_virtual_html_writer() -> None:
+    """Test that the virtual viewer's blocks hold every line of the source."""
+    writer = writers.VirtualHTMLWriter(blue=True, dark=False)
+    writer.LINES_PER_BLOCK = 2
+    chunks = [
+        ("x = 1\ny", Stats(specialized=1)),
+        (" = '</script>'\n\n", Stats(specialized=1)),
+        ("z = 3", Stats(churn=2)),
+    ]
+    for source, stats in chunks:
+        writer.add(source, stats)
+    html = writer.emit()
+    assert "</script>'" not in html and "const LINES=4," in html
+    blocks = re.findall(r"class='specialist-block'>(.*?)</script>", html)
+    lines = [line for block in blocks for line in json.loads(block)]
+    # Palette indexes are shifted left, with the lowest bit set for churn:
+    assert lines == [
+        ["x = 1\n", 256],
+        ["y = '</script>'\n", 256],
+        ["\n", 256],
+        ["z = 3", -1],
+    ]
+
+
+def test_binary_report(tmp_path: pathlib.Path) -> None:
+    """Test that binary reports round-trip, including appended segments."""
+    chunks = [("x = ", Stats()), ("'h\u00e9llo'", Stats(1, 2, 3, 4)), ("\n", Stats())]
+    path = tmp_path / "report.spcl"
+    writer = binary.BinaryWriter()
+    writer.SEGMENT_CHUNKS = 2
+    with path.open("wb") as file:
+        writer.write(chunks, file)
+    with path.open("ab") as file:
+        binary.BinaryWriter().write(chunks[1:2], file)
+    with binary.BinaryReport(path) as report:
+        assert list(report) == [*chunks, chunks[1]]
+        assert len(report) == 4 and report[-1] == report[1] == chunks[1]
+        assert report.totals() == Stats(2, 4, 6, 8)
+        core.view({path: report}, writer=writers.JSONWriter(), out_dir=tmp_path)
+    json_writer = writers.JSONWriter()
+    for source, stats in [*chunks, chunks[1]]:
+        json_writer.add(source, stats)
+    assert (tmp_path / "report.json").read_text() == json_writer.emit()
+
+
+def test_view_index(tmp_path: pathlib.Path) -> None:
+    """Test that the index ranks functions, and links to their reports."""
+    path = tmp_path / "indexed.py"
+    path.write_text(
+        "def hot(x):\n    return x.real + x\n"
+        "def cold():\n    pass\n"
+        "for i in range(100):\n    hot(i if i % 2 else float(i))\n"
+    )
+    code = compile(path.read_text(), str(path), "exec")
+    exec(code, {})
+    utils.register_code(code)
+    try:
+        index = core.view({path: core._read(path)}, out_dir=tmp_path, index=True)
+    finally:
+        specialist.CODE.discard(code)
+    assert index is not None and index.files == 1
+    top, *_ = index.ranking("functions_by_adaptive")
+    assert top.name.endswith(":hot") and top.report == "indexed.html"
+    assert top.stats.adaptive
+    assert "href='indexed.html'" in (tmp_path / "index.html").read_text()
+    data = json.loads((tmp_path / "index.json").read_text())
+    assert data["totals"] == dataclasses.asdict(index.totals)
+
+
+@pytest.mark.parametrize("flags", [["--index"], ["--format", "binary"]])
+def test_run_needs_output(tmp_path: pathlib.Path, flags: typing.List[str]) -> None:
+    """Test that flags needing --output are rejected before anything runs."""
+    ran = tmp_path / "ran"
+    source = f"open({str(ran)!r}, 'w').close()"
+    runner = click.testing.CliRunner()
+    result = runner.invoke(cli.main, ["run", *flags, "--no-cache", "-c", source])
+    assert result.exit_code == 2 and "--output" in result.output
+    assert not ran.exists()
+
+
+def test_index_collision(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that the index never overwrites a report with the same name."""
+    paths = [tmp_path / "index.py", tmp_path / "main.py"]
+    for path in paths:
+        path.write_text("x = 1\n")
+    results = {path: [(path.read_text(), Stats())] for path in paths}
+    with pytest.raises(ValueError):
+        core.view(results, out_dir=tmp_path / "out", index=True)
+    assert not (tmp_path / "out").exists()
+    core.view(results, out_dir=tmp_path / "out", writer=writers.JSONWriter())
+    assert (tmp_path / "out" / "index.json").exists()
+    # The CLI refuses before running anything:
+    ran = tmp_path / "ran"
+    paths[1].write_text(f"open({str(ran)!r}, 'w').close()\n")
+    monkeypatch.chdir(tmp_path)
+    args = ["--index", "--output", "out", "--no-cache", "--targets", "*.py"]
+    result = click.testing.CliRunner().invoke(cli.main, ["run", *args, "main.py"])
+    assert result.exit_code == 2 and "index.html" in result.output
+    assert not ran.exists()
+
+
+def test_code_stats_families() -> None:
+    """Test that family counts add up, and that writers can render them."""
+
+    def f(x: typing.Any) -> typing.Any:
+        return x.real + x
+
+    for i in range(100):
+        f(i)
+    (stats,) = families.code_stats(f.__code__)
+    assert stats.qualname.endswith("f") and stats.lineno == f.__code__.co_firstlineno
+    assert stats.family("LOAD_ATTR") == Stats(adaptive=1)
+    assert stats.family("BINARY_OP") == Stats(specialized=1)
+    categories = [category for _, category in instructions.classify_code(f.__code__)]
+    assert stats.total == Stats(*(categories.count(i) for i in range(3)))
+    json_writer = writers.JSONWriter()
+    json_writer.add_code([stats])
+    (code,) = json.loads(json_writer.emit())["code"]
+    assert code["families"]["LOAD_ATTR"]["adaptive"] == 1
+    html_writer = writers.HTMLWriter(blue=False, dark=False)
+    html_writer.add_code([stats])
+    assert "<td>LOAD_ATTR</td><td>0</td><td>1</td><td>0</td>" in html_writer.emit()
+
+
+def test_scheduler_round_robin() -> None:
+    """Test that targets over the CPU budget are deferred to later ticks."""
+    targets = [pathlib.Path(name) for name in "abc"]
+    scheduler = Scheduler(targets, interval=0, budget=1e-12)
+    analyzed: list[pathlib.Path] = []
+    for _ in range(4):
+        scheduler.tick(analyzed.append)
+    assert analyzed == [*targets, targets[0]]
+    assert scheduler.overhead.ticks == 4
+    assert scheduler.overhead.deferred == 8
+
+
+def test_watch_store_deltas() -> None:
+    """Test that watch clients are only sent what changed since their last ack."""
+    store = payload.Store()
+    store.update("spam.py", [("x = ", Stats()), ("1", Stats(unquickened=1))])
+    snapshot, record = store.frame("spam.py", None)
+    assert snapshot is not None and snapshot["type"] == "snapshot"
+    assert snapshot["sources"] == ["x = ", "1"]
+    assert record is not None
+    assert store.frame("spam.py", record) == (None, record)
+    store.update("spam.py", [("x = ", Stats()), ("1", Stats(specialized=1))])
+    delta, record = store.frame("spam.py", record)
+    assert delta is not None and delta["type"] == "delta"
+    assert delta["stats"] == [[1, 1, 0, 0, 0]]
+    store.update("spam.py", [("x = ", Stats(adaptive=1)), ("1", Stats(specialized=1))])
+    # Nothing has been acknowledged, so everything since the snapshot is resent:
+    delta, record = store.frame("spam.py", record)
+    assert delta is not None and delta["stats"] == [[0, 0, 1, 0, 0], [1, 1, 0, 0, 0]]
+    assert record is not None
+    record.ack(delta["layout"], delta["version"])
+    store.update("spam.py", [("x = ", Stats()), ("1", Stats(specialized=1))])
+    delta, record = store.frame("spam.py", record)
+    assert delta is not None and delta["stats"] == [[0, 0, 0, 0, 0]]
+    store.update("spam.py", [("x = 1", Stats())])
+    snapshot, record = store.frame("spam.py", record)
+    assert snapshot is not None and snapshot["type"] == "snapshot"
+
+
+@pytest.mark.parametrize("policy", hub.OVERFLOW_POLICIES)
+def test_watch_hub_broadcast(policy: hub.OverflowPolicy) -> None:
+    """Test that every client sees every update, within its buffer."""
+    broadcast = hub.Hub(size=2, policy=policy)
+    first = broadcast.subscribe("first")
+    second = broadcast.subscribe("second")
+    for path in ["a", "b", "a", "c"]:
+        broadcast.publish(path)
+    clients = [client.name for client in broadcast.clients()]
+    # Disconnected clients are forgotten:
+    assert clients == ([] if policy == "disconnect" else ["first", "second"])
+    for subscription in (first, second):
+        paths, missed = subscription.drain(0)
+        stats = subscription.stats()
+        if policy == "disconnect":
+            assert subscription.disconnected and not paths
+        elif policy == "coalesce":
+            assert (paths, missed) == (["a", "c"], True)
+            assert (stats.coalesced, stats.dropped) == (1, 1)
+        else:
+            assert (paths, missed) == (["a", "c"], True)
+            assert (stats.coalesced, stats.dropped) == (0, 2)
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind((socket.gethostname(), 0))
+        return probe.getsockname()[1]
+
+
+def _connect(port: int) -> socket.socket:
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            return socket.create_connection((socket.gethostname(), port), timeout=10)
+        except ConnectionRefusedError:
+            # The server may not be listening yet:
+            if deadline < time.monotonic():
+                raise
+            time.sleep(0.01)
+
+
+def _read_frame(client: socket.socket) -> typing.Dict[str, typing.Any]:
+    def read(size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            received = client.recv(size - len(data))
+            assert received, "the server disconnected"
+            data += received
+        return data
+
+    (length,) = watch_socket.HEADER.unpack(read(watch_socket.HEADER.size))
+    return msgpack.unpackb(read(length))
+
+
+def test_watch_asyncio_server(tmp_path: pathlib.Path) -> None:
+    """Test that one asyncio thread serves every client, and closes cleanly."""
+    path = tmp_path / "watched.py"
+    path.write_text("x = 1\n")
+    code = compile(path.read_text(), str(path), "exec")
+    utils.register_code(code)
+    port = _free_port()
+    monitor = WatchMonitor([path], port=port, interval=0.01, server="asyncio")
+    clients: typing.List[socket.socket] = []
+    try:
+        monitor.start()
+        threads = None
+        for _ in range(4):
+            client = _connect(port)
+            clients.append(client)
+            assert _read_frame(client)["type"] == "hello"
+            snapshot = _read_frame(client)
+            assert snapshot["type"] == "snapshot" and snapshot["path"] == str(path)
+            assert "".join(snapshot["sources"]) == path.read_text()
+            if threads is None:
+                threads = threading.active_count()
+            assert threading.active_count() == threads
+    finally:
+        monitor.close()
+        for client in clients:
+            client.close()
+        specialist.CODE.discard(code)
+    server = monitor._server
+    assert isinstance(server, threading.Thread)
+    monitor.join(10)
+    server.join(10)
+    assert not monitor.is_alive() and not server.is_alive()
+
+
+def test_timeline_ring_buffer(tmp_path: pathlib.Path) -> None:
+    """Test that timelines keep only the newest samples, padded to full width."""
+    path = tmp_path / "spam.py"
+    path.write_text("def f(x):\n    return x + x\n\nfor _ in range(100):\n    f(1)\n")
+    sampler = timeline.Timeline(tmp_path / "timeline.json", interval=60, capacity=2)
+    with sampler.sampling([path]):
+        sampler.sample([path])
+        specialist.analyze_file(path, targets=[])
+        sampler.sample([path])
+    assert (len(sampler), sampler.dropped) == (2, 1)
+    exported = json.loads(sampler.path.read_text())
+    assert exported == sampler.as_dict()
+    assert [code["qualname"] for code in exported["code"]] == ["<module>", "f"]
+    assert all(len(counts) == 6 for counts in exported["counts"])
+    assert exported["times"] == sorted(exported["times"])
+    with pytest.raises(ValueError):
+        timeline.Timeline(sampler.path, capacity=0)
+
+
+def test_timeline_identical_targets(tmp_path: pathlib.Path) -> None:
+    """Test that identical code from different targets gets its own column."""
+    paths = [tmp_path / "a" / "__init__.py", tmp_path / "b" / "__init__.py"]
+    codes = []
+    for path in paths:
+        path.parent.mkdir()
+        path.write_text("")
+        codes.append(compile("", str(path), "exec"))
+        utils.register_code(codes[-1])
+    assert codes[0] == codes[1]
+    sampler = timeline.Timeline(tmp_path / "timeline.json")
+    try:
+        sampler.sample(paths)
+    finally:
+        for code in codes:
+            specialist.CODE.discard(code)
+    assert [code["path"] for code in sampler.as_dict()["code"]] == list(map(str, paths))
+
+
+def test_fingerprint_ignores_caches() -> None:
+    """Test that fingerprints only change when the opcodes themselves do."""
+    objects = [type(f"C{i}", (), {"x": i})() for i in range(8)]
+
+    def f(objects: typing.List[typing.Any]) -> int:
+        total = 0
+        for o in objects:
+            # Megamorphic, so its counter changes on every call:
+            total += o.x
+        return total
+
+    for _ in range(100):
+        f(objects)
+    fingerprint = instructions.Fingerprint(f.__code__)
+    adaptive = set()
+    fingerprints = set()
+    for _ in range(10):
+        f(objects)
+        adaptive.add(f.__code__._co_code_adaptive)  # type: ignore # attr is defined
+        fingerprints.add(fingerprint())
+    assert len(adaptive) > 1 and len(fingerprints) == 1
+
+
+def test_analyzer_churn(tmp_path: pathlib.Path) -> None:
+    """Test that switching specializations between updates counts as churn."""
+    path = tmp_path / "churn.py"
+    path.write_text(
+        "class A:\n    def __init__(self):\n        self.x = 1\n\n"
+        "class B:\n    __slots__ = ('x',)\n    def __init__(self):\n        self.x = 1\n\n"
+        "def f(o):\n    return o.x\n"
+    )
+    code = compile(path.read_text(), str(path), "exec")
+    namespace: typing.Dict[str, typing.Any] = {}
+    exec(code, namespace)
+    utils.register_code(code)
+    f, a, b = namespace["f"], namespace["A"](), namespace["B"]()
+    try:
+        analyzer = analysis.Analyzer()
+        for objects in [[a] * 100, [b] * 1000, [a] * 1000]:
+            for o in objects:
+                f(o)
+            assert analyzer.update(path)
+        churned = {source: stats.churn for source, stats in analyzer.results(path)}
+        # Only o.x (which switched from A's specialization to B's, and back):
+        assert {source for source, churn in churned.items() if churn} == {"o", ".x"}
+        assert churned[".x"] == 2
+        # One-off analysis can't see any churn:
+        assert not any(stats.churn for _, stats in core._read(path))
+        html = writers.HTMLWriter(blue=False, dark=False)
+        json_writer = writers.JSONWriter()
+        for source, stats in analyzer.results(path):
+            html.add(source, stats)
+            json_writer.add(source, stats)
+        assert re.search(r"<span class='[^']*churn'>o?\.x</span>", html.emit())
+        data = json.loads(json_writer.emit())["data"]
+        assert [chunk["stats"].get("churn") for chunk in data].count(2) == 2
+    finally:
+        specialist.CODE.discard(code)
+
+
+def test_import_is_lazy() -> None:
+    """Test that importing specialist doesn't import what it doesn't need yet."""
+    heavy = [
+        "specialist.core",
+        "specialist.watch.monitor",
+        "specialist.writers",
+        "http.server",
+        "msgpack",
+        "runpy",
+        "tempfile",
+    ]
+    script = f"import specialist, sys; print([m for m in {heavy} if m in sys.modules])"
+    root = pathlib.Path(specialist.__file__).parent.parent
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        check=True,
+        cwd=root,
+        text=True,
+    ).stdout
+    assert output.strip() == "[]"
+    assert specialist.watch is core.watch
+    assert specialist.analyze_families is families.analyze_families
+
+
+def test_capture_scopes(tmp_path: pathlib.Path) -> None:
+    """Test that only matching code is captured, and only while capturing."""
+    spam, eggs = tmp_path / "spam.py", tmp_path / "eggs.py"
+    capture = utils.Capture([str(tmp_path / "s*.py")])
+    assert capture.matches(str(spam)) and not capture.matches(str(eggs))
+    assert utils.Capture().matches(str(eggs))
+    assert not utils.Capture([]).matches(str(spam))
+    # (Code objects compare equal regardless of their filenames.)
+    codes = [
+        compile(f"x = {i}", str(path), "exec")
+        for i, path in enumerate([spam, eggs, spam, eggs])
+    ]
+    try:
+        with capture:
+            with utils.Capture(paths=[str(eggs)]):
+                exec(codes[0], {})
+                exec(codes[1], {})
+            exec(codes[3], {})
+        # Nothing is captured once every Capture has stopped:
+        exec(codes[2], {})
+        assert [code in specialist.CODE for code in codes] == [True, True, False, False]
+        assert not utils._CAPTURES
+    finally:
+        for code in codes:
+            specialist.CODE.discard(code)
+
+
+def test_capture_literal_paths(tmp_path: pathlib.Path) -> None:
+    """Test that captured paths only ever match themselves, even with globs in them."""
+    bracketed, star, s = [tmp_path / name for name in ["[s].py", "*.py", "s.py"]]
+    assert utils.Capture(paths=[str(bracketed)]).matches(str(bracketed))
+    assert not utils.Capture(paths=[str(bracketed)]).matches(str(s))
+    assert utils.Capture(paths=[str(star)]).matches(str(star))
+    assert not utils.Capture(paths=[str(star)]).matches(str(s))
+    assert not utils.Capture(paths=[]).matches(str(s))
+    # Patterns are still globs, though:
+    assert utils.Capture([str(bracketed)], paths=[]).matches(str(s))
+
+
+def test_timeline_reloads(tmp_path: pathlib.Path) -> None:
+    """Test that timelines drop replaced code, so reloading doesn't grow them."""
+    path = tmp_path / "reloaded.py"
+    path.write_text("def f():\n    pass\n")
+    sampler = timeline.Timeline(tmp_path / "timeline.json", capacity=2)
+    old = compile(path.read_text(), str(path), "exec")
+    utils.register_code(old)
+    try:
+        sampler.sample([path])
+        reference = weakref.ref(old)
+        for _ in range(10):
+            # Like reloading the module:
+            new = compile(path.read_text(), str(path), "exec")
+            utils.register_code(new)
+            sampler.sample([path])
+            sampler.sample([path])
+    finally:
+        specialist.CODE.discard(new)
+    del old
+    assert reference() is None
+    assert len(sampler._columns) == 2 and len(sampler._labels) <= 4
+    exported = sampler.as_dict()
+    assert [code["qualname"] for code in exported["code"]] == ["<module>", "f"]
+    assert all(len(counts) == 6 for counts in exported["counts"])
+
+
+def test_code_registry(tmp_path: pathlib.Path) -> None:
+    """Test that registries keep the newest code for each file, within a limit."""
+    registry = CodeRegistry(limit=2)
+    paths = [tmp_path / f"{name}.py" for name in ["spam", "eggs", "ham"]]
+    for path in paths:
+        path.write_text("x = 1\n")
+    old, new, eggs, ham = [
+        compile("x = 1\n", str(path), "exec") for path in paths[:1] + paths
+    ]
+    registry.add(old)
+    registry.add(new)
+    # Like a reloaded module:
+    assert registry.get(paths[0]) is new and old not in registry
+    registry.add(eggs)
+    assert registry.get(paths[0]) is new
+    # Spam was just used, so eggs is evicted:
+    registry.add(ham)
+    assert [registry.get(path) for path in paths] == [new, None, ham]
+    string = compile("x = 1\n", "<string>", "exec")
+    registry.add(string)
+    assert set(registry) == {new, ham, string}
+    stats = registry.stats()
+    assert (stats.files, stats.other, stats.evicted) == (2, 1, 1) and stats.size
+    # Code that isn't for a file is only held weakly:
+    del string
+    assert len(registry) == 2
+    with pytest.raises(ValueError):
+        registry.limit = 0
+
+
+def test_code_registry_pinned(tmp_path: pathlib.Path) -> None:
+    """Test that pinned files are never evicted, even past the limit."""
+    registry = CodeRegistry(limit=1)
+    paths = [tmp_path / f"{name}.py" for name in ["spam", "eggs", "ham"]]
+    codes = []
+    for path in paths:
+        path.write_text("x = 1\n")
+        codes.append(compile("x = 1\n", str(path), "exec"))
+    registry.pin(paths[0])
+    registry.pin(paths[1])
+    for code in codes:
+        registry.add(code)
+    assert [registry.get(path) for path in paths] == [*codes[:2], None]
+    registry.unpin(paths[1])
+    assert [registry.get(path) for path in paths] == [codes[0], None, None]
+
+
+def test_watch_code_limit(tmp_path: pathlib.Path) -> None:
+    """Test that watched targets survive a limit lower than their number."""
+    paths = [tmp_path / f"{name}.py" for name in ["spam", "eggs", "ham"]]
+    codes = []
+    for path in paths:
+        path.write_text("x = 1\n")
+        codes.append(compile("x = 1\n", str(path), "exec"))
+    # Targets without code are skipped until they have some:
+    assert not analysis.Analyzer().update(paths[0])
+    monitor = WatchMonitor(paths, port=_free_port(), interval=0.01)
+    specialist.CODE.limit = 2
+    try:
+        monitor.start()
+        for code in codes:
+            utils.register_code(code)
+        deadline = time.monotonic() + 10
+        while monitor.overhead.ticks < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert monitor.is_alive() and monitor.overhead.ticks >= 5
+        assert [utils.get_code_for_path(path) for path in paths] == codes
+    finally:
+        monitor.close()
+        specialist.CODE.limit = None
+        for code in codes:
+            specialist.CODE.discard(code)
+    monitor.join(10)
+    assert not monitor.is_alive()
+
+
+def test_analyze_code_in_memory(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that code is analyzed without files, under a valid report name."""
+    monkeypatch.setattr(pathlib.Path, "open", None)
+    source = "def f(x):\n    return x + 1\n\nfor i in range(100):\n    f(i)\n"
+    main = sys.modules["__main__"]
+    [(path, results)] = core.analyze_code(source, targets=[]).items()
+    assert path == pathlib.Path("__main__.py")
+    assert "".join(chunk for chunk, _ in results) == source
+    assert any(stats.specialized for _, stats in results)
+    with pytest.raises(ValueError) as info:
+        core.analyze_code("x = 1\nraise ValueError(x)\n", targets=[])
+    filename = info.traceback[-1].frame.code.raw.co_filename
+    assert re.fullmatch(r"<specialist-\d+>", filename)
+    # The source is only kept around while the code runs, even if it fails:
+    assert filename not in linecache.cache
+    assert sys.modules["__main__"] is main
+
+
+def test_analyze_code_spawn(capfd: pytest.CaptureFixture[str]) -> None:
+    """Test that code can start processes that re-run __main__ by spawning them."""
+    source = """\
+import multiprocessing
+
+def double(x):
+    return x * 2
+
+if __name__ == "__main__":
+    with multiprocessing.get_context("spawn").Pool(2) as pool:
+        print(pool.map(double, range(4)))
+"""
+    [(_, results)] = core.analyze_code(source, targets=[]).items()
+    assert "".join(chunk for chunk, _ in results) == source
+    assert capfd.readouterr().out == "[0, 2, 4, 6]\n"
+
+
+def _profiled(x: float) -> float:
+    y = x.real
+    return y * 2.0
+
+
+def _unstable(n: int) -> float:
+    # Adding a float to the int 0 deoptimizes the addition on every call:
+    total = 0
+    for i in range(n):
+        total += i * 0.5
+    return total
+
+
+def test_profile() -> None:
+    """Test that profiling warms code up, then times it and analyzes it."""
+    result = specialist.profile(_profiled, (1.5,), iterations=10)
+    assert result.stable and result.warmup < 1000
+    assert result.timing.iterations == 10
+    assert result.timing.best <= result.timing.median <= result.timing.worst
+    source = "".join(chunk for chunk, _ in result.results)
+    assert source.startswith("def _profiled(") and source.endswith("* 2.0\n")
+    assert result.totals.specialized
+    unstable = specialist.profile(_unstable, (10,), iterations=1, warmup=200)
+    assert (unstable.stable, unstable.warmup) == (False, 200)
+    with pytest.raises(TypeError):
+        specialist.profile(len, ([],))
+
+
+def test_diff(tmp_path: pathlib.Path) -> None:
+    """Test that chunks (and functions) are aligned across moved lines."""
+    baseline = [
+        ("def ", Stats()),
+        ("f", Stats()),
+        ("():\n    return ", Stats()),
+        ("x", Stats(adaptive=1)),
+        ("\n", Stats()),
+        ("y", Stats(specialized=1)),
+        (" = 1\n", Stats()),
+    ]
+    candidate = [
+        ("y", Stats(specialized=1)),
+        (" = 1\nimport z\n", Stats()),
+        ("def ", Stats()),
+        ("f", Stats()),
+        ("():\n    return ", Stats()),
+        ("x", Stats(adaptive=2)),
+        ("\n", Stats()),
+    ]
+    for run, chunks, writer in [
+        ("baseline", baseline, writers.JSONWriter()),
+        ("candidate", candidate, binary.BinaryWriter()),
+    ]:
+        (tmp_path / run / "pkg").mkdir(parents=True)
+        path = tmp_path / run / "pkg" / f"mod.{writer.EXTENSION}"
+        with path.open("wb" if writer.BINARY else "w") as file:
+            writer.write(chunks, file)
+    comparison = specialist.diff(
+        tmp_path / "baseline", tmp_path / "candidate", out_dir=tmp_path / "diff"
+    )
+    assert comparison.files == 1 and comparison.delta == Stats(adaptive=1)
+    (changed,) = comparison.changed()
+    assert [(c["source"], c["lineno"], c["status"]) for c in changed["chunks"]] == [
+        ("x", 4, "changed")
+    ]
+    assert [(f["name"], f["lineno"]) for f in changed["functions"]] == [("f", 3)]
+    page = (tmp_path / "diff" / "pkg" / "mod.html").read_text()
+    assert "<span class='worse' title='+0 specialized, +1 adaptive" in page
+    assert json.loads((tmp_path / "diff" / "diff.json").read_text())["files"] == 1
+
+
+def test_diff_reserved_names(tmp_path: pathlib.Path) -> None:
+    """Test that reports named like an index or a diff are still compared."""
+    run = tmp_path / "run"
+    run.mkdir()
+    for name in ["a", "index", "diff"]:
+        with (run / f"{name}.json").open("w") as file:
+            writers.JSONWriter().write([("x = 1\n", Stats(adaptive=1))], file)
+    assert specialist.diff(run, run).files == 3
+    with pytest.raises(ValueError):
+        specialist.diff(run, run, out_dir=tmp_path / "diff")
+    # Actual indexes (and diffs) aren't reports, though:
+    (run / "diff.json").unlink()
+    with (run / "index.json").open("w") as file:
+        summary.Index().write_json(file)
+    comparison = specialist.diff(run, run, out_dir=tmp_path / "diff")
+    assert comparison.files == 1
+    comparison.write(run)
+    assert specialist.diff(run, run).files == 1
+
+
+def test_results_cache(tmp_path: pathlib.Path) -> None:
+    """Test that cached results round-trip, until their source changes."""
+    path = tmp_path / "cached.py"
+    path.write_text("x = '\u00e9'\nfor _ in range(100):\n    x += 'x'\n")
+    code = compile(path.read_text(), str(path), "exec")
+    exec(code, {})
+    chunks = list(core._split(path.read_bytes(), core._parse(code)))
+    results = cache.ResultsCache(tmp_path / "cache")
+    assert results.load(path) is None
+    assert list(results.record(path, chunks)) == chunks
+    assert list(results.record(tmp_path / "missing.py", chunks)) == chunks
+    loaded = results.load(path)
+    assert loaded is not None and list(loaded) == chunks
+    assert results.paths() == [path]
+    other = cache.ResultsCache(tmp_path / "cache", python_version="other")
+    assert other.load(path) is None and results.paths() == [path]
+    path.write_text(path.read_text() + "y = 1\n")
+    assert results.load(path) is None and results.paths() == []